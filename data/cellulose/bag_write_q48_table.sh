@@ -0,0 +1 @@
+python ../../pybiosas/cli.py -c write -s ../../pybiosas/modelling.py -d q48.txt -m ellipticalCylinder -o output_q48_2/ -b bagout_q48_table.sh --table --tasks-per-line 50
@@ -0,0 +1 @@
+python ../../pybiosas/benchmark.py decimation -b bagout.sh -n 12 --multires 50,200
@@ -0,0 +1 @@
+python ../../pybiosas/benchmark.py optimizers -b bagout.sh -n 12 | tee benchmark_optimizers.txt
@@ -0,0 +1 @@
+python ../../pybiosas/chi2map.py -m ellipticalCylinder -d q48.txt -p q48_best.json -g '{"r_minor" : [10, 25, 200], "length" : [300, 1500, 200]}' -o chi2map_q48/r_minor_length
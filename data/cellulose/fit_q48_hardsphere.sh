@@ -0,0 +1 @@
+python ../../pybiosas/modelling.py fit -m 'ellipticalCylinder*hardsphere' -d q48.txt -p q48_hardsphere.json -o output_q48_hardsphere/fit.json
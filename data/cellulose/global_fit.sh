@@ -0,0 +1 @@
+python ../../pybiosas/globalfit.py -s global_spec.json -o output_global/globalfit.json
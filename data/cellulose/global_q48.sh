@@ -0,0 +1,2 @@
+python ../../pybiosas/modelling.py fit -m ellipticalCylinder -d q48.txt -p '[{"paramname": "r_minor", "value": 20.0}, {"paramname": "r_ratio", "value": 2.0}, {"paramname": "length", "value": 400.0}, {"paramname": "scale", "value": 0.001}, {"paramname": "background", "value": 0.001}, {"paramname": "sldCyl", "value": 1e-06, "fixed": true}, {"paramname": "sldSolv", "value": 6e-06, "fixed": true}]' -g de -o output_q48_global/de.json
+python ../../pybiosas/modelling.py fit -m ellipticalCylinder -d q48.txt -p '[{"paramname": "r_minor", "value": 20.0}, {"paramname": "r_ratio", "value": 2.0}, {"paramname": "length", "value": 400.0}, {"paramname": "scale", "value": 0.001}, {"paramname": "background", "value": 0.001}, {"paramname": "sldCyl", "value": 1e-06, "fixed": true}, {"paramname": "sldSolv", "value": 6e-06, "fixed": true}]' -g basinhopping -o output_q48_global/basinhopping.json
@@ -0,0 +1 @@
+python ../../pybiosas/sampler.py -m ellipticalCylinder -d q48.txt -p q48_best.json -w 32 -n 4000 --noise-scale 0.00018 -o mcmc_q48/
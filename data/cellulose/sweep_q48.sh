@@ -0,0 +1,2 @@
+python ../../pybiosas/sweep.py run --table bagout_q48_table.tasks -j 8 --min-seconds 2
+python ../../pybiosas/sweep.py report --costs bagout_q48_table.tasks.costs -j 8
@@ -0,0 +1,223 @@
+# Benchmarks for the fitting machinery in pybiosas
+#
+# The benchmarks re-use the bags of tasks in the data directories so that
+# the timings are for the real starting points used in those sweeps. Run
+# from the relevant data directory as the bags use relative paths, e.g.
+#
+#     python ../../pybiosas/benchmark.py optimizers -b bagout.sh -n 12
+#     python ../../pybiosas/benchmark.py decimation -b bagout.sh -n 12 \
+#                                        --multires 50,200
+#
+# The threads benchmark needs no bag; it times the evaluation of one
+# registered model over a long q array split across 1 to N threads:
+#
+#     python benchmark.py threads -m sphere --nq 1000000 --threads 8
+
+import optparse
+import multiprocessing
+import re
+import time
+import numpy as np
+try:
+    import pybiosas.modelling as modelling
+    import pybiosas.optimizers as optimizers
+    import pybiosas.models as models
+    import pybiosas.tasktable as tasktable
+except ImportError:
+    import modelling
+    import optimizers
+    import models
+    import tasktable
+
+
+def read_bag(bagpath, ntasks=None):
+    """Read the tasks from a bag of tasks file written by cli.py
+
+    Returns a list of argument dictionaries suitable for passing to a
+    ModelWrapper. Only the first ntasks are returned if ntasks is set.
+    Bags that run tasks from a task table (cli.py --table) are read
+    from the table.
+    """
+
+    model_rg = re.compile(r"-m\s+'?([^'\s]+)")
+    dataset_rg = re.compile(r"-d\s+(\S+)")
+    params_rg = re.compile(r"-p\s+'([^']*)'")
+    table_rg = re.compile(r"--table\s+(\S+)\s+--tasks\s+(\S+)")
+    tables = {}
+
+    tasks = []
+    f = open(bagpath, 'r')
+    for line in f:
+        if not line.strip():
+            continue
+        table = table_rg.search(line)
+        if table:
+            path, selection = table.groups()
+            if path not in tables:
+                tables[path] = tasktable.read_table(path)
+            header, values = tables[path]
+            for index in tasktable.parse_range(selection, header['ntasks']):
+                args = tasktable.task_args(header, values, index)
+                args['outpath'] = None
+                tasks.append(args)
+        else:
+            tasks.append({'command'    : 'fit',
+                          'model'      : model_rg.search(line).group(1),
+                          'dataset'    : dataset_rg.search(line).group(1),
+                          'parameters' : params_rg.search(line).group(1),
+                          'outpath'    : None})
+        if ntasks and len(tasks) >= ntasks:
+            break
+    f.close()
+
+    return tasks[:ntasks]
+
+
+def run_task(args):
+    """Run a single fit
+
+    Returns (chi2, nfev, seconds, success, point evaluations)
+    """
+
+    start = time.time()
+    wrapper = modelling.ModelWrapper(dict(args))
+    wrapper.execute()
+    elapsed = time.time() - start
+    return (wrapper.chisqr, wrapper.nfev, elapsed, wrapper.fitsuccess,
+            wrapper.point_evaluations)
+
+
+def benchmark_optimizers(tasks, names):
+    """Fit every task with every optimizer and tabulate the cost
+
+    For each optimizer the table reports the median and total number of
+    evaluations of the residual function (including those used for
+    finite difference Jacobians), the total wall time, the number of
+    fits that reported success and the best chi2 reached over the set.
+    """
+
+    print "%-10s %8s %10s %10s %8s %14s" % ('optimizer', 'median',
+                                            'total_nfev', 'seconds',
+                                            'success', 'best_chi2')
+    for name in names:
+        results = []
+        for task in tasks:
+            args = dict(task)
+            args['optimizer'] = name
+            results.append(run_task(args))
+
+        nfevs = sorted([r[1] for r in results])
+        median = nfevs[len(nfevs) // 2]
+        total = sum(nfevs)
+        seconds = sum([r[2] for r in results])
+        successes = len([r for r in results if r[3]])
+        best = min([r[0] for r in results])
+        print "%-10s %8d %10d %10.2f %8d %14.6g" % (name, median, total,
+                                                     seconds, successes, best)
+
+
+def benchmark_decimation(tasks, multires):
+    """Compare full resolution fits with coarse-to-fine fits
+
+    The cost of a fit is the total number of q points the model was
+    evaluated at, summed over all the stages of a multiresolution fit,
+    as well as the wall time.
+    """
+
+    print "%-16s %14s %10s %10s %8s %14s" % ('mode', 'point_evals',
+                                             'nfev', 'seconds', 'success',
+                                             'best_chi2')
+    for label, levels in [('full', []), ('multires ' + multires,
+                                         [int(n) for n in multires.split(',')])]:
+        results = []
+        for task in tasks:
+            args = dict(task)
+            args['multires'] = levels
+            results.append(run_task(args))
+
+        print "%-16s %14d %10d %10.2f %8d %14.6g" % (label,
+                                        sum([r[4] for r in results]),
+                                        sum([r[1] for r in results]),
+                                        sum([r[2] for r in results]),
+                                        len([r for r in results if r[3]]),
+                                        min([r[0] for r in results]))
+
+
+def benchmark_threads(model, nq, max_threads, repeats=5):
+    """Time model evaluation over nq points split across 1 to max_threads
+
+    The model is set to the registry's 'exp_vals' and evaluated over a
+    log spaced q array. The best of repeats timings is reported for each
+    thread count, with the speed up over a single thread and the largest
+    difference from the single threaded curve, which should be zero.
+    """
+
+    model_func = modelling.load_model(model)
+    modelling.complete_parameters(model_func, [dict(par) for par in
+                                               models.models[model]['exp_vals']])
+    q = np.logspace(-3, 0, nq)
+    previous = modelling.evaluation_threads
+
+    print "%-8s %8s %10s %10s %12s" % ('threads', 'chunks', 'seconds',
+                                       'speedup', 'max_diff')
+    reference = None
+    try:
+        for threads in range(1, max_threads + 1):
+            modelling.set_evaluation_threads(threads)
+            timings = []
+            for j in range(repeats):
+                start = time.time()
+                curve = modelling.evaluate_model(model_func, q)
+                timings.append(time.time() - start)
+            if reference is None:
+                reference = (np.asarray(curve), min(timings))
+            print "%-8d %8d %10.4f %10.2f %12.3g" % (threads,
+                                        len(modelling.chunk_bounds(nq)),
+                                        min(timings),
+                                        reference[1] / min(timings),
+                                        np.max(np.abs(curve - reference[0])))
+    finally:
+        modelling.set_evaluation_threads(previous)
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser(usage = "%prog optimizers|decimation|threads [options]")
+    parser.add_option('-b', '--bagpath', type = str, dest = 'bagpath',
+                      help = "Bag of tasks to take the starting points from")
+    parser.add_option('-n', '--ntasks', type = int, dest = 'ntasks',
+                      default = None,
+                      help = "Only run the first n tasks from the bag")
+    parser.add_option('-f', '--optimizers', type = str, dest = 'optimizers',
+                      default = ','.join(sorted(optimizers.optimizers.keys())),
+                      help = "Comma separated list of optimizers to compare")
+
+    parser.add_option('--multires', type = str, dest = 'multires',
+                      default = '50,200',
+                      help = "Bin counts for the coarse stages of the decimation benchmark")
+
+    parser.add_option('-m', '--model', type = str, dest = 'model',
+                      default = 'sphere',
+                      help = "Model to time in the threads benchmark")
+    parser.add_option('--nq', type = int, dest = 'nq', default = 1000000,
+                      help = "Number of q points for the threads benchmark")
+    parser.add_option('--threads', type = int, dest = 'threads',
+                      default = multiprocessing.cpu_count(),
+                      help = "Largest number of threads to time")
+    parser.add_option('--repeats', type = int, dest = 'repeats', default = 5,
+                      help = "Timings taken for each number of threads")
+
+    (options, args) = parser.parse_args()
+    if not args:
+        parser.error("A benchmark to run is required")
+
+    if args[0] == 'optimizers':
+        tasks = read_bag(options.bagpath, options.ntasks)
+        benchmark_optimizers(tasks, options.optimizers.split(','))
+    elif args[0] == 'decimation':
+        tasks = read_bag(options.bagpath, options.ntasks)
+        benchmark_decimation(tasks, options.multires)
+    elif args[0] == 'threads':
+        benchmark_threads(options.model, options.nq, options.threads,
+                          options.repeats)
+    else:
+        parser.error("Unknown benchmark: " + args[0])
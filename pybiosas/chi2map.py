@@ -0,0 +1,150 @@
+# PyBioSas.chi2map: chi squared surfaces over slices of parameter space
+#
+# Public Domain Waiver:
+# To the extent possible under law, Cameron Neylon has waived all
+# copyright and related or neighboring rights to chi2map.py
+# This work is published from United Kingdom.
+#
+# See http://creativecommons.org/publicdomain/zero/1.0/
+#
+# Evaluates chi2 for a model against a dataset at every point of a grid
+# over two (or more) parameters, with all the other parameters held at
+# the values given, without any optimisation. The grid is split into
+# chunks of flat indices that are evaluated across a ModelPool and
+# written straight into a memory mapped array, so the map does not have
+# to fit in memory.
+#
+# Usage from the command line:
+#
+#     python chi2map.py -m ellipticalCylinder -d q48.txt -p q48_best.json \
+#            -g '{"r_minor" : [10, 25, 200], "length" : [300, 1500, 200]}' \
+#            -o chi2map_q48
+#
+# writes chi2map_q48.npy, an array with one axis per grid parameter in
+# the order given in the json metadata file chi2map_q48.json.
+
+import optparse
+import json
+import os
+import os.path
+import time
+import numpy as np
+try:
+    import pybiosas.modelling as modelling
+    import pybiosas.parallel as parallel
+    import pybiosas.library as library
+except ImportError:
+    import modelling
+    import parallel
+    import library
+
+
+def _chi2_chunk(state, item):
+    """chi2 for the grid points with flat indices start to stop"""
+
+    start, stop = item
+    parallel.reset_parameters(state)
+    index = np.unravel_index(np.arange(start, stop), state['shape'])
+    values = np.column_stack([axis[j] for axis, j in zip(state['axes'], index)])
+    curves = modelling.evaluate_batch(state['model_func'], state['names'],
+                                      values, state['q'])
+    res = (state['i'] - curves) / state['sigma']
+    return start, np.sum(res * res, axis=1)
+
+
+def chi2_map(model, data, parameters, grid, path, weighting='auto',
+             processes=None, chunk=1000):
+    """Compute a chi2 surface and write it to path.npy with path.json
+
+    grid is a dictionary of parameter name to [first, last, npoints] or
+    [first, last, npoints, 'log'], or an ordered list of (name, spec)
+    pairs to control the axis order. Returns the memory mapped map.
+    """
+
+    if isinstance(grid, dict):
+        grid = sorted(grid.items())
+    names = [name for name, spec in grid]
+    axes = [library.grid_values(spec) for name, spec in grid]
+    shape = tuple([len(axis) for axis in axes])
+    npoints = int(np.prod(shape))
+
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    surface = np.lib.format.open_memmap(path + '.npy', mode='w+', dtype=float,
+                                        shape=shape)
+    flat = surface.reshape(-1)
+
+    start_time = time.time()
+    pool = parallel.ModelPool(model, parameters,
+                              shared = {'q'     : data.q,
+                                        'i'     : data.i,
+                                        'sigma' : data.sigma(weighting),
+                                        'names' : names,
+                                        'axes'  : axes,
+                                        'shape' : shape},
+                              processes = processes)
+    try:
+        chunks = [(start, min(start + chunk, npoints))
+                  for start in range(0, npoints, chunk)]
+        for start, chi2 in pool.imap_unordered(_chi2_chunk, chunks):
+            flat[start:start + len(chi2)] = chi2
+    finally:
+        pool.close()
+    surface.flush()
+    elapsed = time.time() - start_time
+
+    best = np.unravel_index(np.argmin(flat), shape)
+    f = open(path + '.json', 'w')
+    json.dump({'model'      : model,
+               'names'      : names,
+               'axes'       : [axis.tolist() for axis in axes],
+               'parameters' : parameters,
+               'weighting'  : weighting,
+               'npoints'    : len(data),
+               'seconds'    : elapsed,
+               'minimum'    : {'chi2'  : float(surface[best]),
+                               'index' : [int(j) for j in best],
+                               'values': dict([(name, float(axis[j])) for
+                                               name, axis, j in
+                                               zip(names, axes, best)])}}, f)
+    f.close()
+
+    return surface
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser()
+    parser.add_option('-m', '--model', type = str, dest = 'model',
+                      help = "The model to evaluate")
+    parser.add_option('-d', '--dataset', type = str, dest = 'dataset',
+                      help = "The dataset to compare against")
+    parser.add_option('-p', '--parameters', type = str, dest = 'parameters',
+                      help = """Values for the parameters held fixed, as a json
+                      file or string as for modelling.py""")
+    parser.add_option('-g', '--grid', type = str, dest = 'grid',
+                      help = """Json dictionary of parameter name to
+                      [first, last, npoints] with an optional fourth
+                      entry 'log' for logarithmic spacing""")
+    parser.add_option('-w', '--weighting', type = str, dest = 'weighting',
+                      default = 'auto', help = "Weighting as for modelling.py")
+    parser.add_option('-j', '--processes', type = int, dest = 'processes',
+                      default = None, help = "Number of worker processes")
+    parser.add_option('--chunk', type = int, dest = 'chunk', default = 1000,
+                      help = "Grid points per task")
+    parser.add_option('-o', '--outpath', type = str, dest = 'outpath',
+                      default = 'chi2map', help = "Base path for the output")
+
+    (options, args) = parser.parse_args()
+    if os.path.isfile(options.parameters):
+        f = open(options.parameters, 'r')
+        parameters = json.load(f)
+        f.close()
+    else:
+        parameters = json.loads(options.parameters)
+
+    data = modelling.load_dataset(options.dataset)
+    surface = chi2_map(options.model, data, parameters,
+                       json.loads(options.grid), options.outpath,
+                       options.weighting, options.processes, options.chunk)
+    print "Map of shape", surface.shape, "minimum chi2", surface.min()
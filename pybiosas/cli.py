@@ -6,6 +6,7 @@
 import models
 REGISTERED_MODELS = models.models
 import cli_app_template
+import tasktable
 import optparse
 import itertools
 import copy
@@ -14,6 +15,11 @@ import os.path
 from string import Template
 import re
 
+# Fit set arguments passed straight through to modelling.py to mask the
+# dataset, in the order they are written to the bag
+MASK_ARGS = ['qmin', 'qmax', 'exclude', 'outliers']
+NUMERIC_MASK_ARGS = ['qmin', 'qmax', 'outliers']
+
 class CLIApp:
     """A class representing the command line interface"""
 
@@ -26,6 +32,10 @@ class CLIApp:
         self.outpath = None
         self.bagpath = None
         self.script = None
+        self.table = False
+        self.per_line = 1
+        self.lean = False
+        self.mask = {}
 
         self.process_args()
         print self.command, self.model, self.dataset
@@ -43,6 +53,12 @@ class CLIApp:
         self.outpath = temp.outpath
         self.bagpath = temp.bagpath
         self.script = temp.script
+        self.table = temp.table
+        self.per_line = temp.per_line
+        self.lean = temp.lean
+        for key in MASK_ARGS:
+            if getattr(temp, key) is not None:
+                self.mask[key] = getattr(temp, key)
 
     def __init_parser(self):
         """Command line parser for taking in optional arguments"""
@@ -95,6 +111,43 @@ class CLIApp:
                                  script in most cases as user will not be aware
                                  of where bag should go on the client VMs""")
 
+        self.parser.add_option('--qmin', type = str, dest = 'qmin',
+                                 default = None,
+                                 help = "Exclude data below this q from the fits")
+
+        self.parser.add_option('--qmax', type = str, dest = 'qmax',
+                                 default = None,
+                                 help = "Exclude data above this q from the fits")
+
+        self.parser.add_option('--exclude', type = str, dest = 'exclude',
+                                 default = None,
+                                 help = """Json list of [low, high] q ranges to
+                                 exclude from the fits""")
+
+        self.parser.add_option('--outliers', type = str, dest = 'outliers',
+                                 default = None,
+                                 help = """Exclude points further than this many
+                                 robust standard deviations from a running
+                                 median of the intensity""")
+
+        self.parser.add_option('--lean', action = 'store_true',
+                                 dest = 'lean', default = False,
+                                 help = """Only write the fitted parameters,
+                                 chi2, covariance and timings for each task.
+                                 Use process.py --top to regenerate the curves
+                                 of the best fits""")
+
+        self.parser.add_option('-t', '--table', action = 'store_true',
+                                 dest = 'table', default = False,
+                                 help = """Write the starting points to a
+                                 binary task table next to the bag, with the
+                                 bag only giving ranges of tasks to run.
+                                 Much smaller and quicker for large sweeps""")
+
+        self.parser.add_option('--tasks-per-line', type = int,
+                                 dest = 'per_line', default = 1,
+                                 help = """With --table, the number of tasks
+                                 run by each line of the bag""")
 
 
     def _init_fitset(self):
@@ -109,6 +162,10 @@ class CLIApp:
                                         self.model, self.dataset,
                                         self.outpath, self.bagpath,
                                         self.script)
+        for key, value in self.mask.iteritems():
+            self.fitset.set_arg(key, value)
+        if self.lean:
+            self.fitset.set_arg('lean', True)
         print self.fitset.args
 
     def main(self):
@@ -153,7 +210,10 @@ class CLIApp:
 
                 self.fitset.set_param(param['paramname'], value, fixed)
                 
-            self.fitset.write_bag()
+            if self.table:
+                self.fitset.write_task_table(per_line = self.per_line)
+            else:
+                self.fitset.write_bag()
             cont = raw_input('(Q)uit or (M)odify parameters?')
             if cont in ['Q', 'q', 'Quit', 'quit']:
                 rerun = False
@@ -347,7 +407,8 @@ class SingleModelFitSet:
         """
 
         assert (type(value) == str or type(value) == bool)
-        assert arg in ['command', 'model', 'dataset', 'outpath', 'bagpath', 'progpath']
+        assert arg in ['command', 'model', 'dataset', 'outpath', 'bagpath',
+                       'progpath', 'lean'] + MASK_ARGS
 
         self.args[arg] = value
 
@@ -470,21 +531,88 @@ class SingleModelFitSet:
         return args
 
 
+    def mask_options(self):
+        """Return the modelling.py options for the mask and lean output"""
+
+        options = ''
+        for arg in MASK_ARGS:
+            if self.get_arg(arg):
+                options += " --%s '%s'" % (arg, self.get_arg(arg))
+        if self.get_arg('lean'):
+            options += " --lean"
+        return options
+
     def write_bag(self):
-        """Write out a bag of tasks with all parameters set"""
+        """Write out a bag of tasks with all parameters set
+
+        The same mask options are added to every task so all the fits in
+        the set use the same points of the dataset.
+        The model name is quoted as composites such as sphere*hardsphere
+        would otherwise be expanded by the shell.
+        """
         
-        t = Template("""python ${progpath} fit -m ${model} -o ${outpath} -d ${dataset} -p '${params}'\n""")
+        t = Template("""python ${progpath} fit -m '${model}' -o ${outpath} -d ${dataset} -p '${params}'${options}\n""")
         
         self.validate_ready()
         tasks = self.enumerate_tasks()
+        options = self.mask_options()
         f = open(self.get_arg('bagpath'), 'w')
         for task in tasks:
             task['params'] = json.dumps(task['params'])
+            task['options'] = options
             command = t.substitute(task)
             f.write(command)
 
         f.close()
 
+    def write_task_table(self, tablepath=None, per_line=1):
+        """Write the tasks as a binary task table and a bag that runs it
+
+        The starting values of all the tasks are written to tablepath
+        (by default the bag path with the extension .tasks) with the
+        model, dataset, parameter names, fixed flags and mask options
+        stored once; see pybiosas.tasktable. Each line of the bag then
+        runs per_line tasks from the table with modelling.py task.
+        """
+
+        self.validate_ready()
+        bagpath = self.get_arg('bagpath')
+        if tablepath is None:
+            tablepath = os.path.splitext(bagpath)[0] + '.tasks'
+
+        options = {}
+        for arg in MASK_ARGS:
+            if self.get_arg(arg):
+                options[arg] = self.get_arg(arg)
+                if arg in NUMERIC_MASK_ARGS:
+                    options[arg] = float(options[arg])
+        if self.get_arg('lean'):
+            options['lean'] = True
+        values = [param['value'] for param in self.params]
+        ntasks = 1
+        for value in values:
+            ntasks *= len(value)
+        header = {'model'    : self.get_arg('model'),
+                  'dataset'  : self.get_arg('dataset'),
+                  'outpath'  : self.get_arg('outpath'),
+                  'progpath' : self.get_arg('progpath'),
+                  'names'    : [param['paramname'] for param in self.params],
+                  'fixed'    : [bool(param.get('fixed', False))
+                                for param in self.params],
+                  'options'  : options}
+        tasktable.write_table(tablepath, header, itertools.product(*values),
+                              ntasks)
+
+        t = Template("""python ${progpath} task --table ${table} --tasks ${start}:${stop}\n""")
+        f = open(bagpath, 'w')
+        for start in range(0, ntasks, per_line):
+            f.write(t.substitute({'progpath' : self.get_arg('progpath'),
+                                  'table'    : tablepath,
+                                  'start'    : start,
+                                  'stop'     : min(start + per_line, ntasks)}))
+        f.close()
+        return tablepath
+
     def validate_ready(self):
         try:
             assert type(self.get_arg('model')) == str
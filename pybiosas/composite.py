@@ -0,0 +1,154 @@
+# PyBioSas.composite: Models built as sums or products of registered
+# models
+#
+# Public Domain Waiver:
+# To the extent possible under law, Cameron Neylon has waived all
+# copyright and related or neighboring rights to composite.py
+# This work is published from United Kingdom.
+#
+# See http://creativecommons.org/publicdomain/zero/1.0/
+#
+# A CompositeModel wraps instances of SansView models and presents the
+# same interface as a single model (setParam, getParam, details,
+# orientation_params and evalDistribution), so it can be fitted through
+# ModelWrapper like any other. The parameters of each component are
+# namespaced with a prefix, e.g. 'sphere.radius', and the composite has
+# its own 'background' (and for products its own 'scale'). The
+# components' own backgrounds (and scales for a product) are held at
+# zero (one) and hidden, as they would be redundant.
+#
+# Each component's curve is kept from the last evaluation and only
+# recomputed when one of its parameters or the q values change, so a
+# fit only pays for the components whose parameters are being varied.
+# In particular a structure factor S(q) with fixed parameters is
+# computed once per fit, however many steps the fit takes.
+#
+# Composites are declared in pybiosas.models with the 'components' and
+# 'operator' keys; see composite_entry there.
+
+import numpy as np
+
+operators = {'sum'     : np.add,
+             'product' : np.multiply}
+
+
+def hidden_params(operator):
+    """The component parameters held fixed by a composite and their values"""
+
+    if operator == 'product':
+        return {'scale' : 1.0, 'background' : 0.0}
+    return {'background' : 0.0}
+
+
+def own_params(operator):
+    """The parameters of the composite itself and their default values"""
+
+    if operator == 'product':
+        return {'scale' : 1.0, 'background' : 0.0}
+    return {'background' : 0.0}
+
+
+class CompositeModel:
+    """A sum or product of model instances behaving as a single model
+
+    components is a list of (prefix, model) pairs and operator one of
+    the keys of composite.operators. The result is
+    scale * (c1 op c2 op ...) + background. fixed_params names the
+    parameters to hold fixed when they are not given for a fit (see
+    modelling.complete_parameters).
+
+    self.evaluations counts the evaluations of each component, so that
+    the saving from the curve cache can be checked.
+    """
+
+    def __init__(self, components, operator='sum', fixed_params=[]):
+        if operator not in operators:
+            raise ValueError, "Unknown operator: " + str(operator)
+        self.operator = operator
+        self.components = dict(components)
+        self.prefixes = [prefix for prefix, model in components]
+        self.params = own_params(operator)
+        self.fixed_params = list(fixed_params)
+
+        self.details = {'scale'      : ['', None, None],
+                        'background' : ['[1/cm]', None, None]}
+        for name in self.details.keys():
+            if name not in self.params:
+                del self.details[name]
+        self.orientation_params = []
+        hidden = hidden_params(operator)
+        for prefix, model in components:
+            for name, value in hidden.items():
+                if name in model.details:
+                    model.setParam(name, value)
+            for name, detail in model.details.items():
+                if name not in hidden:
+                    self.details[prefix + '.' + name] = detail
+            self.orientation_params += [prefix + '.' + name for name in
+                                        model.orientation_params]
+
+        # Curve cache: prefix to (version, q, curve). The version of a
+        # component is bumped whenever one of its parameters changes.
+        self._versions = dict([(prefix, 0) for prefix in self.prefixes])
+        self._cache = {}
+        self.evaluations = dict([(prefix, 0) for prefix in self.prefixes])
+
+    def _split(self, name):
+        """Return (component model, parameter name) for a namespaced name"""
+
+        prefix, dot, param = name.partition('.')
+        if not dot or prefix not in self.components:
+            raise ValueError, "Model does not contain parameter " + name
+        return self.components[prefix], prefix, param
+
+    def setParam(self, name, value):
+        if name in self.params:
+            self.params[name] = value
+            return
+        model, prefix, param = self._split(name)
+        if model.getParam(param) != value:
+            model.setParam(param, value)
+            self._versions[prefix] += 1
+
+    def getParam(self, name):
+        if name in self.params:
+            return self.params[name]
+        model, prefix, param = self._split(name)
+        return model.getParam(param)
+
+    def component_curve(self, prefix, q, evaluate=None):
+        """The curve for one component, from the cache if still valid
+
+        q is an array of q values or for 2-D the pair [qx, qy]. evaluate,
+        if given, is called as evaluate(model, q) in place of the
+        component's evalDistribution.
+        """
+
+        key = np.asarray(q, dtype=float)
+        version = self._versions[prefix]
+        cached = self._cache.get(prefix)
+        if (cached is not None and cached[0] == version and
+                cached[1].shape == key.shape and np.array_equal(cached[1], key)):
+            return cached[2]
+        if evaluate is None:
+            curve = self.components[prefix].evalDistribution(q)
+        else:
+            curve = evaluate(self.components[prefix], q)
+        curve = np.asarray(curve, dtype=float)
+        self.evaluations[prefix] += 1
+        self._cache[prefix] = (version, key.copy(), curve)
+        return curve
+
+    def evalDistribution(self, q, evaluate=None):
+        if isinstance(q, list):
+            q = [np.asarray(qi, dtype=float) for qi in q]
+        else:
+            q = np.asarray(q, dtype=float)
+        combine = operators[self.operator]
+        out = self.component_curve(self.prefixes[0], q, evaluate)
+        for prefix in self.prefixes[1:]:
+            out = combine(out, self.component_curve(prefix, q, evaluate))
+        return self.params.get('scale', 1.0) * out + self.params['background']
+
+    def clear_cache(self):
+        self._cache = {}
@@ -0,0 +1,125 @@
+# PyBioSas.curvecache: Keep model curves for parameter values seen before
+#
+# Public Domain Waiver:
+# To the extent possible under law, Cameron Neylon has waived all
+# copyright and related or neighboring rights to curvecache.py
+# This work is published from United Kingdom.
+#
+# See http://creativecommons.org/publicdomain/zero/1.0/
+#
+# Bootstrap refits, multistart fits and chi2 maps all evaluate a model
+# many times at parameter values that have been tried before: every
+# bootstrap refit begins from the same best fit values, multistarts
+# converge onto the same minimum and a profile revisits the grid. A
+# CurveCache keeps the last maxsize curves, keyed on
+#
+#   the model     its class name and the names of its parameters
+#   the values    every parameter value rounded to digits significant
+#                 figures, so that values differing only in the last bits
+#                 of a float are the same key, plus any dispersion
+#                 settings the model has
+#   the q grid    the shape and a sha1 digest of the q array
+#
+# and drops the least recently used curve when full. 12 digits is well
+# below the relative steps (about 1e-8) the optimizers take to estimate
+# derivatives, so those evaluations are never mistaken for each other.
+# Curves are returned read only as they are shared between callers.
+#
+# The cache is plugged into modelling.evaluate_model with
+# modelling.set_curve_cache, which the --cache option of modelling.py
+# calls.
+
+import collections
+import hashlib
+import threading
+import numpy as np
+
+
+def quantize(value, digits=12):
+    """value rounded to digits significant figures"""
+
+    try:
+        return float('%.*g' % (digits, value))
+    except TypeError:
+        return value
+
+
+def q_digest(q):
+    """A key for a q array from its shape and a digest of its values"""
+
+    q = np.ascontiguousarray(q, dtype=float)
+    return (q.shape, hashlib.sha1(q.tostring()).hexdigest())
+
+
+class CurveCache:
+    """A least recently used cache of up to maxsize model curves"""
+
+    def __init__(self, maxsize=256, digits=12):
+        self.maxsize = maxsize
+        self.digits = digits
+        self._curves = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        """Drop every curve and reset the statistics"""
+
+        with self._lock:
+            self._curves.clear()
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def model_key(self, model):
+        """The model and its quantized parameter values as a tuple"""
+
+        params = getattr(model, 'params', None)
+        if params is None:
+            params = dict([(name, model.getParam(name))
+                           for name in model.details])
+        values = tuple([(name, quantize(params[name], self.digits))
+                        for name in sorted(params)])
+        dispersion = getattr(model, 'dispersion', None) or {}
+        dispersion = tuple([(name, tuple(sorted(dispersion[name].items())))
+                            for name in sorted(dispersion)])
+        return (model.__class__.__name__, values, dispersion)
+
+    def evaluate(self, model, q, evaluate):
+        """The curve of model over q, calling evaluate(model, q) on a miss"""
+
+        key = (self.model_key(model), q_digest(q))
+        with self._lock:
+            curve = self._curves.get(key)
+            if curve is not None:
+                del self._curves[key]
+                self._curves[key] = curve
+                self.hits += 1
+                return curve
+            self.misses += 1
+
+        curve = np.array(evaluate(model, q), dtype=float)
+        curve.flags.writeable = False
+        with self._lock:
+            self._curves[key] = curve
+            while len(self._curves) > self.maxsize:
+                self._curves.popitem(last=False)
+                self.evictions += 1
+        return curve
+
+    def hit_rate(self):
+        """The fraction of evaluations answered from the cache"""
+
+        total = self.hits + self.misses
+        if total == 0:
+            return 0.0
+        return float(self.hits) / total
+
+    def stats(self):
+        """The size and hit statistics of the cache as a dictionary"""
+
+        return {'maxsize'   : self.maxsize,
+                'size'      : len(self._curves),
+                'hits'      : self.hits,
+                'misses'    : self.misses,
+                'evictions' : self.evictions,
+                'hit_rate'  : self.hit_rate()}
@@ -0,0 +1,249 @@
+# PyBioSas.fit2d: Fitting models to 2-D detector images
+#
+# Public Domain Waiver:
+# To the extent possible under law, Cameron Neylon has waived all
+# copyright and related or neighboring rights to fit2d.py
+# This work is published from United Kingdom.
+#
+# See http://creativecommons.org/publicdomain/zero/1.0/
+#
+# A 2-D dataset (sas_utils.SasData2D) is kept in a memory mapped .npy
+# file. The unmasked pixels are split into chunks which are evaluated
+# across a ModelPool; every worker opens the file itself, so only the
+# file path, the indices of the unmasked pixels and, for each call, the
+# current parameter values are sent to the workers. Each worker only
+# reads the pixels of the chunks it is given, so the memory used is
+# bounded by the chunk size rather than by the size of the image.
+#
+# Unlike 1-D fits the orientation parameters of the model (e.g.
+# cyl_theta, cyl_phi) are part of the fit.
+#
+# Usage from the command line:
+#
+#     python fit2d.py -m cylinder -d image.txt -p params.json \
+#            --qmin 0.005 --beamstop 0,0,0.004 -o fit2d/cylinder.json
+
+import optparse
+import copy
+import json
+import os
+import os.path
+import numpy as np
+try:
+    import pybiosas.sas_utils as sas_utils
+    import pybiosas.modelling as modelling
+    import pybiosas.optimizers as optimizers
+    import pybiosas.parallel as parallel
+except ImportError:
+    import sas_utils
+    import modelling
+    import optimizers
+    import parallel
+
+
+def _worker_data(state):
+    """The worker's own memory mapped copy of the dataset"""
+
+    if 'data' not in state:
+        state['data'] = sas_utils.load_2d_data(state['path'])
+        if 'floor' in state:
+            state['data']._floor[state['weighting']] = state['floor']
+    return state['data']
+
+
+def _set_values(state, values):
+    for name, value in zip(state['names'], values):
+        state['model_func'].setParam(name, value)
+
+
+def _image_residuals(state, item):
+    """Weighted residuals for the unmasked pixels used[start:stop]"""
+
+    start, stop, values = item
+    data = _worker_data(state)
+    _set_values(state, values)
+    index = state['used'][start:stop]
+    model_i = modelling.evaluate_model_2d(state['model_func'],
+                                          data.qx[index], data.qy[index])
+    return (data.i[index] - model_i) / data.sigma(state['weighting'], index)
+
+
+def _image_block(state, item):
+    """Model intensities for all the pixels from start to stop"""
+
+    start, stop, values = item
+    data = _worker_data(state)
+    _set_values(state, values)
+    return start, modelling.evaluate_model_2d(state['model_func'],
+                                              data.qx[start:stop],
+                                              data.qy[start:stop])
+
+
+class ImageResiduals:
+    """Callable returning the weighted residuals of a model over an image
+
+    parameters is a complete parameter list (orientation parameters
+    included) and the values passed on each call are those of its free
+    parameters, as for modelling.Residuals. The work is spread across
+    processes workers in chunks of chunk pixels. data must have been
+    loaded from a file with sas_utils.load_2d_data.
+    """
+
+    def __init__(self, model, parameters, data, weighting='auto',
+                 processes=None, chunk=100000):
+        if data.path is None:
+            raise ValueError, "2-D data must be loaded from a file to be fitted"
+        if weighting == 'auto':
+            weighting = data.auto_weighting()
+        self.names = [par['paramname'] for par in parameters
+                      if not par.get('fixed', False)]
+        self.chunk = chunk
+        self.npixels = len(data)
+        used = data.used()
+        shared = {'path'      : data.path,
+                  'used'      : used,
+                  'names'     : self.names,
+                  'weighting' : weighting}
+        if weighting != 'none':
+            shared['floor'] = data.sigma_floor(weighting)
+        self.pool = parallel.ModelPool(model, parameters, shared = shared,
+                                       processes = processes)
+        self.blocks = [(start, min(start + chunk, len(used)))
+                       for start in range(0, len(used), chunk)]
+
+    def __call__(self, values):
+        values = [float(value) for value in values]
+        return np.concatenate(self.pool.map(_image_residuals,
+                                            [(start, stop, values) for
+                                             start, stop in self.blocks]))
+
+    def chi2(self, values):
+        res = self(values)
+        return float(np.dot(res, res))
+
+    def image(self, values, path):
+        """Write the model intensity at every pixel to path.npy"""
+
+        values = [float(value) for value in values]
+        out = np.lib.format.open_memmap(path + '.npy', mode='w+', dtype=float,
+                                        shape=(self.npixels,))
+        blocks = [(start, min(start + self.chunk, self.npixels), values)
+                  for start in range(0, self.npixels, self.chunk)]
+        for start, block in self.pool.imap_unordered(_image_block, blocks):
+            out[start:start + len(block)] = block
+        out.flush()
+        return out
+
+    def close(self):
+        self.pool.close()
+
+
+def fit_image(model, parameters, data, weighting='auto', optimizer='leastsq',
+              processes=None, chunk=100000, image_path=None):
+    """Fit a model to the unmasked pixels of a 2-D dataset
+
+    Returns the completed parameter list, with the fitted values, and
+    the (values, cov_x, info, mesg, success, chi2) tuple as returned by
+    modelling.fit_parameters. If image_path is given the fitted model
+    image is written to image_path.npy.
+    """
+
+    model_func = modelling.load_model(model)
+    parameters = modelling.complete_parameters(model_func,
+                                               copy.deepcopy(parameters),
+                                               orientation = True)
+    free = [par for par in parameters if not par.get('fixed', False)]
+    bounds = []
+    x_scale = []
+    for par in free:
+        bound, scale = modelling.param_info(model, par)
+        bounds.append(bound)
+        x_scale.append(scale)
+
+    residuals = ImageResiduals(model, parameters, data, weighting, processes,
+                               chunk)
+    try:
+        (out, cov_x, info,
+         mesg, success) = optimizers.minimise(optimizer, residuals,
+                                              [par['value'] for par in free],
+                                              bounds = bounds,
+                                              x_scale = x_scale,
+                                              maxfev = 1000 * len(free))
+        chisqr = residuals.chi2(out)
+        if image_path:
+            residuals.image(out, image_path)
+    finally:
+        residuals.close()
+
+    for par, value in zip(free, out):
+        par['value'] = float(value)
+    return parameters, (out, cov_x, info, mesg, success, chisqr)
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser()
+    parser.add_option('-m', '--model', type = str, dest = 'model',
+                      help = "The model to fit")
+    parser.add_option('-d', '--dataset', type = str, dest = 'dataset',
+                      help = """2-D data as a .npy array or text columns of qx,
+                      qy, I and optionally the error on I""")
+    parser.add_option('-p', '--parameters', type = str, dest = 'parameters',
+                      help = "Parameters as a json file or string")
+    parser.add_option('-w', '--weighting', type = str, dest = 'weighting',
+                      default = 'auto', help = "Weighting as for modelling.py")
+    parser.add_option('-f', '--optimizer', type = str, dest = 'optimizer',
+                      default = 'leastsq', help = "Optimizer backend")
+    parser.add_option('--qmin', type = float, dest = 'qmin', default = None,
+                      help = "Exclude pixels with |q| below this")
+    parser.add_option('--qmax', type = float, dest = 'qmax', default = None,
+                      help = "Exclude pixels with |q| above this")
+    parser.add_option('--beamstop', type = str, dest = 'beamstop',
+                      default = None,
+                      help = "qx,qy,radius of a circle of pixels to exclude")
+    parser.add_option('--mask', type = str, dest = 'mask', default = None,
+                      help = """A .npy boolean array over the pixels, False for
+                      those to exclude""")
+    parser.add_option('-j', '--processes', type = int, dest = 'processes',
+                      default = None, help = "Number of worker processes")
+    parser.add_option('--chunk', type = int, dest = 'chunk', default = 100000,
+                      help = "Pixels per task")
+    parser.add_option('-o', '--outpath', type = str, dest = 'outpath',
+                      default = 'fit2d.json',
+                      help = """Path for the json output. The fitted model
+                      image is written alongside it as a .npy file""")
+
+    (options, args) = parser.parse_args()
+    if os.path.isfile(options.parameters):
+        f = open(options.parameters, 'r')
+        parameters = json.load(f)
+        f.close()
+    else:
+        parameters = json.loads(options.parameters)
+
+    data = sas_utils.load_2d_data(options.dataset)
+    if options.qmin is not None or options.qmax is not None:
+        data.mask_q_range(options.qmin, options.qmax)
+    if options.beamstop:
+        data.mask_circle(*[float(x) for x in options.beamstop.split(',')])
+    if options.mask:
+        data.mask_pixels(np.load(options.mask))
+
+    directory = os.path.dirname(options.outpath)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    base = os.path.splitext(options.outpath)[0]
+    parameters, result = fit_image(options.model, parameters, data,
+                                   options.weighting, options.optimizer,
+                                   options.processes, options.chunk,
+                                   image_path = base)
+
+    f = open(options.outpath, 'w')
+    json.dump({'model'      : options.model,
+               'parameters' : parameters,
+               'chi2'       : result[5],
+               'success'    : bool(result[4]),
+               'npixels'    : len(data),
+               'nused'      : int(data.mask.sum()),
+               'image'      : base + '.npy'}, f)
+    f.close()
+    print "Fitted:", bool(result[4]), "chi2:", result[5]
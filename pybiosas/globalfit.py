@@ -0,0 +1,265 @@
+# PyBioSas.globalfit: Simultaneous fitting of several datasets with
+# some model parameters shared between them
+#
+# Public Domain Waiver:
+# To the extent possible under law, Cameron Neylon has waived all
+# copyright and related or neighboring rights to globalfit.py
+# This work is published from United Kingdom.
+#
+# See http://creativecommons.org/publicdomain/zero/1.0/
+#
+# A global fit is described by a json file of the form
+#
+#     {"shared"   : ["r_minor", "r_ratio", "length"],
+#      "weighting": "auto",
+#      "datasets" : [{"dataset"    : "q32.txt",
+#                     "model"      : "ellipticalCylinder",
+#                     "parameters" : [{"paramname" : "scale",
+#                                      "value"     : 0.0004}, ...]},
+#                    {"dataset"    : "q48.txt", ...}]}
+#
+# Free parameters named in "shared" take a single value across all of
+# the datasets that use them, all other free parameters are local to
+# their dataset. The residuals of all of the datasets are stacked into
+# one vector and fitted with the bounded trust region solver using a
+# sparse Jacobian: each dataset's residuals only depend on the shared
+# parameters and its own local parameters, so finite differences for
+# the local parameters of different datasets are taken in the same
+# evaluation and the cost grows linearly with the number of datasets.
+
+import optparse
+import json
+import datetime
+import os.path
+import numpy as np
+import scipy.optimize
+import scipy.sparse
+try:
+    import pybiosas.modelling as modelling
+    import pybiosas.optimizers as optimizers
+except ImportError:
+    import modelling
+    import optimizers
+
+
+def block_sparsity(block_sizes, block_columns, ncols):
+    """Build the Jacobian sparsity structure for a stacked residual vector
+
+    block_sizes gives the number of residuals contributed by each
+    dataset and block_columns the list of fit columns each dataset's
+    residuals depend on. Returns a scipy.sparse lil_matrix with ones
+    where the Jacobian can be non-zero.
+    """
+
+    sparsity = scipy.sparse.lil_matrix((sum(block_sizes), ncols), dtype=int)
+    row = 0
+    for size, columns in zip(block_sizes, block_columns):
+        for col in columns:
+            sparsity[row:row + size, col] = 1
+        row += size
+
+    return sparsity
+
+
+class GlobalFit:
+    """A simultaneous fit of several datasets with shared parameters
+
+    Datasets are added one at a time with a model name and a starting
+    parameter list in the same form as taken by ModelWrapper. Each
+    dataset gets its own model instance so that local parameters do not
+    interfere. Calling fit() builds the stacked residual function, runs
+    the fit and leaves the fitted values in each dataset's parameter
+    list.
+    """
+
+    def __init__(self, shared=None, weighting='auto'):
+        self.shared = shared or []
+        self.weighting = weighting
+        self.datasets = []
+        self.columns = []
+        self.fitsuccess = False
+
+    def add_dataset(self, data, model, parameters, name=None, model_func=None):
+        """Add a dataset (an ExpSasData object) to the global fit"""
+
+        if model_func is None:
+            model_func = modelling.load_model(model)
+        modelling.complete_parameters(model_func, parameters)
+        self.datasets.append({'name'       : name,
+                              'model'      : model,
+                              'model_func' : model_func,
+                              'data'       : data,
+                              'sigma'      : data.sigma(self.weighting),
+                              'parameters' : parameters})
+
+    def _build_columns(self):
+        """Assign every free parameter of every dataset to a fit column
+
+        Shared parameters come first, one column each, followed by the
+        local parameters of each dataset in turn. For each dataset a list
+        of (Parameter, column) pairs is stored under 'mapping'.
+        """
+
+        self.columns = []
+        shared_columns = {}
+        for ds in self.datasets:
+            ds['mapping'] = []
+
+        for passno in ['shared', 'local']:
+            for k, ds in enumerate(self.datasets):
+                for par in ds['parameters']:
+                    if par.get('fixed', False):
+                        continue
+                    name = par['paramname']
+                    is_shared = name in self.shared
+                    if (passno == 'shared') != is_shared:
+                        continue
+
+                    if is_shared and name in shared_columns:
+                        col = shared_columns[name]
+                    else:
+                        bounds, x_scale = modelling.param_info(ds['model'], par)
+                        col = len(self.columns)
+                        if is_shared:
+                            shared_columns[name] = col
+                            label = name
+                        else:
+                            label = '%s[%d]' % (name, k)
+                        self.columns.append({'label'   : label,
+                                             'value'   : par['value'],
+                                             'bounds'  : bounds,
+                                             'x_scale' : x_scale})
+
+                    param = modelling.Parameter(ds['model_func'], name,
+                                                value=par['value'])
+                    ds['mapping'].append((param, col))
+
+    def residuals(self, x):
+        """Return the stacked weighted residuals for the fit column values x"""
+
+        blocks = []
+        for ds in self.datasets:
+            for param, col in ds['mapping']:
+                param.set(x[col])
+            model_i = modelling.evaluate_model(ds['model_func'], ds['data'].q)
+            blocks.append((ds['data'].i - model_i) / ds['sigma'])
+
+        return np.concatenate(blocks)
+
+    def fit(self, maxfev=None):
+        """Run the global fit"""
+
+        self._build_columns()
+        ncols = len(self.columns)
+        block_sizes = [len(ds['data']) for ds in self.datasets]
+        block_columns = [[col for param, col in ds['mapping']]
+                         for ds in self.datasets]
+        sparsity = block_sparsity(block_sizes, block_columns, ncols)
+
+        lower, upper = optimizers.split_bounds([c['bounds'] for c in self.columns],
+                                               ncols)
+        x0 = optimizers.clip_to_bounds([c['value'] for c in self.columns],
+                                       lower, upper)
+        x_scale = np.array([c['x_scale'] for c in self.columns], dtype=float)
+        if maxfev is None:
+            maxfev = 1000 * ncols
+
+        counted = optimizers.CountedFunction(self.residuals)
+        result = scipy.optimize.least_squares(counted, x0,
+                                              jac_sparsity=sparsity,
+                                              bounds=(lower, upper),
+                                              x_scale=x_scale,
+                                              method='trf',
+                                              tr_solver='lsmr',
+                                              max_nfev=maxfev)
+
+        jac = result.jac
+        if scipy.sparse.issparse(jac):
+            jac = jac.toarray()
+        self.cov_x = optimizers.covariance_from_jacobian(jac)
+        self.nfev = counted.ncalls
+        self.mesg = result.message
+
+        # Leave every model and parameter list at the fitted values
+        res = self.residuals(result.x)
+        self.chisqr = float(np.dot(res, res))
+        self.reduced_chisqr = self.chisqr / max(len(res) - ncols, 1)
+        row = 0
+        for ds, size in zip(self.datasets, block_sizes):
+            block = res[row:row + size]
+            ds['chi2'] = float(np.dot(block, block))
+            row += size
+            values = dict([(param.get_name(), param.get())
+                           for param, col in ds['mapping']])
+            for par in ds['parameters']:
+                if par['paramname'] in values:
+                    par['value'] = values[par['paramname']]
+
+        self.x = result.x
+        self.fitsuccess = result.success and self.cov_x is not None
+        return self.fitsuccess
+
+    def write(self, outpath):
+        """Write the result of the global fit to a json file"""
+
+        outdict = {'run'     : {'command' : 'globalfit',
+                                'date'    : str(datetime.date.today())},
+                   'shared'  : self.shared,
+                   'global'  : {'chi2'         : {'value' : self.chisqr},
+                                'reduced_chi2' : {'value' : self.reduced_chisqr},
+                                'nfev'         : {'value' : self.nfev},
+                                'success'      : {'value' : self.fitsuccess},
+                                'message'      : {'value' : self.mesg}},
+                   'datasets': []}
+
+        if self.cov_x is not None:
+            outdict['global']['cov_x'] = {'value'  : self.cov_x.tolist(),
+                                          'params' : [c['label'] for c
+                                                      in self.columns]}
+
+        for ds in self.datasets:
+            outdict['datasets'].append({'dataset'    : ds['name'],
+                                        'model'      : ds['model'],
+                                        'chi2'       : {'value' : ds['chi2']},
+                                        'parameters' : ds['parameters']})
+
+        path = os.path.dirname(outpath)
+        if path and not os.path.exists(path):
+            os.makedirs(path)
+        f = open(outpath, 'w')
+        json.dump(outdict, f)
+        f.close()
+
+
+def from_spec(spec):
+    """Create a GlobalFit from a specification dictionary (see above)"""
+
+    globalfit = GlobalFit(spec.get('shared', []), spec.get('weighting', 'auto'))
+    for entry in spec['datasets']:
+        data = modelling.load_dataset(entry['dataset'])
+        globalfit.add_dataset(data, entry['model'], list(entry['parameters']),
+                              name=entry['dataset'])
+
+    return globalfit
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser()
+    parser.add_option('-s', '--spec', type = str, dest = 'spec',
+                      help = """A json file describing the datasets, models
+                      and starting parameters and which parameters are
+                      shared between the datasets""")
+    parser.add_option('-o', '--outpath', type = str, dest = 'outpath',
+                      default = 'globalfit_output.json',
+                      help = "Path of the json file to write the results to")
+
+    (options, args) = parser.parse_args()
+    f = open(options.spec, 'r')
+    spec = json.load(f)
+    f.close()
+
+    globalfit = from_spec(spec)
+    print "Fitting", len(globalfit.datasets), "datasets"
+    globalfit.fit()
+    print "Fitted:", globalfit.fitsuccess, "chi2:", globalfit.chisqr
+    globalfit.write(options.outpath)
@@ -0,0 +1,266 @@
+# PyBioSas.globalopt: Global searches for the best fit of a model
+#
+# Public Domain Waiver:
+# To the extent possible under law, Cameron Neylon has waived all
+# copyright and related or neighboring rights to globalopt.py
+# This work is published from United Kingdom.
+#
+# See http://creativecommons.org/publicdomain/zero/1.0/
+#
+# The local optimizers in pybiosas.optimizers find the minimum nearest
+# to where they start, which is why the bags of tasks in the data
+# directories sweep a grid of starting points. The searches here cover
+# the whole of a bounded region of parameter space in one job:
+#
+#   differential_evolution  A population of parameter vectors evolved by
+#                           mutation and crossover. Each generation is
+#                           scored in one call, split in blocks across a
+#                           ModelPool with evaluate_batch.
+#   basin_hopping           Repeated random jumps from the best minimum so
+#                           far, each followed by a local (LM) refit. The
+#                           jumps of one round are refitted in parallel.
+#
+# Both return the best parameter list found, which should then be
+# polished with a local fit (ModelWrapper.fit does this with --global).
+
+import copy
+import numpy as np
+try:
+    import pybiosas.modelling as modelling
+    import pybiosas.parallel as parallel
+except ImportError:
+    import modelling
+    import parallel
+
+
+def _population_chi2(state, rows):
+    """chi2 for each row of a block of free parameter vectors"""
+
+    parallel.reset_parameters(state)
+    curves = modelling.evaluate_batch(state['model_func'], state['names'],
+                                      rows, state['q'])
+    res = (state['i'] - curves) / state['sigma']
+    return np.sum(res * res, axis=1)
+
+
+def _local_fit(state, values):
+    """Refit the free parameters from the given values"""
+
+    parameters = parallel.reset_parameters(state)
+    for par in parameters:
+        if par['paramname'] in state['names']:
+            par['value'] = values[state['names'].index(par['paramname'])]
+    modelling.complete_parameters(state['model_func'], parameters)
+    result = modelling.fit_parameters(state['model_func'], state['model'],
+                                      parameters, state['q'], state['i'],
+                                      state['sigma'], state['optimizer'])
+    values = [par['value'] for par in parameters
+              if par['paramname'] in state['names']]
+    return values, result[5], result[2]['nfev']
+
+
+def search_bounds(model, parameters, width=10.0):
+    """Finite (lower, upper) arrays bounding the search for the free parameters
+
+    Bounds given for a parameter (see modelling.param_info) are used
+    where they are finite. A missing upper bound is set width times the
+    value (or x_scale if larger) above it, and a missing lower bound the
+    same distance below it.
+    """
+
+    lower = []
+    upper = []
+    for par in parameters:
+        if par.get('fixed', False):
+            continue
+        bounds, x_scale = modelling.param_info(model, par)
+        span = width * max(abs(par['value']), x_scale)
+        low, high = bounds
+        if low is None:
+            low = par['value'] - span
+        if high is None:
+            high = max(par['value'], low) + span
+        lower.append(float(low))
+        upper.append(float(high))
+    return np.array(lower), np.array(upper)
+
+
+class PopulationObjective:
+    """chi2 of many free parameter vectors at once across a ModelPool
+
+    Calling the instance with an (npop, nfree) array returns the npop
+    chi2 values. The population is split into one block per worker and
+    each block is evaluated with modelling.evaluate_batch.
+    """
+
+    def __init__(self, model, parameters, data, weighting='auto',
+                 optimizer='leastsq', processes=None):
+        self.model = model
+        self.parameters = copy.deepcopy(parameters)
+        self.names = [par['paramname'] for par in self.parameters
+                      if not par.get('fixed', False)]
+        self.pool = parallel.ModelPool(model, self.parameters,
+                                       shared = {'q'         : data.q,
+                                                 'i'         : data.i,
+                                                 'sigma'     : data.sigma(weighting),
+                                                 'names'     : self.names,
+                                                 'optimizer' : optimizer},
+                                       processes = processes)
+        self.npoints = len(data)
+        self.nevaluations = 0
+
+    def __call__(self, population):
+        population = np.atleast_2d(population)
+        nblocks = min(self.pool.processes, len(population))
+        blocks = np.array_split(population, nblocks)
+        self.nevaluations += len(population)
+        return np.concatenate(self.pool.map(_population_chi2, blocks))
+
+    def local_fits(self, starts):
+        """Local fits from each row of starts, run in parallel
+
+        Returns a list of (values, chi2, nfev) for each start.
+        """
+
+        return self.pool.map(_local_fit, [list(row) for row in starts])
+
+    def parameters_for(self, values):
+        """A copy of the parameter list with the free values replaced"""
+
+        parameters = copy.deepcopy(self.parameters)
+        for par in parameters:
+            if par['paramname'] in self.names:
+                par['value'] = float(values[self.names.index(par['paramname'])])
+        return parameters
+
+    def close(self):
+        self.pool.close()
+
+
+def differential_evolution(objective, lower, upper, popsize=15, maxiter=200,
+                           mutation=(0.5, 1.0), crossover=0.7, tol=0.01,
+                           seed=None, x0=None):
+    """Minimise objective over a box by differential evolution
+
+    objective takes an (npop, ndim) array and returns npop values, so
+    each generation is a single call. The population has popsize * ndim
+    members, the first of them x0 if given, and evolves by the rand/1/bin
+    scheme with the mutation factor dithered over the range given. The
+    search stops after maxiter generations or when the spread of the
+    population's values falls below tol times their mean.
+
+    Returns (best vector, best value, number of generations).
+    """
+
+    random = np.random.RandomState(seed)
+    ndim = len(lower)
+    npop = max(popsize * ndim, 5)
+    span = upper - lower
+
+    # Latin hypercube initial population
+    segments = (np.arange(npop)[:, np.newaxis] +
+                random.uniform(size=(npop, ndim))) / npop
+    for j in range(ndim):
+        segments[:, j] = segments[random.permutation(npop), j]
+    population = lower + segments * span
+    if x0 is not None:
+        population[0] = np.clip(x0, lower, upper)
+    energies = objective(population)
+
+    for generation in range(1, maxiter + 1):
+        # Three distinct other members for every member
+        picks = np.array([random.choice(np.delete(np.arange(npop), j), 3,
+                                        replace=False) for j in range(npop)])
+        factor = random.uniform(*mutation)
+        trial = (population[picks[:, 0]] +
+                 factor * (population[picks[:, 1]] - population[picks[:, 2]]))
+
+        cross = random.uniform(size=(npop, ndim)) < crossover
+        cross[np.arange(npop), random.randint(0, ndim, npop)] = True
+        trial = np.where(cross, trial, population)
+
+        # Reflect members that left the box back inside it
+        trial = np.where(trial < lower, 2 * lower - trial, trial)
+        trial = np.where(trial > upper, 2 * upper - trial, trial)
+        trial = np.clip(trial, lower, upper)
+
+        trial_energies = objective(trial)
+        better = trial_energies < energies
+        population[better] = trial[better]
+        energies[better] = trial_energies[better]
+
+        if np.std(energies) <= tol * abs(np.mean(energies)):
+            break
+
+    best = np.argmin(energies)
+    return population[best], energies[best], generation
+
+
+def basin_hopping(objective, x0, lower, upper, niter=20, stepsize=0.5,
+                  temperature=None, seed=None):
+    """Minimise by local fits from random jumps about the current minimum
+
+    objective must provide local_fits (see PopulationObjective). Each
+    round makes one jump per worker process from the current minimum,
+    of stepsize times the box size in each dimension, and refits them
+    in parallel. The best refit of the round is accepted by the
+    Metropolis criterion at temperature, which defaults to the chi2 of
+    the first local fit divided by the number of data points so that
+    changes of order one reduced chi2 are often accepted.
+
+    Returns (best vector, best value, total model evaluations).
+    """
+
+    random = np.random.RandomState(seed)
+    span = upper - lower
+    values, chi2, nfev = objective.local_fits([x0])[0]
+    current = (np.array(values), chi2)
+    best = current
+    if temperature is None:
+        temperature = max(chi2 / objective.npoints, 1e-12)
+
+    njumps = objective.pool.processes
+    for j in range(niter):
+        jumps = current[0] + stepsize * span * random.uniform(-1, 1,
+                                                             (njumps, len(x0)))
+        jumps = np.clip(jumps, lower, upper)
+        results = objective.local_fits(jumps)
+        nfev += sum([result[2] for result in results])
+        values, chi2, n = min(results, key=lambda result: result[1])
+        if (chi2 < current[1] or
+                random.uniform() < np.exp(-(chi2 - current[1]) / temperature)):
+            current = (np.array(values), chi2)
+        if current[1] < best[1]:
+            best = current
+
+    return best[0], best[1], nfev
+
+
+def global_fit(model, parameters, data, method='de', weighting='auto',
+               optimizer='leastsq', processes=None, seed=None, **options):
+    """Run a global search and return the best parameter list found
+
+    method is 'de' for differential evolution or 'basinhopping'. Any
+    further options are passed to the search function. The result is a
+    copy of parameters with the free values at the best point; run a
+    local fit from it for the final values and covariance.
+    """
+
+    objective = PopulationObjective(model, parameters, data, weighting,
+                                    optimizer, processes)
+    try:
+        lower, upper = search_bounds(model, parameters)
+        x0 = np.array([par['value'] for par in parameters
+                       if not par.get('fixed', False)])
+        if method == 'de':
+            best, chi2, generations = differential_evolution(
+                                          objective, lower, upper,
+                                          seed = seed, x0 = x0, **options)
+        elif method == 'basinhopping':
+            best, chi2, nfev = basin_hopping(objective, x0, lower, upper,
+                                             seed = seed, **options)
+        else:
+            raise ValueError, "Unknown global method: " + str(method)
+        return objective.parameters_for(best)
+    finally:
+        objective.close()
@@ -0,0 +1,325 @@
+# PyBioSas.library: Precomputed libraries of model curves for finding
+# good starting points for a fit
+#
+# Public Domain Waiver:
+# To the extent possible under law, Cameron Neylon has waived all
+# copyright and related or neighboring rights to library.py
+# This work is published from United Kingdom.
+#
+# See http://creativecommons.org/publicdomain/zero/1.0/
+#
+# A library holds a model evaluated with scale 1 and no background over
+# a grid of its shape parameters (the 'library_grid' entry for the model
+# in pybiosas.models.models) on a fixed reference q range. Each curve is
+# normalised to a maximum of one. A library is stored as three files
+# sharing a base path:
+#
+#     base.npy         (ncurves, nq) normalised curves, memory mapped
+#     base_params.npy  (ncurves, nparams + 1) grid values and the
+#                      normalisation of each curve
+#     base.json        model, parameter names, q grid and fixed values
+#
+# To match a dataset it is interpolated onto the library q grid and for
+# every curve the best scale and background are found by weighted linear
+# least squares, all curves at once. The curves with the lowest residual
+# give complete starting parameter sets, scale and background included.
+#
+# The curves are computed at the model's default scattering length
+# densities, kept with the other fixed values in base.json. The scale
+# of a two phase model goes as the square of its contrast, so when a fit
+# uses other SLDs the scale of each match is multiplied by
+# (library contrast / fit contrast)**2 (see CurveLibrary.contrast_factor).
+#
+# Usage from the command line:
+#
+#     python library.py build -m ellipticalCylinder -o libs/ellcyl
+#     python library.py query -l libs/ellcyl -d q32.txt -k 5
+
+import optparse
+import itertools
+import copy
+import json
+import os
+import os.path
+import numpy as np
+try:
+    import pybiosas.modelling as modelling
+    import pybiosas.models as models
+    import pybiosas.parallel as parallel
+except ImportError:
+    import modelling
+    import models
+    import parallel
+
+
+def grid_values(spec):
+    """Expand a [first, last, npoints, 'log'/'lin'] grid specification"""
+
+    first, last, npoints = spec[0], spec[1], int(spec[2])
+    spacing = 'lin'
+    if len(spec) > 3:
+        spacing = spec[3]
+    if spacing == 'log':
+        return np.logspace(np.log10(first), np.log10(last), npoints)
+    return np.linspace(first, last, npoints)
+
+
+def _evaluate_chunk(state, rows):
+    """Evaluate the library curves for a block of grid points"""
+
+    parallel.reset_parameters(state)
+    return modelling.evaluate_batch(state['model_func'], state['names'],
+                                    rows, state['q'])
+
+
+def build_library(model, path, grid=None, q=None, processes=None, chunk=256):
+    """Compute and store a curve library for a registered model
+
+    grid is a dictionary of parameter name to grid specification and
+    defaults to the model's 'library_grid'. q defaults to 200 points
+    logarithmically spaced from 1e-3 to 1 A^-1. Curves are computed in
+    chunks across a ModelPool and written directly to the memory mapped
+    array.
+    """
+
+    if grid is None:
+        grid = models.models[model]['library_grid']
+    if q is None:
+        q = np.logspace(-3, 0, 200)
+    q = np.asarray(q, dtype=float)
+    names = sorted(grid.keys())
+    axes = [grid_values(grid[name]) for name in names]
+    points = np.array(list(itertools.product(*axes)))
+
+    # Scale of one and no background; everything else at model defaults
+    parameters = [{'paramname' : 'scale', 'value' : 1.0},
+                  {'paramname' : 'background', 'value' : 0.0}]
+
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    curves = np.lib.format.open_memmap(path + '.npy', mode='w+', dtype=float,
+                                       shape=(len(points), len(q)))
+
+    pool = parallel.ModelPool(model, parameters,
+                              shared = {'q' : q, 'names' : names},
+                              processes = processes)
+    try:
+        starts = range(0, len(points), chunk)
+        blocks = pool.map(_evaluate_chunk,
+                          [points[start:start + chunk] for start in starts])
+        for start, block in zip(starts, blocks):
+            curves[start:start + len(block)] = block
+        fixed = [par for par in pool.map(_worker_parameters, [None])[0]
+                 if par['paramname'] not in names]
+    finally:
+        pool.close()
+
+    norms = np.abs(curves).max(axis=1)
+    norms[norms == 0] = 1.0
+    curves /= norms[:, np.newaxis]
+    curves.flush()
+    np.save(path + '_params.npy', np.column_stack([points, norms]))
+
+    f = open(path + '.json', 'w')
+    json.dump({'model'  : model,
+               'names'  : names,
+               'grid'   : grid,
+               'q'      : q.tolist(),
+               'fixed'  : fixed}, f)
+    f.close()
+
+    return CurveLibrary(path)
+
+
+def _worker_parameters(state, item):
+    return parallel.reset_parameters(state)
+
+
+class CurveLibrary:
+    """A stored curve library opened for searching
+
+    The curves are memory mapped so opening a library is cheap and only
+    the pages needed for a search are read.
+    """
+
+    def __init__(self, path):
+        f = open(path + '.json', 'r')
+        self.info = json.load(f)
+        f.close()
+        self.model = self.info['model']
+        self.names = self.info['names']
+        self.fixed = dict([(par['paramname'], par['value'])
+                           for par in self.info.get('fixed', [])])
+        self.q = np.array(self.info['q'])
+        self.curves = np.load(path + '.npy', mmap_mode='r')
+        params = np.load(path + '_params.npy')
+        self.points = params[:, :-1]
+        self.norms = params[:, -1]
+
+    def __len__(self):
+        return len(self.points)
+
+    def match(self, data, weighting='relative'):
+        """Score every curve against a dataset
+
+        Returns (residual, scale, background) arrays with an entry per
+        curve, where scale and background are in the units of the
+        model's own parameters.
+        """
+
+        overlap = (self.q >= data.q.min()) & (self.q <= data.q.max())
+        if overlap.sum() < 3:
+            raise ValueError, "Dataset does not overlap the library q range"
+        q = self.q[overlap]
+        d = np.interp(q, data.q, data.i)
+        w = 1.0 / np.interp(q, data.q, data.sigma(weighting)) ** 2
+        curves = np.asarray(self.curves[:, overlap])
+
+        # Weighted linear least squares for d = s * curve + b for every
+        # curve at once
+        sw = w.sum()
+        sx = np.dot(curves, w)
+        sy = np.dot(w, d)
+        sxx = np.dot(curves * curves, w)
+        sxy = np.dot(curves, w * d)
+        det = sw * sxx - sx * sx
+        det[det == 0] = np.finfo(float).tiny
+        s = (sw * sxy - sx * sy) / det
+        b = (sy - s * sx) / sw
+
+        # Negative scales are unphysical, refit those with background only
+        negative = s < 0
+        s[negative] = 0.0
+        b[negative] = sy / sw
+
+        model_d = s[:, np.newaxis] * curves + b[:, np.newaxis]
+        residual = np.dot((d - model_d) ** 2, w)
+        return residual, s / self.norms, b
+
+    def nearest(self, data, k=5, weighting='relative'):
+        """Return the k best matching curves as (residual, values) pairs
+
+        values is a dictionary of parameter name to value including scale
+        and background.
+        """
+
+        residual, scale, background = self.match(data, weighting)
+        k = min(k, len(residual))
+        best = np.argpartition(residual, k - 1)[:k]
+        best = best[np.argsort(residual[best])]
+
+        out = []
+        for j in best:
+            values = dict(zip(self.names, self.points[j].tolist()))
+            values['scale'] = float(scale[j])
+            values['background'] = float(background[j])
+            out.append((float(residual[j]), values))
+        return out
+
+
+    def contrast_factor(self, parameters):
+        """Factor taking the library scales to the SLDs of parameters
+
+        The SLDs are the fixed values with 'sld' in their name; any not
+        in parameters are taken to be at the library values. Raises
+        ValueError if the SLDs differ from the library and the model
+        does not have exactly two of them, or gives them no contrast.
+        """
+
+        given = dict([(par['paramname'], par['value']) for par in parameters])
+        slds = sorted([name for name in self.fixed if 'sld' in name.lower()])
+        if all([given.get(name, self.fixed[name]) == self.fixed[name]
+                for name in slds]):
+            return 1.0
+        if len(slds) != 2:
+            raise ValueError, ("Can not rescale a library of " + self.model +
+                               " to other SLDs, build it at the SLDs of the fit")
+        library_contrast = self.fixed[slds[0]] - self.fixed[slds[1]]
+        contrast = (given.get(slds[0], self.fixed[slds[0]]) -
+                    given.get(slds[1], self.fixed[slds[1]]))
+        if contrast == 0:
+            raise ValueError, "The SLDs of the fit give no contrast"
+        return (library_contrast / contrast) ** 2
+
+
+def seed_parameters(library, data, parameters, k=5, weighting='relative',
+                    model=None):
+    """Starting parameter lists for a fit from the k best library matches
+
+    Each returned list is a copy of parameters with the values of the
+    free parameters replaced by those of a library match. Fixed
+    parameters keep the values given. The scales are rescaled to the
+    SLDs in parameters (see CurveLibrary.contrast_factor); where that is
+    not possible a warning is printed and no seeds are returned, so the
+    fit runs from the parameters given. If model is given it must be the
+    model the library was built for.
+    """
+
+    if model is not None and model != library.model:
+        raise ValueError, ("Library of " + library.model +
+                           " can not seed a fit of " + model)
+    try:
+        factor = library.contrast_factor(parameters)
+    except ValueError, error:
+        print "Warning: library starts not used.", error
+        return []
+    seeds = []
+    for residual, values in library.nearest(data, k, weighting):
+        values['scale'] *= factor
+        seed = copy.deepcopy(parameters)
+        given = [par['paramname'] for par in seed]
+        for par in seed:
+            if par['paramname'] in values and not par.get('fixed', False):
+                par['value'] = values[par['paramname']]
+        for name in values:
+            if name not in given:
+                seed.append({'paramname' : name, 'value' : values[name]})
+        seeds.append(seed)
+    return seeds
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser(usage = "%prog build|query [options]")
+    parser.add_option('-m', '--model', type = str, dest = 'model',
+                      help = "Model to build a library for")
+    parser.add_option('-o', '--outpath', type = str, dest = 'outpath',
+                      help = "Base path for the library files")
+    parser.add_option('-g', '--grid', type = str, dest = 'grid', default = None,
+                      help = """Grid as a json dictionary of parameter name to
+                      [first, last, npoints, 'log'/'lin'], defaults to the
+                      model's library_grid""")
+    parser.add_option('--qmin', type = float, dest = 'qmin', default = 1e-3)
+    parser.add_option('--qmax', type = float, dest = 'qmax', default = 1.0)
+    parser.add_option('--nq', type = int, dest = 'nq', default = 200)
+    parser.add_option('-j', '--processes', type = int, dest = 'processes',
+                      default = None)
+    parser.add_option('-l', '--library', type = str, dest = 'library',
+                      help = "Base path of the library to query")
+    parser.add_option('-d', '--dataset', type = str, dest = 'dataset',
+                      help = "Dataset to find starting points for")
+    parser.add_option('-k', type = int, dest = 'k', default = 5,
+                      help = "Number of matches to return")
+
+    (options, args) = parser.parse_args()
+    if not args:
+        parser.error("build or query is required")
+
+    if args[0] == 'build':
+        grid = None
+        if options.grid:
+            grid = json.loads(options.grid)
+        q = np.logspace(np.log10(options.qmin), np.log10(options.qmax),
+                        options.nq)
+        library = build_library(options.model, options.outpath, grid, q,
+                                options.processes)
+        print "Built library of", len(library), "curves"
+
+    elif args[0] == 'query':
+        library = CurveLibrary(options.library)
+        data = modelling.load_dataset(options.dataset)
+        for residual, values in library.nearest(data, options.k):
+            print residual, json.dumps(values)
+
+    else:
+        parser.error("Unknown command: " + args[0])
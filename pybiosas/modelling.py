@@ -17,6 +17,10 @@
 #     * Sansview (and all its dependencies)
 #     * Numpy and Scipy
 #     * pybiosas.sas_utils
+#     * pybiosas.optimizers
+#     * pybiosas.composite
+#     * pybiosas.monitor
+#     * pybiosas.curvecache
 #
 # In principle these should all be installed for you if you've used
 # pip or easy_install to pull this package from PyPi
@@ -30,11 +34,23 @@ import os.path
 try:
     import pybiosas.sas_utils
     import pybiosas.models
+    import pybiosas.optimizers
+    import pybiosas.composite
+    import pybiosas.tasktable
+    import pybiosas.monitor
+    import pybiosas.curvecache
 except ImportError:
     import sas_utils
     import models
+    import optimizers
+    import composite
+    import tasktable
+    import monitor
+    import curvecache
 import scipy.optimize
 import copy
+import multiprocessing
+import multiprocessing.pool
 import numpy as np
 
 
@@ -53,7 +69,8 @@ class ApplicationRun():
         self.dataset = None
         self.datain = None
         self.outpath = None
-
+        self.model_instance = None
+        self.failed = []
 
         self.__init_parser()
         self._raw_args, command = self.parser.parse_args()
@@ -105,16 +122,178 @@ class ApplicationRun():
                                  command line then outpath defaults to the
                                  current working directory.""")
 
+        self.parser.add_option('-f', '--optimizer', type = str, dest='optimizer',
+                                 help = ("Optimizer backend to use for fitting. "
+                                         "Available optimizers are " +
+                                         str(pybiosas.optimizers.optimizers.keys())),
+                                 default = 'leastsq')
+
+        self.parser.add_option('-w', '--weighting', type = str, dest='weighting',
+                                 help = """How to weight the residuals in a fit.
+                                 One of 'errors' (the measured uncertainties),
+                                 'poisson', 'relative', 'none' or 'auto' which
+                                 uses the measured uncertainties when the
+                                 dataset has them and is otherwise unweighted""",
+                                 default = 'auto')
+
+        self.parser.add_option('-B', '--bootstrap', type = int, dest='bootstrap',
+                                 help = """Number of residual bootstrap refits to
+                                 run after a fit to estimate confidence
+                                 intervals on the free parameters""",
+                                 default = 0)
+
+        self.parser.add_option('--profile', type = int, dest='profile',
+                                 help = """Number of points in a profile
+                                 likelihood scan of each free parameter run
+                                 after a fit""",
+                                 default = 0)
+
+        self.parser.add_option('--level', type = float, dest='level',
+                                 help = "Confidence level for the intervals",
+                                 default = 0.95)
+
+        self.parser.add_option('-l', '--library', type = str, dest='library',
+                                 help = """Base path of a curve library built
+                                 with library.py. The fit is also started
+                                 from the best matches in the library""",
+                                 default = None)
+
+        self.parser.add_option('--starts', type = int, dest='starts',
+                                 help = """Number of library matches to start
+                                 fits from""",
+                                 default = 5)
+
+        self.parser.add_option('-g', '--global', type = str, dest='globalopt',
+                                 help = """Run a global search before the
+                                 local fit, either 'de' (differential
+                                 evolution) or 'basinhopping'. The search
+                                 covers the parameter bounds, or ten times
+                                 each value where there is no bound""",
+                                 default = None)
+
+        self.parser.add_option('--multires', type = str, dest='multires',
+                                 help = """Comma separated numbers of points,
+                                 e.g. 50,200. The fit is first run on the data
+                                 log-rebinned to each of these in turn before
+                                 the fit at full resolution""",
+                                 default = None)
+
+        self.parser.add_option('-j', '--processes', type = int, dest='processes',
+                                 help = """Number of worker processes for the
+                                 uncertainty estimates and global searches.
+                                 Defaults to the number of cores""",
+                                 default = None)
+
+        self.parser.add_option('-t', '--threads', type = int, dest='threads',
+                                 help = """Number of threads each model
+                                 evaluation is split across. Only faster for
+                                 long q arrays and models whose compiled code
+                                 releases the GIL""",
+                                 default = None)
+
+        self.parser.add_option('--cache', type = int, dest='cache',
+                                 help = """Keep up to this many model curves
+                                 to reuse when a model is evaluated again at
+                                 the same parameter values, as in bootstrap
+                                 refits and multistart fits""",
+                                 default = None)
+
+        self.parser.add_option('--qmin', type = float, dest='qmin',
+                                 help = "Exclude data below this q from fits",
+                                 default = None)
+
+        self.parser.add_option('--qmax', type = float, dest='qmax',
+                                 help = "Exclude data above this q from fits",
+                                 default = None)
+
+        self.parser.add_option('--exclude', type = str, dest='exclude',
+                                 help = """Json list of [low, high] q ranges to
+                                 exclude from fits, e.g. around a beamstop
+                                 artefact or a Bragg peak""",
+                                 default = None)
+
+        self.parser.add_option('--outliers', type = float, dest='outliers',
+                                 help = """Exclude points further than this many
+                                 robust standard deviations from a running
+                                 median of the intensity""",
+                                 default = None)
+
+        self.parser.add_option('--timeout', type = float, dest='timeout',
+                                 help = """Abort any single fit that runs for
+                                 longer than this many seconds""",
+                                 default = None)
+
+        self.parser.add_option('--patience', type = int, dest='patience',
+                                 help = """Abort a fit once chi2 has not improved
+                                 for this many evaluations""",
+                                 default = None)
+
+        self.parser.add_option('--check-bounds', action = 'store_true',
+                                 dest='check_bounds',
+                                 help = """Abort a fit when a parameter leaves its
+                                 bounds or one bounded by zero collapses
+                                 towards zero""",
+                                 default = False)
+
+        self.parser.add_option('--lean', action = 'store_true', dest='lean',
+                                 help = """Write only the fitted parameters, chi2,
+                                 covariance and timings, leaving out the fitted
+                                 curve and the data. process.py can regenerate
+                                 the curves of the best fits""",
+                                 default = False)
+
+        self.parser.add_option('--table', type = str, dest='table',
+                                 help = """A binary task table written by cli.py
+                                 to take the fits from with the 'task'
+                                 command""",
+                                 default = None)
+
+        self.parser.add_option('--tasks', type = str, dest='tasks',
+                                 help = """The task from the table to run, N, or
+                                 a range of tasks N:M (M excluded). Defaults
+                                 to all the tasks in the table""",
+                                 default = None)
 
 
     def execute(self):
         """Generate Model Wrapper and Execute."""
 
+        if self.args['command'] == 'task':
+            self.failed = self.run_tasks()
+            return
         self.model_instance = ModelWrapper(self.args)
         self.model_instance.execute()
 
+    def run_tasks(self):
+        """Fit and write out each of the selected tasks from the task table
+
+        Options given on the command line, such as the optimizer, apply
+        to every task. A task that raises an error is reported and the
+        remaining tasks are still run. Returns the failed task indices.
+        """
+
+        header, values = pybiosas.tasktable.read_table(self.args['table'])
+        failed = []
+        selection = self.args['tasks'] or ':'
+        for index in pybiosas.tasktable.parse_range(selection,
+                                                    header['ntasks']):
+            args = dict(self.args)
+            args.update(pybiosas.tasktable.task_args(header, values, index))
+            try:
+                wrapper = ModelWrapper(args)
+                wrapper.execute()
+                wrapper.write()
+            except Exception, error:
+                print "Task", index, "failed:", error
+                failed.append(index)
+        return failed
+
     def write_out(self):
-        self.model_instance.write()
+        if self.model_instance is not None:
+            self.model_instance.write()
+        if self.failed:
+            print len(self.failed), "tasks failed:", self.failed
+            sys.exit(1)
         
 
 class ModelWrapper:
@@ -124,6 +303,7 @@ class ModelWrapper:
         self.args = args
         self.fitsuccess = False
         self.traceback = None
+        self.uncertainty = None
         self.__distribute_args()
         self._registered_models = pybiosas.models.models
 
@@ -135,6 +315,26 @@ class ModelWrapper:
             self.__dict__[key] = self.args[key]
         if not 'q_vals' in self.args:
             self.q_vals = None
+        if not self.args.get('optimizer'):
+            self.optimizer = 'leastsq'
+        if not self.args.get('weighting'):
+            self.weighting = 'auto'
+        for key, default in [('bootstrap', 0), ('profile', 0),
+                             ('processes', None), ('level', 0.95),
+                             ('library', None), ('starts', 5),
+                             ('globalopt', None),
+                             ('multires', []), ('qmin', None),
+                             ('qmax', None), ('exclude', []),
+                             ('outliers', None), ('threads', 1),
+                             ('timeout', None), ('patience', None),
+                             ('check_bounds', False), ('lean', False),
+                             ('cache', 0)]:
+            if self.args.get(key) is None:
+                self.__dict__[key] = default
+        if isinstance(self.multires, str):
+            self.multires = [int(nbins) for nbins in self.multires.split(',')]
+        if isinstance(self.exclude, basestring):
+            self.exclude = json.loads(self.exclude)
 
     def calculate(self):
         """Calculate values of i for given model and q values
@@ -158,11 +358,11 @@ class ModelWrapper:
         else:
             q_vals = q_vals_list
             
-        # Calculate i for each value of q
-        i_vals_out = map(self.__model_func.run, q_vals)
+        # Calculate i for all values of q in one call
+        i_vals_out = evaluate_model(self.__model_func, q_vals)
 
-        self.i_vals_out = i_vals_out
-        self.q_vals_out = q_vals
+        self.i_vals_out = np.asarray(i_vals_out).tolist()
+        self.q_vals_out = np.asarray(q_vals).tolist()
         return True
     
     def execute(self):
@@ -170,14 +370,20 @@ class ModelWrapper:
 
         self.__model_func = self.__model_importer()
         self.__load_files_from_args() # load data from files
+        set_evaluation_threads(self.threads)
+        set_curve_cache(self.cache)
 
         if self.command == 'fit':
             print "Fitting"
+            start_time = datetime.datetime.now()
             self.fit()
+            self.seconds = (datetime.datetime.now() -
+                            start_time).total_seconds()
             print "Fitted:", self.fitsuccess
-            print "Calculating"
-            self.calculate()
-            print "Calculated"
+            if not self.lean:
+                print "Calculating"
+                self.calculate()
+                print "Calculated"
             
         elif self.command == ('calc' or 'calculate'):
             self.calculate()
@@ -193,77 +399,219 @@ class ModelWrapper:
         the model in the __load_args function they do not need to be set again here.
         If this library is being used in scripts it might be appropriate to reset
         parameters for the model here just to be safe.
+
+        The fit itself is delegated to the backend named in self.optimizer
+        (see pybiosas.optimizers). Bounds and typical scales for each free
+        parameter are taken from the 'bounds' and 'x_scale' keys of the
+        parameter dictionary if present, otherwise from the 'param_info'
+        entry for the model in pybiosas.models.models.
+
+        Residuals are weighted by the standard deviations chosen by
+        self.weighting (see ExpSasData.sigma) so that self.chisqr is a
+        true chi squared when the data has uncertainties.
+
+        If self.library names a curve library (see pybiosas.library) the
+        fit is run from each of the self.starts best library matches as
+        well as from the given parameters and the lowest chi2 is kept.
+        Likewise if self.globalopt names a global search (see
+        pybiosas.globalopt) the fit is also started from the best point
+        it finds.
+
+        If self.multires is a list of bin counts each fit is first run on
+        the data log-rebinned to each of those numbers of points in turn,
+        warm-starting every stage from the last, before the final fit at
+        full resolution. self.point_evaluations counts the total number of
+        q points the model was evaluated at over all stages.
+
+        Only the points left by the mask on self.datain (see
+        apply_mask) are fitted, so the model is never evaluated at the
+        excluded points.
+
+        If any of self.timeout, self.patience or self.check_bounds are
+        set every fit is watched by a pybiosas.monitor.FitMonitor and
+        stopped early if it runs too long, stagnates or leaves the
+        bounds of its parameters. The reasons are kept in self.aborted.
         """
         
-        parameters=[]
+        datain = self.datain.masked
         self.q_vals = self.datain.q
-        for par in self.parameters:
-            if not par.get('fixed', False):
-                parameters.append(Parameter(self.__model_func, par['paramname'],
-                                                               value=par['value']))
-            
-        def f(params):
-            i=0
-            for p in parameters:
-                p.set(params[i])
-                i+=1
-
-            residuals=[]
-            for j in range(len(self.datain.q)):
-                residuals.append(self.datain.i[j] -
-                             self.__model_func.run(self.datain.q[j]))
-
-            return residuals
-
-        def chi2(params):
-            sum = 0
-            res = f(params)
-            for item in res:
-                sum += item * item
-            return sum
-
-        p = [param() for param in parameters]
-        out, self.cov_x, self.fit_info, self.mesg, success = scipy.optimize.leastsq(f, p, 
-                                                                 full_output=1,
-                                                                  maxfev = 1000*len(p))
-        # Calculate chi squared
-        if len(parameters) > 1:
-            self.chisqr = chi2(out)
-        elif len(parameters) == 1:
-            self.chisqr = chi2([out])
-        
-        # Update the main parameter list at self.parameters with finalised values
-        paramlist = []
-        for p in self.parameters:
-            paramlist.append(p['paramname'])
-
-        for p in parameters:
-            self.parameters[paramlist.index(p.get_name())]['value'] = p.get()
-
-        if self.cov_x != None:
+        sigma = datain.sigma(self.weighting)
+        starts = [self.parameters]
+        if self.library:
+            import pybiosas.library
+            library = pybiosas.library.CurveLibrary(self.library)
+            starts += pybiosas.library.seed_parameters(library, datain,
+                                                       self.parameters,
+                                                       self.starts,
+                                                       model = self.model)
+        if self.globalopt:
+            import pybiosas.globalopt
+            starts.append(pybiosas.globalopt.global_fit(
+                              self.model,
+                              complete_parameters(self.__model_func,
+                                                  copy.deepcopy(self.parameters)),
+                              datain, self.globalopt,
+                              weighting = self.weighting,
+                              optimizer = self.optimizer,
+                              processes = self.processes))
+
+        coarse = [datain.log_rebin(nbins) for nbins in self.multires]
+
+        fit_monitor = None
+        if self.timeout or self.patience or self.check_bounds:
+            fit_monitor = pybiosas.monitor.FitMonitor(self.timeout,
+                                                      self.patience,
+                                                      check_bounds = self.check_bounds)
+        self.aborted = []
+
+        best = None
+        self.nfev = 0
+        self.point_evaluations = 0
+        for start in starts:
+            parameters = complete_parameters(self.__model_func,
+                                             copy.deepcopy(start))
+            for data in coarse:
+                result = fit_parameters(self.__model_func, self.model,
+                                        parameters, data.q, data.i,
+                                        data.sigma(self.weighting),
+                                        self.optimizer, self._registered_models,
+                                        monitor = fit_monitor)
+                self.nfev += result[2]['nfev']
+                if 'aborted' in result[2]:
+                    self.aborted.append(result[2]['aborted'])
+                self.point_evaluations += result[2]['nfev'] * len(data)
+
+            result = fit_parameters(self.__model_func, self.model, parameters,
+                                    datain.q, datain.i, sigma,
+                                    self.optimizer, self._registered_models,
+                                    monitor = fit_monitor)
+            self.nfev += result[2]['nfev']
+            if 'aborted' in result[2]:
+                self.aborted.append(result[2]['aborted'])
+            self.point_evaluations += result[2]['nfev'] * len(datain)
+            if best is None or result[5] < best[0][5]:
+                best = (result, parameters)
+
+        # Leave the model and parameter list at the best of the fits
+        (out, self.cov_x, self.fit_info, self.mesg,
+         success, self.chisqr) = best[0]
+        self.parameters = complete_parameters(self.__model_func, best[1])
+        self.free_params = [par['paramname'] for par in self.parameters
+                            if not par.get('fixed', False)]
+        self.dof = max(len(datain) - len(self.free_params), 1)
+        self.reduced_chisqr = self.chisqr / self.dof
+
+        if self.cov_x is not None:
             self.fitsuccess = True
+            # Scale the covariance by the residual variance
+            self.cov = self.cov_x * self.reduced_chisqr
+
+        if self.fitsuccess and (self.bootstrap or self.profile):
+            self.estimate_uncertainty()
+
+    def apply_mask(self):
+        """Mask self.datain from the qmin, qmax, exclude and outliers options"""
+
+        self.datain.clear_mask()
+        if self.qmin is not None or self.qmax is not None:
+            self.datain.mask_q_range(self.qmin, self.qmax)
+        if self.exclude:
+            self.datain.mask_ranges(self.exclude)
+        if self.outliers:
+            self.datain.mask_outliers(self.outliers)
+        if len(self.datain.masked) == 0:
+            raise ValueError, "The mask excludes every point in the dataset"
+
+    def estimate_uncertainty(self):
+        """Bootstrap and profile likelihood estimates for the free parameters
+
+        Runs self.bootstrap residual bootstrap refits and self.profile
+        point profile likelihood scans per free parameter across
+        self.processes worker processes, starting from the fitted values.
+        The results are stored in self.uncertainty for writing out.
+        """
 
+        import pybiosas.uncertainty
+
+        analysis = pybiosas.uncertainty.UncertaintyAnalysis(
+                        self.model, self.parameters, self.datain.masked,
+                        weighting = self.weighting,
+                        optimizer = self.optimizer,
+                        processes = self.processes,
+                        level = self.level)
+        self.uncertainty = {'level' : self.level}
+        try:
+            if self.bootstrap:
+                self.uncertainty['bootstrap'] = analysis.bootstrap(self.bootstrap)
+            if self.profile:
+                self.uncertainty['profile'] = analysis.profile(self.profile,
+                                                               self.cov)
+        finally:
+            analysis.close()
 
     def write(self):
+        """Write the results out as json to self.outpath
+
+        In lean mode the calculated curve and the input data are left
+        out, which makes the output of a large sweep far smaller. The
+        dataset path and mask are still written so that process.py can
+        regenerate the curve of a fit when it is wanted.
+        """
+
         outdict = {'model'            : self.model,
-                   'data_out'         : {'q'       : json.dumps(self.q_vals_out),
-                                         'i'       : json.dumps(self.i_vals_out),
-                                         'units'   : 'A^-1'},
                    'run'              : {'command' : self.command,
                                          'date'    : str(datetime.date.today()),
-                                         'time'    : str(datetime.time())},
+                                         'time'    : str(datetime.time()),
+                                         'lean'    : self.lean},
                    'parameters_in'    : self.parameters_in}
+        if not self.lean:
+            outdict['data_out'] = {'q'     : json.dumps(self.q_vals_out),
+                                   'i'     : json.dumps(self.i_vals_out),
+                                   'units' : 'A^-1'}
+        if hasattr(self, 'seconds'):
+            outdict['run']['seconds'] = self.seconds
 
         if self.dataset:
-            outdict['dataset'] = {'q_in' : json.dumps(self.datain.q),
-                                  'i_in' : json.dumps(self.datain.i)}
+            outdict['dataset'] = {'path' : self.dataset,
+                                  'mask' : {'qmin'     : self.qmin,
+                                            'qmax'     : self.qmax,
+                                            'exclude'  : self.exclude,
+                                            'outliers' : self.outliers,
+                                            'npoints'  : len(self.datain.masked)}}
+            if not self.lean:
+                outdict['dataset']['q_in'] = json.dumps(self.datain.q.tolist())
+                outdict['dataset']['i_in'] = json.dumps(self.datain.i.tolist())
             
         if (self.fitsuccess and (self.command == 'fit')):
             outdict['fit'] = {'chi2'           : {'value' : self.chisqr},
-                              'cov_x'          : {'value' : str(self.cov_x)}}
-
+                              'cov_x'          : {'value'    : self.cov.tolist(),
+                                                  'unscaled' : self.cov_x.tolist(),
+                                                  'params'   : self.free_params},
+                              'reduced_chi2'   : {'value' : self.reduced_chisqr},
+                              'weighting'      : {'value' : self.weighting},
+                              'optimizer'      : {'value' : self.optimizer},
+                              'nfev'           : {'value' : self.nfev},
+                              'point_evaluations' : {'value' : self.point_evaluations}}
+
+            stderr = np.sqrt(np.abs(np.diag(self.cov)))
             for param in self.parameters:
                 outdict['fit'][param['paramname']] = param
+                if param['paramname'] in self.free_params:
+                    j = self.free_params.index(param['paramname'])
+                    param['stderr'] = stderr[j]
+
+            if hasattr(self.__model_func, 'evaluations'):
+                outdict['fit']['component_evaluations'] = {
+                    'value' : self.__model_func.evaluations}
+
+            if self.uncertainty:
+                outdict['uncertainty'] = self.uncertainty
+
+        if curve_cache is not None:
+            outdict['run']['curve_cache'] = curve_cache.stats()
+
+        if getattr(self, 'aborted', None):
+            outdict['monitor'] = {'aborted' : self.aborted}
 
         if os.path.isdir(self.outpath):
             self.outpath = os.path.join(self.outpath, "sansmodel_output.json")
@@ -287,20 +635,20 @@ class ModelWrapper:
         if self.dataset:
             try:
                 print "trying", self.dataset
-                if os.path.splitext(self.dataset)[1] == '.xml':
-                    self.datain = pybiosas.sas_utils.loadsasxml(self.dataset)
-                else:
-                    self.datain = pybiosas.sas_utils.load_two_column_data(self.dataset, rows_to_skip=1)
+                self.datain = load_dataset(self.dataset)
 
-                self.datain.err = None
-    
             except OSError:
                 errmsg = "Unable to load file: " + self.dataset
                 raise InputError, errmsg
                 return False
+            self.apply_mask()
 
         # Load and parse the parameters
-        if self.parameters:
+        if isinstance(self.parameters, list):
+            if not self.outpath:
+                self.outpath = os.getcwd()
+            self.parameters_in = copy.deepcopy(self.parameters)
+        elif self.parameters:
             if os.path.isfile(self.parameters):
                 print "self.outpath:", self.outpath
                 if not self.outpath:
@@ -319,21 +667,9 @@ class ModelWrapper:
 
             self.parameters_in = copy.deepcopy(self.parameters)
             
-        # Check we have all the parameters for model including those left as defaults
-        input_param_list = []
-        for param in self.parameters:
-            input_param_list.append(param['paramname'])
-        for paramname in self.__model_func.details.keys():
-            if (paramname not in input_param_list) and (
-                    paramname not in self.__model_func.orientation_params):
-                self.parameters.append({'paramname' : paramname,
-                                        'value' :
-                                       self.__model_func.getParam(paramname)
-                                        })
-
-        # Set the parameters for the model
-        for parameter in self.parameters:
-            self.__model_func.setParam(parameter['paramname'], parameter['value'])
+        # Check we have all the parameters for model including those left
+        # as defaults and set them in the model
+        complete_parameters(self.__model_func, self.parameters)
         
         if (self.q_vals and os.path.isfile(self.q_vals)):
             try:
@@ -355,25 +691,360 @@ class ModelWrapper:
         
             
     def __model_importer(self):
-        """Function for importing correct model library and returning model function
-
-        Because we don't know either the module name or the model function name
-        until runtime (as it is selected by the user) we need to look it up in
-        the dictionary of registered model (self._registered_models) and then
-        use __import__ so that we can pass the import command the string with
-        the module location. Having identified the library we then want to pass
-        the actual model calculation function back to the data model. The
-        function is available from the module __dict__ and if we know the model
-        we know the function name, so can create a pointer to this function and
-        return it to the main app execution thread.
+        """Import the model library and return a model instance
+
+        See load_model, which does the work.
         """
         
-        model_location = self._registered_models[self.model]['library_name']
-        library_location = 'sans.models.' + model_location
-        __import__(library_location)
-        model_func = getattr(sys.modules[library_location],
-                             self._registered_models[self.model]['model_name'])()
-        return model_func
+        return load_model(self.model, self._registered_models)
+
+
+def load_model(model, registered_models=None):
+    """Function for importing correct model library and returning model function
+
+    Because we don't know either the module name or the model function name
+    until runtime (as it is selected by the user) we need to look it up in
+    the dictionary of registered model (pybiosas.models.models) and then
+    use __import__ so that we can pass the import command the string with
+    the module location. Having identified the library we then want to pass
+    the actual model calculation function back to the data model. The
+    function is available from the module __dict__ and if we know the model
+    we know the function name, so can create a pointer to this function and
+    return it to the main app execution thread.
+
+    Composite models (registry entries with 'components') are returned
+    as a pybiosas.composite.CompositeModel of their loaded components.
+    """
+
+    if registered_models is None:
+        registered_models = pybiosas.models.models
+    if 'components' in registered_models[model]:
+        entry = registered_models[model]
+        components = [(prefix, load_model(name, registered_models))
+                      for prefix, name in entry['components']]
+        return pybiosas.composite.CompositeModel(components, entry['operator'],
+                                                 entry.get('fixed_params', []))
+    model_location = registered_models[model]['library_name']
+    library_location = 'sans.models.' + model_location
+    __import__(library_location)
+    model_func = getattr(sys.modules[library_location],
+                         registered_models[model]['model_name'])()
+    return model_func
+
+
+def load_dataset(path):
+    """Load a dataset as an ExpSasData object choosing the loader by extension
+
+    Files ending .xml are read as canSAS XML and anything else as
+    columns of q, i (and optionally the error on i and the resolution in
+    q), with the header and delimiter found automatically. See
+    pybiosas.sas_utils.load_column_data for the binary cache kept
+    alongside text files.
+    """
+
+    if os.path.splitext(path)[1] == '.xml':
+        return pybiosas.sas_utils.loadsasxml(path)
+    else:
+        return pybiosas.sas_utils.load_column_data(path)
+
+
+def complete_parameters(model_func, parameters, orientation=False):
+    """Add any model parameters missing from the list and set them all
+
+    Parameters not given in the list are appended with the model's
+    default value so that the list describes the full model, fixed if
+    the model lists it in fixed_params (as composites do for the
+    parameters of structure factors). Orientation parameters are
+    skipped as only 1-D data is handled. The list is modified in place
+    and also returned.
+    """
+
+    fixed_params = getattr(model_func, 'fixed_params', [])
+    input_param_list = []
+    for param in parameters:
+        input_param_list.append(param['paramname'])
+    for paramname in model_func.details.keys():
+        if (paramname not in input_param_list) and (orientation or
+                paramname not in model_func.orientation_params):
+            parameters.append({'paramname' : paramname,
+                               'value' : model_func.getParam(paramname)})
+            if paramname in fixed_params:
+                parameters[-1]['fixed'] = True
+
+    for parameter in parameters:
+        model_func.setParam(parameter['paramname'], parameter['value'])
+
+    return parameters
+
+
+def fit_parameters(model_func, model, parameters, q, i, sigma=None,
+                   optimizer='leastsq', registered_models=None, maxfev=None,
+                   monitor=None):
+    """Fit the free parameters in a parameter list to a set of data
+
+    The parameters list has the same form as ModelWrapper.parameters and
+    every parameter in it should already be set in model_func. Parameters
+    that are not marked fixed are fitted with the named backend from
+    pybiosas.optimizers, using bounds and scales from param_info. The
+    'value' entries of the free parameters are updated in place and the
+    model is left set to the fitted values.
+
+    Returns the optimizer five-tuple followed by the chi squared:
+    (values, cov_x, info, mesg, success, chi2).
+
+    monitor is an optional pybiosas.monitor.FitMonitor checking every
+    evaluation. If it aborts the fit the best values it saw are kept
+    and returned as an unsuccessful fit with no covariance, with the
+    reason in info['aborted'].
+    """
+
+    free = []
+    bounds = []
+    x_scale = []
+    for par in parameters:
+        if not par.get('fixed', False):
+            free.append(Parameter(model_func, par['paramname'],
+                                  value=par['value']))
+            bound, scale = param_info(model, par, registered_models)
+            bounds.append(bound)
+            x_scale.append(scale)
+
+    f = Residuals(model_func, free, q, i, sigma)
+    p = [param() for param in free]
+    if maxfev is None:
+        maxfev = 1000*len(p)
+    if monitor is not None:
+        monitor.start(p, bounds)
+        f.monitor = monitor
+    try:
+        (out, cov_x, info,
+         mesg, success) = pybiosas.optimizers.minimise(optimizer, f, p,
+                                                       bounds = bounds,
+                                                       x_scale = x_scale,
+                                                       maxfev = maxfev)
+    except pybiosas.monitor.FitAborted, error:
+        out = monitor.best_values
+        if out is None:
+            out = np.array(p, dtype=float)
+        cov_x = None
+        info = {'nfev' : monitor.nfev, 'aborted' : error.reason}
+        mesg = "Fit aborted: " + error.reason
+        success = False
+    f.monitor = None
+
+    # Calculate chi squared, which also leaves the model set to the
+    # fitted values
+    chisqr = f.chi2(out)
+
+    # Update the parameter list with finalised values
+    values = dict([(param.get_name(), param.get()) for param in free])
+    for par in parameters:
+        if par['paramname'] in values:
+            par['value'] = values[par['paramname']]
+
+    return out, cov_x, info, mesg, success, chisqr
+
+
+def param_info(model, par, registered_models=None):
+    """Return the (bounds, x_scale) pair for a single parameter dict
+
+    Values given in the parameter dictionary itself take precedence over
+    those in the 'param_info' entry for the model in the registry.
+    Without either the scale is the magnitude of the value, so that an
+    SLD of 1e-6 is scaled as such, or 1 for a value of zero.
+    """
+
+    if registered_models is None:
+        registered_models = pybiosas.models.models
+    info = registered_models[model].get('param_info', {})
+    info = info.get(par['paramname'], {})
+    bounds = par.get('bounds', info.get('bounds', [None, None]))
+    x_scale = par.get('x_scale', info.get('x_scale'))
+    if not x_scale:
+        x_scale = abs(par['value']) or 1.0
+    return bounds, x_scale
+
+
+# Long q arrays may be split into chunks evaluated on a pool of threads.
+# This only gives a speed up where the model's compiled code releases the
+# GIL while it runs, so it is off (a single thread) by default; use
+# "benchmark.py threads" to measure the scaling for a model. Arrays are
+# only split where every chunk would have at least min_chunk points, as
+# below that handing the work to the threads costs more than it saves.
+evaluation_threads = 1
+min_chunk = 2048
+_thread_pool = None
+_thread_pool_pid = None
+
+
+def set_evaluation_threads(threads, chunk=None):
+    """Set the number of threads (None for one per cpu) used to evaluate models"""
+
+    global evaluation_threads, min_chunk, _thread_pool
+    if threads is None:
+        threads = multiprocessing.cpu_count()
+    threads = max(int(threads), 1)
+    if _thread_pool is not None and threads != evaluation_threads:
+        if _thread_pool_pid == os.getpid():
+            _thread_pool.close()
+        _thread_pool = None
+    evaluation_threads = threads
+    if chunk:
+        min_chunk = int(chunk)
+
+
+def chunk_bounds(npoints, threads=None, chunk=None):
+    """Split npoints into at most threads (start, stop) ranges
+
+    The ranges are of near equal size and no smaller than chunk points,
+    so short arrays give a single range.
+    """
+
+    if threads is None:
+        threads = evaluation_threads
+    if chunk is None:
+        chunk = min_chunk
+    nchunks = max(min(threads, npoints // max(chunk, 1)), 1)
+    edges = np.linspace(0, npoints, nchunks + 1).astype(int)
+    return zip(edges[:-1], edges[1:])
+
+
+def _evaluate_chunks(func, arrays):
+    """func applied to matching chunks of the arrays on the thread pool"""
+
+    global _thread_pool, _thread_pool_pid
+    bounds = chunk_bounds(len(arrays[0]))
+    if len(bounds) == 1:
+        return func(*arrays)
+    # A forked worker (see pybiosas.parallel) inherits the pool object but
+    # none of its threads, so it starts a pool of its own
+    if _thread_pool is None or _thread_pool_pid != os.getpid():
+        _thread_pool = multiprocessing.pool.ThreadPool(evaluation_threads)
+        _thread_pool_pid = os.getpid()
+    parts = _thread_pool.map(lambda (start, stop):
+                                 func(*[array[start:stop] for array in arrays]),
+                             bounds)
+    return np.concatenate([np.asarray(part, dtype=float) for part in parts])
+
+
+# Curves of models evaluated again at values already tried can be kept in
+# a pybiosas.curvecache.CurveCache. It is off unless set_curve_cache is
+# given a size. Worker processes started after it is set each get their
+# own copy, so its statistics count only the evaluations of this process.
+curve_cache = None
+
+
+def set_curve_cache(size, digits=12):
+    """Keep up to size model curves (0 or None for no cache)"""
+
+    global curve_cache
+    if not size:
+        curve_cache = None
+    elif curve_cache is None or curve_cache.digits != digits:
+        curve_cache = pybiosas.curvecache.CurveCache(size, digits)
+    else:
+        curve_cache.maxsize = size
+    return curve_cache
+
+
+def evaluate_model(model, q):
+    """Evaluate a model over an array of q values in a single call
+
+    SansView models provide evalDistribution which loops over the q
+    array in compiled code, avoiding a Python call per point. With more
+    than one evaluation thread (see set_evaluation_threads) long arrays
+    are split into chunks evaluated concurrently. The components of a
+    composite model are each chunked in turn so that its curve cache
+    still holds whole curves. With a curve cache set (see
+    set_curve_cache) the curves of the components are looked up there
+    first.
+    """
+
+    q = np.asarray(q, dtype=float)
+    if isinstance(model, pybiosas.composite.CompositeModel):
+        return model.evalDistribution(q, evaluate_model)
+    if curve_cache is not None:
+        return curve_cache.evaluate(model, q, _evaluate_uncached)
+    return _evaluate_uncached(model, q)
+
+
+def _evaluate_uncached(model, q):
+    if evaluation_threads == 1:
+        return model.evalDistribution(q)
+    return _evaluate_chunks(model.evalDistribution, [q])
+
+
+def evaluate_model_2d(model, qx, qy):
+    """Evaluate a model at the pixels with the given qx and qy arrays
+
+    SansView models take the pair [qx, qy] in evalDistribution for 2-D
+    evaluation, which depends on the orientation parameters. The pixels
+    are split across threads as for evaluate_model.
+    """
+
+    qx = np.asarray(qx, dtype=float)
+    qy = np.asarray(qy, dtype=float)
+    if evaluation_threads == 1:
+        return model.evalDistribution([qx, qy])
+    return _evaluate_chunks(lambda qx, qy: model.evalDistribution([qx, qy]),
+                            [qx, qy])
+
+
+def evaluate_batch(model, names, values, q):
+    """Evaluate a model for many parameter sets over the same q values
+
+    values is an (nsets, len(names)) array, each row giving the values
+    of the named parameters. Returns an (nsets, len(q)) array of
+    intensities. SansView models hold a single set of scalar parameters
+    so the sets are stepped through in turn, each one evaluated over the
+    whole q array in compiled code. Parameters not named keep whatever
+    value is set in the model.
+    """
+
+    q = np.asarray(q, dtype=float)
+    values = np.atleast_2d(np.asarray(values, dtype=float))
+    out = np.empty((values.shape[0], len(q)))
+    for row, vector in enumerate(values):
+        for name, value in zip(names, vector):
+            model.setParam(name, value)
+        out[row] = evaluate_model(model, q)
+    return out
+
+
+class Residuals:
+    """Callable returning the weighted residuals of a model against data
+
+    Calling the instance with a sequence of values sets each of the
+    Parameter objects in turn and returns (i - model(q)) / sigma as an
+    array, which is the form expected by the pybiosas.optimizers
+    backends. If self.monitor is set (see fit_parameters) it checks
+    every evaluation.
+    """
+
+    def __init__(self, model, parameters, q, i, sigma=None):
+        self.model = model
+        self.parameters = parameters
+        self.q = np.asarray(q, dtype=float)
+        self.i = np.asarray(i, dtype=float)
+        if sigma is None:
+            sigma = np.ones(len(self.q))
+        self.sigma = np.asarray(sigma, dtype=float)
+        self.monitor = None
+
+    def __call__(self, params):
+        for p, value in zip(self.parameters, params):
+            p.set(value)
+        res = (self.i - evaluate_model(self.model, self.q)) / self.sigma
+        if self.monitor is not None:
+            self.monitor.check(params, res)
+        return res
+
+    def chi2(self, params):
+        """Return the weighted sum of squared residuals"""
+
+        res = self(params)
+        return float(np.dot(res, res))
+
 
 class Parameter:
     """
@@ -1,5 +1,40 @@
 # Central repository for model information. Could also contain
 # additional models built up from components
+#
+# A composite model has 'components', a list of [prefix, registered
+# model] pairs, and an 'operator', 'sum' or 'product', in place of the
+# 'library_name' and 'model_name' of a SansView model. Its parameters are
+# those of the components with the prefix added, e.g. 'sphere.radius',
+# plus its own 'background' (and 'scale' for a product). The entries are
+# built from those of the components by composite_entry below; see
+# pybiosas.composite for how they are evaluated.
+#
+# Entries with 'structure_factor' set are interparticle structure
+# factors S(q), only meant to be used as the second component of a
+# product with a form factor. In such a product their parameters are in
+# the entry's 'fixed_params', so they are held fixed unless given in the
+# parameters for a fit and S(q) is computed once and reused for every
+# step of the fit.
+#
+# 'param_info' gives for each parameter the physical 'bounds' as a
+# [lower, upper] pair (None for no limit) and 'x_scale', the typical
+# magnitude of the parameter. These are used by the bounded optimizer
+# backends in pybiosas.optimizers to keep the fit physical and
+# well-conditioned.
+#
+# 'library_grid' gives the default grid of shape parameters used by
+# pybiosas.library to precompute curves for finding starting points, as
+# [first, last, number of points, 'log' or 'lin' spacing].
+#
+# 'test_data' and 'test_params' give a fixture for test/test_modelfit.py,
+# which refits the data from 'test_params' and expects 'exp_vals'.
+# Entries without test data, such as the structure factors, are not
+# refitted there.
+
+try:
+    import pybiosas.composite as composite
+except ImportError:
+    import composite
 
 models = {
            'cylinder' : {
@@ -16,6 +51,20 @@ models = {
                                          {'paramname' : 'scale',
                                           'value'     : 0.01,
                                           'fixed'     : True}],
+                         'param_info'  :{'scale'       : {'bounds'  : [0, None],
+                                                          'x_scale' : 0.01},
+                                         'radius'      : {'bounds'  : [0, None],
+                                                          'x_scale' : 10.0},
+                                         'length'      : {'bounds'  : [0, None],
+                                                          'x_scale' : 100.0},
+                                         'sldCyl'      : {'bounds'  : [None, None],
+                                                          'x_scale' : 1e-6},
+                                         'sldSolv'     : {'bounds'  : [None, None],
+                                                          'x_scale' : 1e-6},
+                                         'background'  : {'bounds'  : [None, None],
+                                                          'x_scale' : 0.1}},
+                         'library_grid':{'radius'     : [5.0, 200.0, 24, 'log'],
+                                         'length'     : [10.0, 2000.0, 24, 'log']},
                          'exp_vals'    :[{'paramname' : 'scale',
                                           'value'     : 0.01},
                                          {'paramname' : 'radius',
@@ -43,6 +92,17 @@ models = {
                                           {'paramname' : 'scale',
                                            'value'     : 0.01,
                                            'fixed'     : True}],
+                         'param_info'  :{'scale'       : {'bounds'  : [0, None],
+                                                          'x_scale' : 0.01},
+                                         'radius'      : {'bounds'  : [0, None],
+                                                          'x_scale' : 10.0},
+                                         'sldSph'      : {'bounds'  : [None, None],
+                                                          'x_scale' : 1e-6},
+                                         'sldSolv'     : {'bounds'  : [None, None],
+                                                          'x_scale' : 1e-6},
+                                         'background'  : {'bounds'  : [None, None],
+                                                          'x_scale' : 0.1}},
+                         'library_grid':{'radius'     : [5.0, 500.0, 100, 'log']},
                          'exp_vals'    :[{'paramname' : 'scale',
                                           'value'     : 0.01},
                                          {'paramname' : 'radius',
@@ -69,6 +129,20 @@ models = {
                                           {'paramname' : 'scale',
                                            'value'     : 0.01,
                                            'fixed'     : True}],
+                         'param_info'  :{'scale'       : {'bounds'  : [0, None],
+                                                          'x_scale' : 0.01},
+                                         'radius_a'    : {'bounds'  : [0, None],
+                                                          'x_scale' : 10.0},
+                                         'radius_b'    : {'bounds'  : [0, None],
+                                                          'x_scale' : 10.0},
+                                         'sldEll'      : {'bounds'  : [None, None],
+                                                          'x_scale' : 1e-6},
+                                         'sldSolv'     : {'bounds'  : [None, None],
+                                                          'x_scale' : 1e-6},
+                                         'background'  : {'bounds'  : [None, None],
+                                                          'x_scale' : 0.1}},
+                         'library_grid':{'radius_a'   : [5.0, 500.0, 24, 'log'],
+                                         'radius_b'   : [5.0, 500.0, 24, 'log']},
                          'exp_vals'    :[{'paramname' : 'scale',
                                           'value'     : 0.01},
                                          {'paramname' : 'radius_a',
@@ -101,6 +175,30 @@ models = {
                                            'value'     : 20},
                                           {'paramname' : 'rim_sld',
                                            'value'     : 4e-6}],
+                         'param_info'  :{'scale'       : {'bounds'  : [0, None],
+                                                          'x_scale' : 0.1},
+                                         'radius'      : {'bounds'  : [0, None],
+                                                          'x_scale' : 10.0},
+                                         'rim_thick'   : {'bounds'  : [0, None],
+                                                          'x_scale' : 10.0},
+                                         'face_thick'  : {'bounds'  : [0, None],
+                                                          'x_scale' : 10.0},
+                                         'length'      : {'bounds'  : [0, None],
+                                                          'x_scale' : 10.0},
+                                         'core_sld'    : {'bounds'  : [None, None],
+                                                          'x_scale' : 1e-6},
+                                         'face_sld'    : {'bounds'  : [None, None],
+                                                          'x_scale' : 1e-6},
+                                         'rim_sld'     : {'bounds'  : [None, None],
+                                                          'x_scale' : 1e-6},
+                                         'solvent_sld' : {'bounds'  : [None, None],
+                                                          'x_scale' : 1e-6},
+                                         'background'  : {'bounds'  : [None, None],
+                                                          'x_scale' : 0.1}},
+                         'library_grid':{'radius'     : [10.0, 500.0, 12, 'log'],
+                                         'rim_thick'  : [2.0, 50.0, 6, 'log'],
+                                         'face_thick' : [2.0, 50.0, 6, 'log'],
+                                         'length'     : [5.0, 500.0, 12, 'log']},
                          'exp_vals'    :[{'paramname' : 'scale',
                                           'value'     : 0.1},
                                          {'paramname' : 'radius',
@@ -147,6 +245,23 @@ models = {
                                           {'paramname' : 'background',
                                            'fixed'     : False,
                                            'value'     : 0.0}],
+                         'param_info'  :{'r_minor'     : {'bounds'  : [0, None],
+                                                          'x_scale' : 10.0},
+                                         'scale'       : {'bounds'  : [0, None],
+                                                          'x_scale' : 1e-3},
+                                         'r_ratio'     : {'bounds'  : [1, None],
+                                                          'x_scale' : 1.0},
+                                         'length'      : {'bounds'  : [0, None],
+                                                          'x_scale' : 100.0},
+                                         'sldCyl'      : {'bounds'  : [None, None],
+                                                          'x_scale' : 1e-6},
+                                         'sldSolv'     : {'bounds'  : [None, None],
+                                                          'x_scale' : 1e-6},
+                                         'background'  : {'bounds'  : [None, None],
+                                                          'x_scale' : 0.1}},
+                         'library_grid':{'r_minor'    : [5.0, 100.0, 20, 'log'],
+                                         'r_ratio'    : [1.0, 6.0, 11, 'lin'],
+                                         'length'     : [50.0, 2000.0, 20, 'log']},
                          'exp_vals'    : [{'paramname' : 'r_minor',
                                            'value'     : 20.0},
                                           {'paramname' : 'scale',
@@ -161,7 +276,105 @@ models = {
                                            'value'     : 1e-6},
                                           {'paramname' : 'background',
                                            'value'     : 0.0}]
+                                   },
+            'hardsphere' : {
+                         'library_name':'HardsphereStructure',
+                         'model_name'  :'HardsphereStructure',
+                         'structure_factor' : True,
+                         'param_info'  :{'effect_radius' : {'bounds'  : [0, None],
+                                                            'x_scale' : 10.0},
+                                         'volfraction'   : {'bounds'  : [0, 0.74],
+                                                            'x_scale' : 0.1}},
+                         'exp_vals'    : [{'paramname' : 'effect_radius',
+                                           'value'     : 50.0},
+                                          {'paramname' : 'volfraction',
+                                           'value'     : 0.2}]
+                                   },
+            'hayterMSA' : {
+                         'library_name':'HayterMSAStructure',
+                         'model_name'  :'HayterMSAStructure',
+                         'structure_factor' : True,
+                         'param_info'  :{'effect_radius' : {'bounds'  : [0, None],
+                                                            'x_scale' : 10.0},
+                                         'charge'        : {'bounds'  : [0, None],
+                                                            'x_scale' : 10.0},
+                                         'volfraction'   : {'bounds'  : [0, 0.74],
+                                                            'x_scale' : 0.01},
+                                         'temperature'   : {'bounds'  : [0, None],
+                                                            'x_scale' : 100.0},
+                                         'saltconc'      : {'bounds'  : [0, None],
+                                                            'x_scale' : 0.1},
+                                         'dielectconst'  : {'bounds'  : [1, None],
+                                                            'x_scale' : 10.0}},
+                         'exp_vals'    : [{'paramname' : 'effect_radius',
+                                           'value'     : 20.75},
+                                          {'paramname' : 'charge',
+                                           'value'     : 19.0},
+                                          {'paramname' : 'volfraction',
+                                           'value'     : 0.0192},
+                                          {'paramname' : 'temperature',
+                                           'value'     : 318.16},
+                                          {'paramname' : 'saltconc',
+                                           'value'     : 0.0},
+                                          {'paramname' : 'dielectconst',
+                                           'value'     : 71.08}]
                                    }
                                           
 
         }
+
+
+def composite_entry(components, operator='sum'):
+    """Build the registry entry for a composite of registered models
+
+    The 'param_info' and 'exp_vals' of the components are copied with
+    the prefix added to each parameter name, leaving out the parameters
+    the composite holds fixed. The parameters of structure factors are
+    listed in 'fixed_params', which are held fixed in a fit unless they
+    are given in the parameters. Composites have no test data of
+    their own, so test/test_modelfit.py does not refit them.
+    """
+
+    hidden = composite.hidden_params(operator)
+    own = composite.own_params(operator)
+
+    entry = {'components'  : components,
+             'operator'    : operator,
+             'param_info'  : {'scale'      : {'bounds'  : [0, None],
+                                             'x_scale' : 1.0},
+                              'background' : {'bounds'  : [None, None],
+                                             'x_scale' : 0.1}},
+             'exp_vals'    : [],
+             'fixed_params': []}
+    for name in ['scale', 'background']:
+        if name not in own:
+            del entry['param_info'][name]
+    for name in sorted(own.keys(), reverse=True):
+        entry['exp_vals'].append({'paramname' : name,
+                                  'value'     : own[name]})
+
+    for prefix, model in components:
+        fixed = models[model].get('structure_factor', False)
+        for name, info in models[model]['param_info'].items():
+            if name not in hidden:
+                entry['param_info'][prefix + '.' + name] = dict(info)
+        for par in models[model]['exp_vals']:
+            if par['paramname'] not in hidden:
+                entry['exp_vals'].append({'paramname' : prefix + '.' +
+                                                        par['paramname'],
+                                          'value'     : par['value']})
+                if fixed:
+                    entry['fixed_params'].append(prefix + '.' +
+                                                 par['paramname'])
+    return entry
+
+
+models['sphere+cylinder'] = composite_entry([['sphere', 'sphere'],
+                                             ['cylinder', 'cylinder']])
+
+for form in ['sphere', 'cylinder', 'ellipticalCylinder']:
+    for structure in ['hardsphere', 'hayterMSA']:
+        models[form + '*' + structure] = composite_entry([[form, form],
+                                                          [structure,
+                                                           structure]],
+                                                         'product')
@@ -0,0 +1,98 @@
+# PyBioSas.monitor: Stop fits that have stopped making progress
+#
+# Public Domain Waiver:
+# To the extent possible under law, Cameron Neylon has waived all
+# copyright and related or neighboring rights to monitor.py
+# This work is published from United Kingdom.
+#
+# See http://creativecommons.org/publicdomain/zero/1.0/
+#
+# A fit from a poor starting point can wander off into nonsense,
+# negative radii or a scale collapsing to zero, and still run on to the
+# full maxfev evaluations. A FitMonitor is handed every set of values
+# the optimizer tries along with the residuals, and aborts the fit by
+# raising FitAborted when
+#
+#   'timeout'      the fit has run for longer than timeout seconds
+#   'stagnated'    chi2 has not improved by a fraction tolerance of its
+#                  best value in the last patience evaluations
+#   'out of bounds' a value has left the bounds of its parameter (see
+#                  modelling.param_info), which only the unbounded
+#                  leastsq backend allows
+#   'collapsed'    a value bounded below by zero has fallen below
+#                  collapse times its starting value
+#   'not finite'   the residuals are nan or infinite
+#
+# modelling.fit_parameters catches FitAborted and returns the best
+# values seen before the abort as an unsuccessful fit, with the reason
+# in info['aborted'].
+
+import time
+import numpy as np
+
+
+class FitAborted(Exception):
+    """Raised by FitMonitor.check with the reason the fit was stopped"""
+
+    def __init__(self, reason):
+        Exception.__init__(self, reason)
+        self.reason = reason
+
+
+class FitMonitor:
+    """Checks the progress of a fit at every evaluation
+
+    Any of timeout, patience and check_bounds left at None or False
+    turns that test off. Call start at the beginning of every fit.
+    """
+
+    def __init__(self, timeout=None, patience=None, tolerance=1e-6,
+                 check_bounds=False, collapse=1e-6):
+        self.timeout = timeout
+        self.patience = patience
+        self.tolerance = tolerance
+        self.check_bounds = check_bounds
+        self.collapse = collapse
+        self.start()
+
+    def start(self, p0=None, bounds=None):
+        """Reset the clock and the best chi2 for a fit from p0"""
+
+        self.start_time = time.time()
+        self.nfev = 0
+        self.best_chi2 = np.inf
+        self.best_values = None
+        self.last_improvement = 0
+        self.lower = self.upper = self.floor = None
+        if p0 is not None and bounds is not None:
+            p0 = np.abs(np.asarray(p0, dtype=float))
+            self.lower = np.array([pair[0] if pair and pair[0] is not None
+                                   else -np.inf for pair in bounds])
+            self.upper = np.array([pair[1] if pair and pair[1] is not None
+                                   else np.inf for pair in bounds])
+            self.floor = np.where(self.lower == 0, self.collapse * p0, -np.inf)
+
+    def check(self, values, residuals):
+        """Record an evaluation, raising FitAborted if the fit should stop"""
+
+        self.nfev += 1
+        values = np.asarray(values, dtype=float)
+        if not np.all(np.isfinite(residuals)):
+            raise FitAborted, 'not finite'
+        if self.check_bounds and self.lower is not None:
+            if np.any(values < self.lower) or np.any(values > self.upper):
+                raise FitAborted, 'out of bounds'
+            if np.any(values < self.floor):
+                raise FitAborted, 'collapsed'
+
+        chi2 = float(np.dot(residuals, residuals))
+        if chi2 < self.best_chi2 * (1 - self.tolerance):
+            self.last_improvement = self.nfev
+        if chi2 < self.best_chi2:
+            self.best_chi2 = chi2
+            self.best_values = values.copy()
+
+        if self.timeout and time.time() - self.start_time > self.timeout:
+            raise FitAborted, 'timeout'
+        if self.patience and self.nfev - self.last_improvement > self.patience:
+            raise FitAborted, 'stagnated'
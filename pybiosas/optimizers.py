@@ -0,0 +1,256 @@
+# PyBioSas.optimizers: Interchangeable least squares backends for
+# ModelWrapper.fit
+#
+# Public Domain Waiver:
+# To the extent possible under law, Cameron Neylon has waived all
+# copyright and related or neighboring rights to optimizers.py
+# This work is published from United Kingdom.
+#
+# See http://creativecommons.org/publicdomain/zero/1.0/
+#
+# Each backend takes a residual function, a list of starting values
+# and optionally a list of (lower, upper) bounds and a list of typical
+# parameter scales. They all return the same five-tuple as
+# scipy.optimize.leastsq with full_output set so that they can be
+# swapped without changing the calling code:
+#
+#     (fitted values, cov_x, info dict, message, success)
+#
+# cov_x is the unscaled covariance estimate (J^T J)^-1 in the units of
+# the parameters and info['nfev'] is the number of calls made to the
+# residual function, including those used for finite difference
+# Jacobians, so that backends can be compared on an equal footing.
+
+import numpy as np
+import scipy.optimize
+
+
+class CountedFunction:
+    """Wrap a residual function and count the number of times it is called"""
+
+    def __init__(self, func):
+        self.func = func
+        self.ncalls = 0
+
+    def __call__(self, params):
+        self.ncalls += 1
+        return self.func(params)
+
+
+def split_bounds(bounds, npar):
+    """Convert a list of (lower, upper) pairs to two arrays
+
+    None for either limit, or for the whole pair, is converted to the
+    appropriate infinity.
+    """
+
+    lower = -np.inf * np.ones(npar)
+    upper = np.inf * np.ones(npar)
+    if bounds is None:
+        return lower, upper
+
+    for j, pair in enumerate(bounds):
+        if pair is None:
+            continue
+        if pair[0] is not None:
+            lower[j] = pair[0]
+        if pair[1] is not None:
+            upper[j] = pair[1]
+
+    return lower, upper
+
+
+def clip_to_bounds(p, lower, upper):
+    """Move starting values that lie on or outside a bound just inside it"""
+
+    p = np.array(p, dtype=float)
+    span = np.where(np.isfinite(upper - lower), upper - lower, 1.0)
+    margin = 1e-10 * np.maximum(np.abs(p), span)
+    p = np.where(p <= lower, lower + margin, p)
+    p = np.where(p >= upper, upper - margin, p)
+    return p
+
+
+def covariance_from_jacobian(jac):
+    """Estimate (J^T J)^-1 from a Jacobian using a truncated SVD"""
+
+    jac = np.atleast_2d(jac)
+    u, s, vt = np.linalg.svd(jac, full_matrices=False)
+    if s.size == 0 or s[0] == 0:
+        return None
+    threshold = np.finfo(float).eps * max(jac.shape) * s[0]
+    keep = s > threshold
+    s = s[keep]
+    vt = vt[keep]
+    return np.dot(vt.T / s ** 2, vt)
+
+
+def leastsq(func, p0, bounds=None, x_scale=None, maxfev=None):
+    """MINPACK Levenberg-Marquardt via scipy.optimize.leastsq
+
+    This is the original behaviour of ModelWrapper.fit. Bounds and
+    parameter scales are ignored so that existing fits are reproduced
+    exactly.
+    """
+
+    counted = CountedFunction(func)
+    if maxfev is None:
+        maxfev = 1000 * len(p0)
+    out, cov_x, info, mesg, ier = scipy.optimize.leastsq(counted, p0,
+                                                         full_output=1,
+                                                         maxfev=maxfev)
+    info['nfev'] = counted.ncalls
+    success = ier in [1, 2, 3, 4] and cov_x is not None
+    return np.atleast_1d(out), cov_x, info, mesg, success
+
+
+def trust_region(func, p0, bounds=None, x_scale=None, maxfev=None):
+    """Bounded trust region reflective fit via scipy.optimize.least_squares
+
+    Bounds are enforced at every evaluation and x_scale is passed
+    through so that parameters with very different magnitudes (scale
+    around 1e-3, SLDs around 1e-6 and lengths in the hundreds) are
+    stepped in comparable units.
+    """
+
+    counted = CountedFunction(func)
+    lower, upper = split_bounds(bounds, len(p0))
+    p0 = clip_to_bounds(p0, lower, upper)
+    if x_scale is None:
+        x_scale = 1.0
+    if maxfev is None:
+        maxfev = 1000 * len(p0)
+
+    result = scipy.optimize.least_squares(counted, p0,
+                                          bounds=(lower, upper),
+                                          x_scale=x_scale,
+                                          method='trf',
+                                          max_nfev=maxfev)
+    cov_x = covariance_from_jacobian(result.jac)
+    info = {'nfev' : counted.ncalls,
+            'fvec' : result.fun,
+            'njev' : result.njev,
+            'status' : result.status}
+    success = result.success and cov_x is not None
+    return result.x, cov_x, info, result.message, success
+
+
+class BoundsTransform:
+    """Map between bounded external and unbounded internal parameters
+
+    Uses the same transformations as MINUIT so that an unbounded
+    Levenberg-Marquardt solver can be used on a bounded problem. Two
+    sided bounds use a sine transform and single sided bounds a square
+    root transform. Unbounded parameters pass through unchanged.
+    """
+
+    def __init__(self, lower, upper):
+        self.lower = lower
+        self.upper = upper
+        self.has_lower = np.isfinite(lower)
+        self.has_upper = np.isfinite(upper)
+        self.both = self.has_lower & self.has_upper
+        self.lower_only = self.has_lower & ~self.has_upper
+        self.upper_only = self.has_upper & ~self.has_lower
+
+    def to_external(self, u):
+        u = np.asarray(u, dtype=float)
+        p = u.copy()
+        lo = self.lower
+        hi = self.upper
+        p[self.both] = (lo[self.both] + (hi[self.both] - lo[self.both]) *
+                        (np.sin(u[self.both]) + 1.0) / 2.0)
+        p[self.lower_only] = (lo[self.lower_only] - 1.0 +
+                              np.sqrt(u[self.lower_only] ** 2 + 1.0))
+        p[self.upper_only] = (hi[self.upper_only] + 1.0 -
+                              np.sqrt(u[self.upper_only] ** 2 + 1.0))
+        return p
+
+    def to_internal(self, p):
+        p = np.asarray(p, dtype=float)
+        u = p.copy()
+        lo = self.lower
+        hi = self.upper
+        u[self.both] = np.arcsin(2.0 * (p[self.both] - lo[self.both]) /
+                                 (hi[self.both] - lo[self.both]) - 1.0)
+        u[self.lower_only] = np.sqrt((p[self.lower_only] -
+                                      lo[self.lower_only] + 1.0) ** 2 - 1.0)
+        u[self.upper_only] = np.sqrt((hi[self.upper_only] -
+                                      p[self.upper_only] + 1.0) ** 2 - 1.0)
+        return u
+
+    def derivative(self, u):
+        """Return dp/du for each parameter, used to transform cov_x"""
+
+        u = np.asarray(u, dtype=float)
+        d = np.ones(len(u))
+        lo = self.lower
+        hi = self.upper
+        d[self.both] = (hi[self.both] - lo[self.both]) * np.cos(u[self.both]) / 2.0
+        d[self.lower_only] = u[self.lower_only] / np.sqrt(u[self.lower_only] ** 2 + 1.0)
+        d[self.upper_only] = -u[self.upper_only] / np.sqrt(u[self.upper_only] ** 2 + 1.0)
+        return d
+
+
+def bounded_lm(func, p0, bounds=None, x_scale=None, maxfev=None):
+    """Levenberg-Marquardt with bounds enforced by a variable transform
+
+    The fit is run with MINPACK on the internal (unbounded) variables
+    defined by BoundsTransform, so the optimizer can never evaluate the
+    model outside the bounds. Typical scales are applied through the
+    leastsq diag argument for parameters that are unbounded; bounded
+    parameters are already of order one in the internal space.
+    """
+
+    counted = CountedFunction(func)
+    lower, upper = split_bounds(bounds, len(p0))
+    transform = BoundsTransform(lower, upper)
+    u0 = transform.to_internal(clip_to_bounds(p0, lower, upper))
+
+    diag = None
+    if x_scale is not None:
+        scales = np.ones(len(p0)) * np.asarray(x_scale, dtype=float)
+        free = ~(transform.has_lower | transform.has_upper)
+        diag = np.where(free, 1.0 / scales, 1.0)
+    if maxfev is None:
+        maxfev = 1000 * len(p0)
+
+    def internal(u):
+        return counted(transform.to_external(u))
+
+    u, cov_u, info, mesg, ier = scipy.optimize.leastsq(internal, u0,
+                                                       full_output=1,
+                                                       maxfev=maxfev,
+                                                       diag=diag)
+    u = np.atleast_1d(u)
+    out = transform.to_external(u)
+
+    cov_x = None
+    if cov_u is not None:
+        d = transform.derivative(u)
+        cov_x = cov_u * np.outer(d, d)
+
+    info['nfev'] = counted.ncalls
+    success = ier in [1, 2, 3, 4] and cov_x is not None
+    return out, cov_x, info, mesg, success
+
+
+# Registry of the available backends, keyed by the name used on the
+# command line (modelling.py --optimizer)
+optimizers = {
+              'leastsq'   : leastsq,
+              'trf'       : trust_region,
+              'lmbounded' : bounded_lm
+             }
+
+
+def minimise(optimizer, func, p0, bounds=None, x_scale=None, maxfev=None):
+    """Run a fit with the named optimizer backend"""
+
+    try:
+        backend = optimizers[optimizer]
+    except KeyError:
+        raise ValueError, ("Unknown optimizer: " + str(optimizer) +
+                           " Available optimizers are " + str(optimizers.keys()))
+
+    return backend(func, p0, bounds=bounds, x_scale=x_scale, maxfev=maxfev)
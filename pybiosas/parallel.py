@@ -0,0 +1,108 @@
+# PyBioSas.parallel: Process pools whose workers hold their own model
+#
+# Public Domain Waiver:
+# To the extent possible under law, Cameron Neylon has waived all
+# copyright and related or neighboring rights to parallel.py
+# This work is published from United Kingdom.
+#
+# See http://creativecommons.org/publicdomain/zero/1.0/
+#
+# SansView model instances are compiled extension objects that can not
+# be pickled, so they can not be sent to worker processes. Instead each
+# worker imports the model once when it starts and keeps it, along with
+# the parameter list and any shared arrays (typically the data), in a
+# module level state dictionary. Tasks are then just the small item that
+# varies (a random seed, a parameter vector, a chunk of a grid) and a
+# module level function taking (state, item) that does the work.
+
+import copy
+import multiprocessing
+try:
+    import pybiosas.modelling as modelling
+except ImportError:
+    import modelling
+
+_state = {}
+
+
+def _init_worker(model, parameters, shared):
+    """Pool initializer: import the model and store the worker state"""
+
+    _state.clear()
+    _state['model'] = model
+    if model is not None:
+        _state['model_func'] = modelling.load_model(model)
+        _state['parameters'] = modelling.complete_parameters(
+                                   _state['model_func'], copy.deepcopy(parameters))
+    else:
+        _state['model_func'] = None
+        _state['parameters'] = copy.deepcopy(parameters)
+    if shared:
+        _state.update(shared)
+
+
+def _call(task):
+    func, item = task
+    return func(_state, item)
+
+
+def reset_parameters(state):
+    """Return a fresh copy of the worker's parameter list set in its model
+
+    Tasks that change parameter values call this first so that every task
+    starts from the parameters the pool was created with.
+    """
+
+    parameters = copy.deepcopy(state['parameters'])
+    if state['model_func'] is not None:
+        modelling.complete_parameters(state['model_func'], parameters)
+    return parameters
+
+
+class ModelPool:
+    """A pool of worker processes each holding an instance of a model
+
+    model is a registered model name and parameters a parameter list as
+    taken by ModelWrapper. shared is an optional dictionary of further
+    values (numpy arrays of the data for example) made available to every
+    task. With processes=1 tasks are run in this process, which avoids
+    the cost of starting workers for small jobs.
+    """
+
+    def __init__(self, model, parameters, shared=None, processes=None):
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        self.processes = processes
+        self.initargs = (model, parameters, shared)
+        if processes == 1:
+            self.pool = None
+            _init_worker(*self.initargs)
+        else:
+            self.pool = multiprocessing.Pool(processes, _init_worker,
+                                             self.initargs)
+
+    def map(self, func, items, chunksize=1):
+        """Apply func(state, item) to each item and return the results in order
+
+        func must be a module level function so that it can be sent to
+        the workers.
+        """
+
+        tasks = [(func, item) for item in items]
+        if self.pool is None:
+            return map(_call, tasks)
+        return self.pool.map(_call, tasks, chunksize)
+
+    def imap_unordered(self, func, items, chunksize=1):
+        """As map but yield results as they complete"""
+
+        tasks = [(func, item) for item in items]
+        if self.pool is None:
+            return (_call(task) for task in tasks)
+        return self.pool.imap_unordered(_call, tasks, chunksize)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
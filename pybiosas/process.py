@@ -1,9 +1,21 @@
+# Collect the fits written by a sweep, sort them by chi2 and group the
+# fits that reached the same minimum.
+#
+# Fits written in lean mode (modelling.py --lean) hold no fitted curve.
+# With --top N the curve of the best fit in each of the N lowest minima
+# is calculated from the fitted parameters and added to its file as
+# data_out, so only the fits worth looking at pay for the curve.
+
 import json
 import os
 import os.path
 import optparse
 import models
 REGISTERED_MODELS = models.models
+try:
+    import pybiosas.modelling as modelling
+except ImportError:
+    import modelling
 
 def compare_chi2(first_fit, second_fit):
     diff = first_fit[0]*1e10 - second_fit[0]*1e10
@@ -24,64 +36,106 @@ def approx_equal(x, y, tol=1e-18, rel=1e-7):
     assert tests
     return abs(x - y) <= max(tests)
 
-parser = optparse.OptionParser()
-parser.add_option('-p', '--path', dest = 'path', type = str,
-                  help = "Path to a folder of data to process")
-
-(options, args) = parser.parse_args()
-if options.path:
-    directory = options.path
-else:
-    directory = raw_input("Path to data?")
-
-fit_list = []
-
-for file in os.listdir(directory):
-    if file[len(file)-4:len(file)] == 'json':
-
-        fit = []
-        path = os.path.join(directory, file)
-        print directory, file
-        with open(path, 'r') as f:
-            output = json.load(f)
-
-        if 'fit' in output:
-            model = output['model']
-            params = [p['paramname'] for p in REGISTERED_MODELS[model]['exp_vals']]
-            params.insert(0, 'chi2')
-
-            for param in params:
-                param_value = float(output['fit'][param]['value'])
-                fit.append(param_value)
-            fit.append(file)
-            fit_list.append(fit)
-
-fit_list.sort(compare_chi2)
-
-print params
-for fit in fit_list:
-    print fit
-
-concatenated = [fit_list[0]]
-count = 1
-i=0
-while i < len(fit_list)-1:
-    if approx_equal(fit_list[i][0], fit_list[i+1][0], rel=1e-6):
-        count+=1
+def fitted_parameters(output):
+    """The fitted parameter list from the 'fit' section of an output"""
+
+    return [value for value in output['fit'].values()
+            if isinstance(value, dict) and 'paramname' in value]
+
+
+def regenerate_curve(output, q=None):
+    """Calculate the fitted curve of an output, returning (q, i)
+
+    The curve is calculated at the q values of the dataset that was
+    fitted unless q is given.
+    """
+
+    model_func = modelling.load_model(output['model'])
+    parameters = [{'paramname' : par['paramname'], 'value' : par['value']}
+                  for par in fitted_parameters(output)]
+    modelling.complete_parameters(model_func, parameters)
+    if q is None:
+        q = modelling.load_dataset(output['dataset']['path']).q
+    q = [float(value) for value in q]
+    i = modelling.evaluate_model(model_func, q)
+    return q, [float(value) for value in i]
+
+
+def add_curve(path, q=None):
+    """Add the regenerated fitted curve to an output file as data_out"""
+
+    f = open(path, 'r')
+    output = json.load(f)
+    f.close()
+    q, i = regenerate_curve(output, q)
+    output['data_out'] = {'q'     : json.dumps(q),
+                          'i'     : json.dumps(i),
+                          'units' : 'A^-1'}
+    f = open(path, 'w')
+    json.dump(output, f)
+    f.close()
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser()
+    parser.add_option('-p', '--path', dest = 'path', type = str,
+                      help = "Path to a folder of data to process")
+    parser.add_option('-n', '--top', dest = 'top', type = int, default = 0,
+                      help = """Add the fitted curve to the best fit of each of
+                      this many of the lowest minima, for output written
+                      with --lean""")
+
+    (options, args) = parser.parse_args()
+    if options.path:
+        directory = options.path
     else:
-        fit_list[i].append(count)
-        concatenated.append(fit_list[i+1])
-        count = 1
-    i+=1
-
-print '\n\n'
-print params
-for fit in concatenated:
-    print fit
-    
-
-
-
-        
-        
-
+        directory = raw_input("Path to data?")
+
+    fit_list = []
+
+    for file in os.listdir(directory):
+        if file[len(file)-4:len(file)] == 'json':
+
+            fit = []
+            path = os.path.join(directory, file)
+            print directory, file
+            with open(path, 'r') as f:
+                output = json.load(f)
+
+            if 'fit' in output:
+                model = output['model']
+                params = [p['paramname'] for p in REGISTERED_MODELS[model]['exp_vals']]
+                params.insert(0, 'chi2')
+
+                for param in params:
+                    param_value = float(output['fit'][param]['value'])
+                    fit.append(param_value)
+                fit.append(file)
+                fit_list.append(fit)
+
+    fit_list.sort(compare_chi2)
+
+    print params
+    for fit in fit_list:
+        print fit
+
+    concatenated = [fit_list[0]]
+    count = 1
+    i=0
+    while i < len(fit_list)-1:
+        if approx_equal(fit_list[i][0], fit_list[i+1][0], rel=1e-6):
+            count+=1
+        else:
+            fit_list[i].append(count)
+            concatenated.append(fit_list[i+1])
+            count = 1
+        i+=1
+
+    print '\n\n'
+    print params
+    for fit in concatenated:
+        print fit
+
+    for fit in concatenated[:options.top]:
+        print "Adding the fitted curve to", fit[len(params)]
+        add_curve(os.path.join(directory, fit[len(params)]))
@@ -0,0 +1,287 @@
+# PyBioSas.ranking: Fit several models to one dataset and rank them
+#
+# Public Domain Waiver:
+# To the extent possible under law, Cameron Neylon has waived all
+# copyright and related or neighboring rights to ranking.py
+# This work is published from United Kingdom.
+#
+# See http://creativecommons.org/publicdomain/zero/1.0/
+#
+# The dataset is loaded, masked and weighted once and shared with the
+# workers of a pybiosas.parallel.ModelPool when they start. Each model is then one task: the
+# worker loads the model, fits it from each of its starting points and
+# returns the best. The models are ranked by chi2 and by the Akaike and
+# Bayesian information criteria, which penalise the extra free
+# parameters of the more complex models:
+#
+#     with uncertainties      AIC = chi2 + 2k        BIC = chi2 + k ln(n)
+#     without                 AIC = n ln(chi2/n) + 2k, and likewise BIC
+#
+# for k free parameters and n data points. The Akaike weight of each
+# model is its relative likelihood exp(-dAIC/2), normalised over the
+# models compared.
+#
+# Usage from the command line:
+#
+#     python ranking.py -d q48.txt -m sphere,cylinder,ellipse,ellipticalCylinder \
+#            --starts 8 -o q48_ranking.json
+
+import optparse
+import multiprocessing
+import copy
+import json
+import time
+import os
+import os.path
+import numpy as np
+try:
+    import pybiosas.modelling as modelling
+    import pybiosas.models as models
+    import pybiosas.parallel as parallel
+except ImportError:
+    import modelling
+    import models
+    import parallel
+
+
+def default_models():
+    """The registered form factor models
+
+    Composites and structure factors are left out but can be ranked by
+    naming them.
+    """
+
+    return sorted([name for name, entry in models.models.items()
+                   if 'library_name' in entry and
+                   not entry.get('structure_factor', False)])
+
+
+def default_parameters(model):
+    """Starting parameters for a model from its registry 'exp_vals'
+
+    Scattering length densities are held fixed as they are degenerate
+    with the scale.
+    """
+
+    parameters = copy.deepcopy(models.models[model]['exp_vals'])
+    for par in parameters:
+        if 'sld' in par['paramname'].lower():
+            par['fixed'] = True
+    return parameters
+
+
+def random_starts(model, parameters, nstarts, spread=3.0, seed=0):
+    """The parameters followed by nstarts - 1 randomised copies
+
+    Each free value is multiplied by a factor drawn log-uniformly
+    between 1 / spread and spread, then clipped to its bounds.
+    """
+
+    random = np.random.RandomState(seed)
+    starts = [copy.deepcopy(parameters)]
+    for j in range(nstarts - 1):
+        start = copy.deepcopy(parameters)
+        for par in start:
+            if par.get('fixed', False):
+                continue
+            value = par['value'] * spread ** random.uniform(-1, 1)
+            lower, upper = modelling.param_info(model, par)[0]
+            if lower is not None:
+                value = max(value, lower)
+            if upper is not None:
+                value = min(value, upper)
+            par['value'] = value
+        starts.append(start)
+    return starts
+
+
+def _fit_model(state, task):
+    """Fit one model from each of its starts and return the best"""
+
+    model, starts = task
+    start_time = time.time()
+    best = None
+    nfev = 0
+    error = None
+    try:
+        model_func = modelling.load_model(model)
+    except Exception, error:
+        starts = []
+    for start in starts:
+        parameters = modelling.complete_parameters(model_func,
+                                                   copy.deepcopy(start))
+        try:
+            result = modelling.fit_parameters(model_func, model, parameters,
+                                              state['q'], state['i'],
+                                              state['sigma'],
+                                              state['optimizer'])
+        except Exception, error:
+            continue
+        nfev += result[2]['nfev']
+        if best is None or result[5] < best[0]:
+            best = (result[5], parameters, bool(result[4]))
+
+    out = {'model'   : model,
+           'seconds' : time.time() - start_time,
+           'nfev'    : nfev,
+           'starts'  : len(starts)}
+    if best is not None:
+        out.update({'chi2'       : best[0],
+                    'parameters' : best[1],
+                    'success'    : best[2],
+                    'k'          : len([par for par in best[1]
+                                        if not par.get('fixed', False)])})
+    elif error is not None:
+        out['error'] = repr(error)
+    return out
+
+
+def information_criteria(results, npoints, true_chi2):
+    """Add aic, bic, delta_aic and akaike_weight to each fitted result
+
+    true_chi2 says whether chi2 is weighted by measured uncertainties.
+    """
+
+    fitted = [result for result in results if 'chi2' in result]
+    for result in fitted:
+        k = result['k']
+        if true_chi2:
+            fit_term = result['chi2']
+        else:
+            fit_term = npoints * np.log(max(result['chi2'], 1e-300) / npoints)
+        result['aic'] = float(fit_term + 2 * k)
+        result['bic'] = float(fit_term + k * np.log(npoints))
+        result['reduced_chi2'] = result['chi2'] / max(npoints - k, 1)
+
+    if fitted:
+        best = min([result['aic'] for result in fitted])
+        for result in fitted:
+            result['delta_aic'] = result['aic'] - best
+        total = sum([np.exp(-result['delta_aic'] / 2.0) for result in fitted])
+        for result in fitted:
+            result['akaike_weight'] = float(np.exp(-result['delta_aic'] / 2.0)
+                                            / total)
+    return results
+
+
+def rank_models(data, model_names=None, parameters=None, nstarts=5,
+                weighting='auto', optimizer='leastsq', processes=None,
+                criterion='aic', seed=0):
+    """Fit each model to the data concurrently and rank the results
+
+    parameters is an optional dictionary of model name to starting
+    parameters, defaulting to default_parameters. Each model is fitted
+    from nstarts starts (see random_starts). Returns the list of result
+    dictionaries ordered by criterion ('chi2', 'aic' or 'bic'), models
+    that could not be fitted last.
+    """
+
+    if model_names is None:
+        model_names = default_models()
+    if parameters is None:
+        parameters = {}
+    sigma = data.sigma(weighting)
+    true_chi2 = (weighting == 'errors' or
+                 (weighting == 'auto' and data.err is not None and
+                  np.any(data.err > 0)))
+
+    tasks = []
+    for model in model_names:
+        if model in parameters:
+            start = parameters[model]
+        else:
+            start = default_parameters(model)
+        tasks.append((model, random_starts(model, start, nstarts,
+                                           seed = seed)))
+
+    if processes is None:
+        processes = min(multiprocessing.cpu_count(), len(tasks))
+    pool = parallel.ModelPool(None, [],
+                              shared = {'q'         : data.q,
+                                        'i'         : data.i,
+                                        'sigma'     : sigma,
+                                        'optimizer' : optimizer},
+                              processes = processes)
+    try:
+        results = pool.map(_fit_model, tasks)
+    finally:
+        pool.close()
+
+    information_criteria(results, len(data), true_chi2)
+    results.sort(key=lambda result: result.get(criterion, np.inf))
+    return results
+
+
+def format_table(results):
+    """Ranked results as a text table"""
+
+    lines = ['%-24s %4s %12s %12s %12s %8s %8s %8s' %
+             ('model', 'k', 'chi2', 'AIC', 'BIC', 'weight', 'seconds',
+              'nfev')]
+    for result in results:
+        if 'chi2' not in result:
+            lines.append('%-24s failed' % result['model'])
+            continue
+        lines.append('%-24s %4d %12.5g %12.5g %12.5g %8.3f %8.1f %8d' %
+                     (result['model'], result['k'], result['chi2'],
+                      result['aic'], result['bic'], result['akaike_weight'],
+                      result['seconds'], result['nfev']))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser()
+    parser.add_option('-d', '--dataset', type = str, dest = 'dataset',
+                      help = "The dataset to fit")
+    parser.add_option('-m', '--models', type = str, dest = 'models',
+                      default = None,
+                      help = """Comma separated models to compare, defaults
+                      to all the registered form factors""")
+    parser.add_option('-p', '--parameters', type = str, dest = 'parameters',
+                      default = None,
+                      help = """Json file or string of a dictionary of model
+                      name to starting parameters""")
+    parser.add_option('--starts', type = int, dest = 'starts', default = 5,
+                      help = "Number of starting points for each model")
+    parser.add_option('-w', '--weighting', type = str, dest = 'weighting',
+                      default = 'auto', help = "Weighting as for modelling.py")
+    parser.add_option('-f', '--optimizer', type = str, dest = 'optimizer',
+                      default = 'leastsq', help = "Optimizer backend")
+    parser.add_option('-c', '--criterion', type = str, dest = 'criterion',
+                      default = 'aic', help = "Rank by chi2, aic or bic")
+    parser.add_option('--qmin', type = float, dest = 'qmin', default = None)
+    parser.add_option('--qmax', type = float, dest = 'qmax', default = None)
+    parser.add_option('-j', '--processes', type = int, dest = 'processes',
+                      default = None, help = "Number of worker processes")
+    parser.add_option('-o', '--outpath', type = str, dest = 'outpath',
+                      default = None, help = "Path for the json results")
+
+    (options, args) = parser.parse_args()
+    parameters = None
+    if options.parameters:
+        if os.path.isfile(options.parameters):
+            f = open(options.parameters, 'r')
+            parameters = json.load(f)
+            f.close()
+        else:
+            parameters = json.loads(options.parameters)
+    model_names = None
+    if options.models:
+        model_names = options.models.split(',')
+
+    data = modelling.load_dataset(options.dataset)
+    if options.qmin is not None or options.qmax is not None:
+        data.mask_q_range(options.qmin, options.qmax)
+    results = rank_models(data.masked, model_names, parameters, options.starts,
+                          options.weighting, options.optimizer,
+                          options.processes, options.criterion)
+    print format_table(results)
+
+    if options.outpath:
+        f = open(options.outpath, 'w')
+        json.dump({'dataset'   : options.dataset,
+                   'criterion' : options.criterion,
+                   'weighting' : options.weighting,
+                   'npoints'   : len(data.masked),
+                   'results'   : results}, f)
+        f.close()
@@ -0,0 +1,237 @@
+# PyBioSas.reduction: Background subtraction and normalisation of many
+# frames of 1-D data
+#
+# Public Domain Waiver:
+# To the extent possible under law, Cameron Neylon has waived all
+# copyright and related or neighboring rights to reduction.py
+# This work is published from United Kingdom.
+#
+# See http://creativecommons.org/publicdomain/zero/1.0/
+#
+# Each sample frame is reduced as
+#
+#     I = scale * ((sample - empty) * sample_norm
+#                  - (background - empty) * background_norm)
+#
+# where empty is the empty cell, background the solvent or buffer and
+# the norms are per frame factors such as 1 / (transmission * thickness).
+# Any of background and empty can be left out. All the curves are put on
+# a common q grid by linear interpolation, restricted to the range they
+# all cover, and the errors are propagated through the interpolation,
+# the subtraction and the scaling. The empty cell appears in both terms,
+# so it is collected into a single term before the errors are added,
+#
+#     I = scale * (sample_norm * sample - background_norm * background
+#                  + (background_norm - sample_norm) * empty)
+#
+# and its error cancels when the two norms are equal.
+#
+# Many frames are reduced across a process pool. The background and
+# empty cell are read once and shared with the workers, each of which
+# reads, reduces and writes one frame at a time so only a few frames are
+# ever held in memory. The reduced frames are written as q, i, err
+# columns that modelling.py can fit directly.
+#
+# Usage from the command line:
+#
+#     python reduction.py -b buffer.txt -e empty.txt -o reduced/ frame*.txt
+
+import optparse
+import json
+import os
+import os.path
+import numpy as np
+try:
+    import pybiosas.sas_utils as sas_utils
+    import pybiosas.modelling as modelling
+    import pybiosas.parallel as parallel
+except ImportError:
+    import sas_utils
+    import modelling
+    import parallel
+
+
+def common_q(datasets, q=None):
+    """The q values covered by every dataset in a list
+
+    With q None the q values of the first dataset are used, otherwise
+    those given. Either way only values inside the q range of all the
+    datasets are kept.
+    """
+
+    if q is None:
+        q = datasets[0].q
+    q = np.asarray(q, dtype=float)
+    qmin = max([data.q[0] for data in datasets])
+    qmax = min([data.q[-1] for data in datasets])
+    return q[(q >= qmin) & (q <= qmax)]
+
+
+def reduce_frame(sample, background=None, empty=None, sample_norm=1.0,
+                 background_norm=1.0, scale=1.0, q=None):
+    """Subtract and normalise a single sample frame
+
+    The inputs are SasData objects. q gives the grid for the result and
+    defaults to the q values of the sample (see common_q). Returns an
+    ExpSasData.
+    """
+
+    inputs = [data for data in [sample, background, empty] if data is not None]
+    q = common_q(inputs, q)
+    if not len(q):
+        raise ValueError, "The frames have no q range in common"
+    sample = sample.interpolate(q)
+    if background is not None:
+        background = background.interpolate(q)
+    if empty is not None:
+        empty = empty.interpolate(q)
+
+    terms = [(sample_norm, sample)]
+    if background is not None:
+        terms.append((-background_norm, background))
+        if empty is not None:
+            terms.append((background_norm - sample_norm, empty))
+    elif empty is not None:
+        terms.append((-sample_norm, empty))
+
+    i = scale * sum([factor * data.i for factor, data in terms])
+    errors = [(factor * data.err) ** 2 for factor, data in terms
+              if data.err is not None]
+    err = None
+    if errors:
+        err = abs(scale) * np.sqrt(sum(errors))
+    return sas_utils.ExpSasData(q, i, err)
+
+
+def output_path(outdir, path):
+    """Path for the reduced version of a frame: outdir/name.txt"""
+
+    name = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(outdir, name + '.txt')
+
+
+def check_outputs(samples, outdir, inputs=()):
+    """Raise ValueError if reduced frames would overwrite data
+
+    The outputs are named by the basename of each sample alone, so two
+    samples of the same name in different directories would write the
+    same file, and a .txt sample reduced into its own directory would be
+    written over. inputs are further paths (background, empty cell) that
+    must not be written over either.
+    """
+
+    outputs = {}
+    for path in samples:
+        out = os.path.realpath(output_path(outdir, path))
+        if out in outputs:
+            raise ValueError, (path + " and " + outputs[out] +
+                               " would both be reduced to " + out)
+        outputs[out] = path
+    for path in list(samples) + [path for path in inputs if path]:
+        if os.path.realpath(path) in outputs:
+            raise ValueError, path + " would be overwritten by a reduced frame"
+
+
+def _reduce_file(state, item):
+    """Read, reduce and write one frame, returning the output path"""
+
+    path, norm = item
+    reduced = reduce_frame(modelling.load_dataset(path),
+                           state['background'], state['empty'],
+                           norm, state['background_norm'], state['scale'],
+                           state['q'])
+    out = output_path(state['outdir'], path)
+    sas_utils.write_column_data(reduced, out)
+    return path, out
+
+
+def reduce_files(samples, outdir, background=None, empty=None, norms=None,
+                 background_norm=1.0, scale=1.0, q=None, processes=None):
+    """Reduce a list of sample files and write them to outdir
+
+    background and empty are paths (or None). norms is a dictionary of
+    sample path to its sample_norm, with 1 for any sample not in it.
+    The frames are reduced in parallel across processes workers and
+    the list of (sample path, output path) pairs is returned in the
+    order of samples. Nothing is reduced if an output would overwrite
+    another output or any of the input files (see check_outputs).
+    """
+
+    check_outputs(samples, outdir, [background, empty])
+    if norms is None:
+        norms = {}
+    if background is not None:
+        background = modelling.load_dataset(background)
+    if empty is not None:
+        empty = modelling.load_dataset(empty)
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+
+    pool = parallel.ModelPool(None, [],
+                              shared = {'background'      : background,
+                                        'empty'           : empty,
+                                        'background_norm' : background_norm,
+                                        'scale'           : scale,
+                                        'q'               : q,
+                                        'outdir'          : outdir},
+                              processes = processes)
+    try:
+        done = dict(pool.imap_unordered(_reduce_file,
+                                        [(path, norms.get(path, 1.0))
+                                         for path in samples]))
+    finally:
+        pool.close()
+
+    return [(path, done[path]) for path in samples]
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser(usage = "%prog [options] sample files")
+    parser.add_option('-b', '--background', type = str, dest = 'background',
+                      default = None, help = "Background (buffer) data file")
+    parser.add_option('-e', '--empty', type = str, dest = 'empty',
+                      default = None, help = "Empty cell data file")
+    parser.add_option('-n', '--norms', type = str, dest = 'norms',
+                      default = None,
+                      help = """Json file or string of a dictionary of sample
+                      file to the factor its intensities are multiplied by,
+                      e.g. 1 / (transmission * thickness)""")
+    parser.add_option('--background-norm', type = float,
+                      dest = 'background_norm', default = 1.0,
+                      help = "Factor the background intensities are multiplied by")
+    parser.add_option('-s', '--scale', type = float, dest = 'scale',
+                      default = 1.0,
+                      help = "Overall scale factor, e.g. to absolute units")
+    parser.add_option('-q', '--qgrid', type = str, dest = 'qgrid',
+                      default = None,
+                      help = """first,last,npoints for a common logarithmic q
+                      grid. Defaults to the q values of each sample""")
+    parser.add_option('-j', '--processes', type = int, dest = 'processes',
+                      default = None, help = "Number of worker processes")
+    parser.add_option('-o', '--outdir', type = str, dest = 'outdir',
+                      default = 'reduced',
+                      help = "Directory for the reduced files")
+
+    (options, args) = parser.parse_args()
+    if not args:
+        parser.error("No sample files given")
+
+    norms = None
+    if options.norms:
+        if os.path.isfile(options.norms):
+            f = open(options.norms, 'r')
+            norms = json.load(f)
+            f.close()
+        else:
+            norms = json.loads(options.norms)
+
+    q = None
+    if options.qgrid:
+        first, last, npoints = [float(x) for x in options.qgrid.split(',')]
+        q = np.logspace(np.log10(first), np.log10(last), int(npoints))
+
+    for path, out in reduce_files(args, options.outdir, options.background,
+                                  options.empty, norms,
+                                  options.background_norm, options.scale, q,
+                                  options.processes):
+        print path, '->', out
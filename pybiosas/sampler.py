@@ -0,0 +1,336 @@
+# PyBioSas.sampler: Affine invariant ensemble MCMC for exploring the
+# posterior distribution of model parameters
+#
+# Public Domain Waiver:
+# To the extent possible under law, Cameron Neylon has waived all
+# copyright and related or neighboring rights to sampler.py
+# This work is published from United Kingdom.
+#
+# See http://creativecommons.org/publicdomain/zero/1.0/
+#
+# The sampler uses the stretch move of Goodman and Weare (Comm. App.
+# Math. Comp. Sci. 5, 65 (2010)) with the ensemble split in two halves,
+# so that the proposals for a whole half of the walkers are independent
+# and their log probabilities can be computed in one batched call. The
+# chain is written to a memory mapped .npy file in chunks of steps so
+# that long runs do not have to be held in memory.
+#
+# Usage from the command line:
+#
+#     python sampler.py -m ellipticalCylinder -d q48.txt -p start.json \
+#                       -w 32 -n 5000 -o mcmc/
+#
+# where start.json is a parameter list, ideally the best fit.
+
+import optparse
+import json
+import os
+import os.path
+import numpy as np
+try:
+    import pybiosas.modelling as modelling
+except ImportError:
+    import modelling
+
+
+def integrated_time(x, c=5.0):
+    """Estimate the integrated autocorrelation time of a chain
+
+    x is an (nsteps, nwalkers) array for one parameter. The normalised
+    autocorrelation function is computed with an FFT for each walker and
+    averaged, then summed up to the smallest window M with M >= c * tau
+    (Sokal's automatic windowing).
+    """
+
+    x = np.atleast_2d(np.asarray(x, dtype=float).T).T
+    nsteps = x.shape[0]
+    n = 1
+    while n < 2 * nsteps:
+        n *= 2
+
+    acf = np.zeros(nsteps)
+    for walker in range(x.shape[1]):
+        y = x[:, walker] - x[:, walker].mean()
+        f = np.fft.rfft(y, n=n)
+        a = np.fft.irfft(f * np.conjugate(f))[:nsteps]
+        if a[0] > 0:
+            acf += a / a[0]
+    acf /= x.shape[1]
+
+    taus = 2.0 * np.cumsum(acf) - 1.0
+    window = np.arange(len(taus)) < c * taus
+    if np.any(~window):
+        return float(taus[np.argmin(window)])
+    return float(taus[-1])
+
+
+def gelman_rubin(x):
+    """Potential scale reduction factor R-hat treating walkers as chains
+
+    x is an (nsteps, nwalkers) array for one parameter. Walkers in an
+    ensemble are not independent so this is a guide to convergence
+    rather than a formal test; values close to 1 are expected once the
+    ensemble has forgotten its starting point.
+    """
+
+    x = np.asarray(x, dtype=float)
+    n = x.shape[0]
+    if n < 2:
+        return float('nan')
+    chain_means = x.mean(axis=0)
+    within = x.var(axis=0, ddof=1).mean()
+    between = n * chain_means.var(ddof=1)
+    if within == 0:
+        return float('nan')
+    var_plus = (n - 1.0) / n * within + between / n
+    return float(np.sqrt(var_plus / within))
+
+
+class ModelPosterior:
+    """Batched log posterior for a registered model against a dataset
+
+    The free parameters in the parameter list are sampled, with flat
+    priors inside the bounds given by modelling.param_info (that is from
+    the 'param_info' entries in pybiosas.models.models). The likelihood
+    is Gaussian with the standard deviations from the data's weighting,
+    multiplied by sqrt(noise_scale); for data without uncertainties set
+    noise_scale to the reduced chi2 of the best fit.
+    """
+
+    def __init__(self, model, parameters, data, weighting='auto',
+                 noise_scale=1.0, model_func=None):
+        if model_func is None:
+            model_func = modelling.load_model(model)
+        self.model = model
+        self.model_func = model_func
+        self.parameters = modelling.complete_parameters(model_func, parameters)
+        self.free = [par for par in self.parameters
+                     if not par.get('fixed', False)]
+        self.names = [par['paramname'] for par in self.free]
+        self.q = data.q
+        self.i = data.i
+        self.sigma = data.sigma(weighting) * np.sqrt(noise_scale)
+
+        bounds = [modelling.param_info(model, par)[0] for par in self.free]
+        self.lower = np.array([-np.inf if b[0] is None else b[0]
+                               for b in bounds])
+        self.upper = np.array([np.inf if b[1] is None else b[1]
+                               for b in bounds])
+        self.x_scale = np.array([modelling.param_info(model, par)[1]
+                                 for par in self.free], dtype=float)
+
+    def start(self):
+        return np.array([par['value'] for par in self.free], dtype=float)
+
+    def __call__(self, positions):
+        """Return the log posterior for each row of positions"""
+
+        positions = np.atleast_2d(positions)
+        logp = -np.inf * np.ones(len(positions))
+        inside = np.all((positions > self.lower) & (positions < self.upper),
+                        axis=1)
+        if np.any(inside):
+            curves = modelling.evaluate_batch(self.model_func, self.names,
+                                              positions[inside], self.q)
+            res = (self.i - curves) / self.sigma
+            logp[inside] = -0.5 * np.sum(res * res, axis=1)
+        return logp
+
+
+class EnsembleSampler:
+    """Affine invariant ensemble sampler using the stretch move
+
+    log_prob takes an (n, ndim) array of positions and returns the n log
+    probabilities; it is called once per half-ensemble per step. If
+    chain_path is set the chain and log probabilities are written to
+    chain.npy and log_prob.npy in that directory, flushed every chunk
+    steps.
+    """
+
+    def __init__(self, log_prob, ndim, nwalkers, a=2.0, chain_path=None,
+                 chunk=100, seed=None):
+        if nwalkers < 2 * ndim or nwalkers % 2:
+            raise ValueError, ("nwalkers must be even and at least twice "
+                               "the number of parameters")
+        self.log_prob = log_prob
+        self.ndim = ndim
+        self.nwalkers = nwalkers
+        self.a = a
+        self.chain_path = chain_path
+        self.chunk = chunk
+        self.random = np.random.RandomState(seed)
+        self.naccepted = np.zeros(nwalkers)
+        self.nsteps = 0
+
+    def _open_storage(self, nsteps):
+        if self.chain_path is None:
+            self.chain = np.empty((nsteps, self.nwalkers, self.ndim))
+            self.lnprob = np.empty((nsteps, self.nwalkers))
+            return
+
+        if not os.path.exists(self.chain_path):
+            os.makedirs(self.chain_path)
+        self.chain = np.lib.format.open_memmap(
+                         os.path.join(self.chain_path, 'chain.npy'), mode='w+',
+                         dtype=float, shape=(nsteps, self.nwalkers, self.ndim))
+        self.lnprob = np.lib.format.open_memmap(
+                         os.path.join(self.chain_path, 'log_prob.npy'), mode='w+',
+                         dtype=float, shape=(nsteps, self.nwalkers))
+
+    def _flush(self):
+        if hasattr(self.chain, 'flush'):
+            self.chain.flush()
+            self.lnprob.flush()
+
+    def run(self, p0, nsteps):
+        """Advance the ensemble from positions p0 for nsteps steps
+
+        Each run starts a new chain, replacing the stored chain and the
+        acceptance counts of any earlier run. To continue a chain pass
+        the positions returned by the last run as p0.
+        """
+
+        position = np.array(p0, dtype=float)
+        self.naccepted = np.zeros(self.nwalkers)
+        self.nsteps = 0
+        lnprob = self.log_prob(position)
+        if not np.all(np.isfinite(lnprob)):
+            raise ValueError, "All walkers must start with a finite probability"
+
+        self._open_storage(nsteps)
+        half = self.nwalkers // 2
+        halves = [np.arange(half), np.arange(half, self.nwalkers)]
+        buffer_chain = np.empty((self.chunk, self.nwalkers, self.ndim))
+        buffer_lnprob = np.empty((self.chunk, self.nwalkers))
+        written = 0
+
+        for step in range(nsteps):
+            for moving, other in [halves, halves[::-1]]:
+                z = ((self.a - 1.0) * self.random.rand(half) + 1.0) ** 2 / self.a
+                partners = position[other[self.random.randint(0, half, half)]]
+                proposal = partners + z[:, np.newaxis] * (position[moving] -
+                                                          partners)
+                new_lnprob = self.log_prob(proposal)
+                log_ratio = ((self.ndim - 1.0) * np.log(z) + new_lnprob -
+                             lnprob[moving])
+                accept = np.log(self.random.rand(half)) < log_ratio
+                position[moving[accept]] = proposal[accept]
+                lnprob[moving[accept]] = new_lnprob[accept]
+                self.naccepted[moving[accept]] += 1
+
+            buffer_chain[step - written] = position
+            buffer_lnprob[step - written] = lnprob
+            if step + 1 - written == self.chunk or step + 1 == nsteps:
+                count = step + 1 - written
+                self.chain[written:written + count] = buffer_chain[:count]
+                self.lnprob[written:written + count] = buffer_lnprob[:count]
+                self._flush()
+                written += count
+
+        self.nsteps = nsteps
+        return position, lnprob
+
+    def acceptance_fraction(self):
+        return self.naccepted / max(self.nsteps, 1)
+
+    def diagnostics(self, names, burn=0):
+        """Convergence diagnostics and posterior summaries after burn-in"""
+
+        chain = np.asarray(self.chain[burn:self.nsteps])
+        out = {'nwalkers'            : self.nwalkers,
+               'nsteps'              : self.nsteps,
+               'burn'                : burn,
+               'acceptance_fraction' : float(np.mean(self.acceptance_fraction())),
+               'params'              : {}}
+        for j, name in enumerate(names):
+            x = chain[:, :, j]
+            tau = integrated_time(x)
+            percentiles = np.percentile(x, [2.5, 16, 50, 84, 97.5])
+            out['params'][name] = {'tau'         : tau,
+                                   'rhat'        : gelman_rubin(x),
+                                   'n_effective' : x.size / max(tau, 1.0),
+                                   'median'      : float(percentiles[2]),
+                                   'percentiles' : {'2.5'  : float(percentiles[0]),
+                                                    '16'   : float(percentiles[1]),
+                                                    '84'   : float(percentiles[3]),
+                                                    '97.5' : float(percentiles[4])}}
+        # A chain shorter than ~50 autocorrelation times is not trustworthy
+        longest = max([p['tau'] for p in out['params'].values()] or [0])
+        out['converged'] = bool(chain.shape[0] > 50 * longest)
+        return out
+
+
+def initial_ensemble(posterior, nwalkers, spread=1e-3, seed=None):
+    """Scatter walkers in a small ball around the posterior's start point
+
+    The ball has a width of spread times each parameter's typical scale
+    and any walker outside the bounds is pulled back inside.
+    """
+
+    random = np.random.RandomState(seed)
+    start = posterior.start()
+    p0 = start + spread * posterior.x_scale * random.randn(nwalkers, len(start))
+    width = spread * posterior.x_scale
+    p0 = np.where(p0 <= posterior.lower, posterior.lower + width, p0)
+    p0 = np.where(p0 >= posterior.upper, posterior.upper - width, p0)
+    return p0
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser()
+    parser.add_option('-m', '--model', type = str, dest = 'model',
+                      help = "The model to sample")
+    parser.add_option('-d', '--dataset', type = str, dest = 'dataset',
+                      help = "The dataset")
+    parser.add_option('-p', '--parameters', type = str, dest = 'parameters',
+                      help = """Starting parameters, a json file or string as
+                      for modelling.py. Start from the best fit""")
+    parser.add_option('-w', '--walkers', type = int, dest = 'walkers',
+                      default = 32, help = "Number of walkers (even)")
+    parser.add_option('-n', '--nsteps', type = int, dest = 'nsteps',
+                      default = 2000, help = "Number of steps")
+    parser.add_option('--burn', type = int, dest = 'burn', default = None,
+                      help = "Steps to discard for diagnostics, default nsteps/4")
+    parser.add_option('--chunk', type = int, dest = 'chunk', default = 100,
+                      help = "Steps held in memory between writes of the chain")
+    parser.add_option('--weighting', type = str, dest = 'weighting',
+                      default = 'auto', help = "Weighting as for modelling.py")
+    parser.add_option('--noise-scale', type = float, dest = 'noise_scale',
+                      default = 1.0,
+                      help = """Multiplier on the variance of each point, set
+                      to the reduced chi2 of the best fit if the data has no
+                      uncertainties""")
+    parser.add_option('--seed', type = int, dest = 'seed', default = None)
+    parser.add_option('-o', '--outpath', type = str, dest = 'outpath',
+                      default = 'mcmc', help = "Directory for the chain")
+
+    (options, args) = parser.parse_args()
+    if os.path.isfile(options.parameters):
+        f = open(options.parameters, 'r')
+        parameters = json.load(f)
+        f.close()
+    else:
+        parameters = json.loads(options.parameters)
+
+    data = modelling.load_dataset(options.dataset)
+    posterior = ModelPosterior(options.model, parameters, data,
+                               options.weighting, options.noise_scale)
+    sampler = EnsembleSampler(posterior, len(posterior.names), options.walkers,
+                              chain_path = options.outpath,
+                              chunk = options.chunk, seed = options.seed)
+    p0 = initial_ensemble(posterior, options.walkers, seed = options.seed)
+    sampler.run(p0, options.nsteps)
+
+    burn = options.burn
+    if burn is None:
+        burn = options.nsteps // 4
+    summary = sampler.diagnostics(posterior.names, burn)
+    summary['model'] = options.model
+    summary['dataset'] = options.dataset
+    summary['names'] = posterior.names
+    f = open(os.path.join(options.outpath, 'summary.json'), 'w')
+    json.dump(summary, f)
+    f.close()
+    print "Acceptance fraction:", summary['acceptance_fraction']
+    for name in posterior.names:
+        print name, summary['params'][name]
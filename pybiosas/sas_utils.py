@@ -1,3 +1,6 @@
+import os.path
+import itertools
+import multiprocessing
 import numpy as np
 
 class SasData(object):
@@ -5,30 +8,61 @@ class SasData(object):
 
     Class has a series of methods for initialising and
     doing basic operations on SAS data. The root class
-    is very simple and only contains the Q and I lists
-    providing simple addition, multiplication, length
-    and string operations.
+    is very simple and only contains the Q and I arrays, and
+    optionally the uncertainties on I, providing simple addition,
+    multiplication, length and string operations.
     """
 
-    def __init__(self, q_vals, i_vals):
+    def __init__(self, q_vals, i_vals, err_vals=None):
         """Initializing the SasData object.
 
-        Just passes two lists to the initializing object which
-        are then stored internally. Possibly an argument for 
-        including the units of Q in the root object
+        Takes two lists or arrays which are stored internally as
+        float64 numpy arrays so that models and residuals can be
+        evaluated over the whole dataset in one call. The optional
+        err_vals holds the standard deviation of each intensity
+        (Idev in canSAS XML). Possibly an argument for including
+        the units of Q in the root object
         """
         
-        assert type(q_vals) == list
-        assert type(i_vals) == list
         assert len(q_vals) == len(i_vals), 'q and i not the same length'
-        self.q = q_vals
-        self.i = i_vals
-
+        self.q = np.asarray(q_vals, dtype=float)
+        self.i = np.asarray(i_vals, dtype=float)
+        if err_vals is not None:
+            assert len(err_vals) == len(q_vals), 'q and err not the same length'
+            self.err = np.asarray(err_vals, dtype=float)
+        else:
+            self.err = None
 
     def __len__(self):
         return len(self.q)
 
 
+    def _combine(self, other, sign):
+        """Add (sign 1) or subtract (sign -1) other, propagating errors
+
+        Errors on two datasets are added in quadrature; a dataset without
+        errors is treated as exact. Returns an object of the same class
+        as self.
+        """
+
+        if isinstance(other, SasData):
+            assert len(self) == len(other), 'datasets not the same length'
+            assert np.allclose(self.q, other.q), 'q values not the same'
+            i = self.i + sign * other.i
+            if self.err is None:
+                err = other.err
+            elif other.err is None:
+                err = self.err
+            else:
+                err = np.sqrt(self.err * self.err + other.err * other.err)
+            return self.__class__(self.q, i, err)
+
+        elif isinstance(other, (int, float, np.number)):
+            return self.__class__(self.q, self.i + sign * other, self.err)
+
+        else:
+            return NotImplemented
+
     def __add__(self, other):
         """Test whether other is SasData or float/int and add together.
 
@@ -36,35 +70,14 @@ class SasData(object):
         where two SasData objects are added together where the wish is
         for the intensities of both to be combined. The second cases is
         when adding (or more likely subtracting) a numeric value (float 
-        or int) which is handled separately. Probably both of these could
-        be written neater and faster.
+        or int) which is handled separately.
 
         Inputs must required are a SasData object and either a SasData object or
-        an int or float. Returns a new SasData object.
+        an int or float. Returns a new object of the same class with the
+        errors propagated (see _combine).
         """
 
-        # addition of two SasData objects
-        if isinstance(other, SasData):
-            assert len(self) == len(other), 'datasets not the same length'
-	    assert all(self.q) == all(other.q), 'q values not the same'
-
-            # initialize a SasData object with zero for all intensities
-	    out = SasData(self.q, ([0] * len(self)))
-	    for j in range(len(self)):
-                out.i[j] = self.i[j] + other.i[j]
-
-	    return out
-
-        # addition of a float or int to  SasData objects
-        elif type(other) is int or type(other) is float:
-            out = SasData(self.q, ([0]*len(self)))
-	    for j in range(len(self)):
-	        out.i[j] = self.i[j] + other
-
-	    return out
-
-        else:
-            return NotImplemented
+        return self._combine(other, 1)
 
     def __sub__(self, other):
         """Subtraction method for SasData Objects.
@@ -72,47 +85,49 @@ class SasData(object):
         See documentation for __add__ which is essentially identical
         """
 
-        # addition of two SasData objects
-        if isinstance(other, SasData):
-            assert len(self) == len(other), 'datasets not the same length'
-	    assert all(self.q) == all(other.q), 'q values not the same'
+        return self._combine(other, -1)
 
-            # initialize a SasData object with zero for all intensities
-	    out = SasData(self.q, ([0] * len(self)))
-	    for j in range(len(self)):
-                out.i[j] = self.i[j] - other.i[j]
+    def __mul__(self, other):
+        """Basic mutplication function for SasData objects.
 
-	    return out
+        Requires a SasData object and an int or a float. Returns a new
+        object of the same class with intensities and errors scaled.
+        """
 
-        # addition of a float or int to  SasData objects
-        elif type(other) is int or type(other) is float:
-            out = SasData(self.q, ([0]*len(self)))
-	    for j in range(len(self)):
-	        out.i[j] = self.i[j] - other
+        if not isinstance(other, (int, float, np.number)):
+            return NotImplemented
 
-	    return out
+        err = None
+        if self.err is not None:
+            err = self.err * abs(other)
+        return self.__class__(self.q, self.i * other, err)
 
-        else:
-            return NotImplemented
+    __rmul__ = __mul__
 
-    def __mul__(self, other):
-        """Basic mutplication function for SasData objects.
+    def interpolate(self, q):
+        """Return the data linearly interpolated onto new q values
 
-        Requires a SasData object and an int or a float. Returns a new
-        SasData object.
+        The errors are propagated through the interpolation weights, so
+        a point halfway between two measured points has an error of
+        sqrt(e1**2 + e2**2) / 2. The new q values must lie within the
+        measured q range.
         """
 
-        assert isinstance(self, SasData)
-        try:
-            assert type(other) is int or type(other) is float
-        except:
-            return NotImplemented
+        q = np.asarray(q, dtype=float)
+        if len(q) and (q.min() < self.q[0] or q.max() > self.q[-1]):
+            raise ValueError, "Can not interpolate outside the measured q range"
 
-        # initialize a SasData object with zero for all intensities 
-        out = SasData(self.q, (([0] * len(self)))) 
-        for j in range(len(self)):
-            out.i[j] = self.i[j] * other
-	return out
+        upper = np.clip(np.searchsorted(self.q, q), 1, len(self.q) - 1)
+        lower = upper - 1
+        step = self.q[upper] - self.q[lower]
+        weight = (q - self.q[lower]) / step
+        i = (1 - weight) * self.i[lower] + weight * self.i[upper]
+
+        err = None
+        if self.err is not None:
+            err = np.sqrt(((1 - weight) * self.err[lower]) ** 2 +
+                          (weight * self.err[upper]) ** 2)
+        return self.__class__(q, i, err)
 
 
 class ExpSasData(SasData):
@@ -122,17 +137,99 @@ class ExpSasData(SasData):
     class adds support for masks over the data to remove parts of the
     experimental pattern. The mask and the masked data can be stored with
     the experimental data. 
+
+    self.mask is a boolean array, True for the points that are used.
+    self.masked is an ExpSasData holding only those points, and is the
+    object itself while nothing is masked. It is rebuilt once whenever
+    the mask changes, as a view on the arrays if the points used form a
+    single contiguous range, so fits can use it directly and only
+    evaluate the model at the unmasked points.
     """
 
-    def __init__(self, q, i):
+    def __init__(self, q, i, err=None):
         """Initialization routine adds additional SasData object for the 
         masked data at self.masked"""
 
-        SasData.__init__(self, q, i)
+        SasData.__init__(self, q, i, err)
         self.id = ''
         self.instrument = ''
-        self.mask = []
-        self.masked = SasData([],[])
+        self.dq = None
+        self.mask = np.ones(len(self.q), dtype=bool)
+        self.masked = self
+
+    def _update_masked(self):
+        """Rebuild self.masked after a change to self.mask"""
+
+        used = np.flatnonzero(self.mask)
+        if len(used) == len(self.q):
+            self.masked = self
+            return
+
+        if len(used) and used[-1] - used[0] + 1 == len(used):
+            selection = slice(used[0], used[-1] + 1)
+        else:
+            selection = self.mask
+
+        err = None
+        if self.err is not None:
+            err = self.err[selection]
+        self.masked = ExpSasData(self.q[selection], self.i[selection], err)
+        self.masked.id = self.id
+        self.masked.instrument = self.instrument
+        if self.dq is not None:
+            self.masked.dq = self.dq[selection]
+
+    def clear_mask(self):
+        """Use all of the points again"""
+
+        self.mask = np.ones(len(self.q), dtype=bool)
+        self._update_masked()
+
+    def mask_q_range(self, qmin=None, qmax=None):
+        """Exclude the points below qmin and above qmax"""
+
+        if qmin is not None:
+            self.mask &= self.q >= qmin
+        if qmax is not None:
+            self.mask &= self.q <= qmax
+        self._update_masked()
+
+    def mask_ranges(self, ranges):
+        """Exclude the points inside each (low, high) q range in a list"""
+
+        for low, high in ranges:
+            self.mask &= ~((self.q >= low) & (self.q <= high))
+        self._update_masked()
+
+    def mask_outliers(self, nsigma=5.0, window=7):
+        """Exclude isolated spikes in the intensity
+
+        Each point is compared with the median of the window points
+        centred on it, with the end points repeated to fill the windows
+        at either end. Points further from that running median than
+        nsigma times their uncertainty are excluded, or when the data
+        has no uncertainties nsigma robust standard deviations (1.4826
+        times the median absolute deviation of all the differences).
+        """
+
+        n = len(self.i)
+        if n < window:
+            return
+        half = window // 2
+        padded = np.concatenate([np.repeat(self.i[0], half), self.i,
+                                 np.repeat(self.i[-1], half)])
+        stride = padded.strides[0]
+        windows = np.lib.stride_tricks.as_strided(padded, shape=(n, window),
+                                                  strides=(stride, stride))
+        deviation = self.i - np.median(windows, axis=1)
+        if self.err is not None:
+            self.mask &= np.abs(deviation) <= nsigma * self.err
+        else:
+            spread = 1.4826 * np.median(np.abs(deviation -
+                                               np.median(deviation)))
+            if spread > 0:
+                self.mask &= np.abs(deviation) <= nsigma * spread
+        self._update_masked()
 
     def set_id(self, id):
         try:
@@ -157,6 +254,84 @@ class ExpSasData(SasData):
     def get_instrument(self):
         return self.instrument     
 
+    def sigma(self, weighting='auto'):
+        """Return the standard deviations used to weight residuals in a fit
+
+        weighting can be one of:
+            'errors'   : the measured uncertainties in self.err
+            'poisson'  : counting statistics, sqrt(I)
+            'relative' : constant relative error, |I|
+            'none'     : unweighted, all ones
+            'auto'     : 'errors' if the data has usable uncertainties
+                         and 'none' otherwise
+
+        Non-positive or non-finite values (zero counts, missing errors)
+        are replaced by the smallest valid value so that no point gets
+        an infinite weight.
+        """
+
+        if weighting == 'auto':
+            if self.err is not None and np.any(self.err > 0):
+                weighting = 'errors'
+            else:
+                weighting = 'none'
+
+        if weighting == 'errors':
+            if self.err is None:
+                raise ValueError, "Dataset has no uncertainties for weighting"
+            sigma = np.array(self.err, dtype=float)
+        elif weighting == 'poisson':
+            sigma = np.sqrt(np.abs(self.i))
+        elif weighting == 'relative':
+            sigma = np.abs(self.i)
+        elif weighting == 'none':
+            return np.ones(len(self))
+        else:
+            raise ValueError, "Unknown weighting: " + str(weighting)
+
+        valid = np.isfinite(sigma) & (sigma > 0)
+        if not np.any(valid):
+            return np.ones(len(self))
+        sigma[~valid] = sigma[valid].min()
+        return sigma
+
+    def log_rebin(self, nbins):
+        """Return a copy of the data averaged into logarithmic q bins
+
+        The q range is split into nbins bins equally spaced in log q and
+        q and I are averaged over the points falling in each bin. Empty
+        bins are dropped so fewer than nbins points may be returned. The
+        error of each bin is the error of the mean of its points; it is
+        left as None if the data has no errors. If the data already has
+        no more than nbins points it is returned unchanged.
+        """
+
+        if len(self) <= nbins:
+            return self
+
+        positive = self.q > 0
+        q = self.q[positive]
+        i = self.i[positive]
+        edges = np.logspace(np.log10(q.min()), np.log10(q.max()), nbins + 1)
+        index = np.clip(np.digitize(q, edges) - 1, 0, nbins - 1)
+
+        counts = np.bincount(index, minlength=nbins).astype(float)
+        occupied = counts > 0
+        counts = counts[occupied]
+        q_out = np.bincount(index, q, nbins)[occupied] / counts
+        i_out = np.bincount(index, i, nbins)[occupied] / counts
+
+        err_out = None
+        if self.err is not None:
+            err = self.err[positive]
+            err_out = np.sqrt(np.bincount(index, err * err,
+                                          nbins)[occupied]) / counts
+
+        rebinned = ExpSasData(q_out, i_out, err_out)
+        rebinned.id = self.id
+        rebinned.instrument = self.instrument
+        return rebinned
+
 
 ##################################################
 #
@@ -164,6 +339,136 @@ class ExpSasData(SasData):
 #
 ##################################################
 
+class SasData2D(object):
+    """Data object for 2-D detector data held as a (4, npixels) array
+
+    The rows of self.data are qx, qy, I and the error on I (zero where
+    there is none) for every pixel, normally a memory mapped .npy file
+    (see load_2d_data) so images of millions of pixels are not read
+    into memory. shape is the (ny, nx) shape of the detector image if
+    known, and the pixels are stored in row order.
+
+    self.mask is a boolean array over the pixels, True for those that
+    are used. Operations over all the pixels are done in blocks of
+    self.chunk pixels to bound the memory used.
+    """
+
+    chunk = 1000000
+
+    def __init__(self, data, shape=None, path=None):
+        assert data.shape[0] == 4, 'data should have rows qx, qy, I and err'
+        self.data = data
+        self.qx = data[0]
+        self.qy = data[1]
+        self.i = data[2]
+        self.err = data[3]
+        self.shape = shape
+        self.path = path
+        self.mask = np.ones(data.shape[1], dtype=bool)
+        self._floor = {}
+
+    def __len__(self):
+        return self.data.shape[1]
+
+    def blocks(self):
+        """Slices covering all the pixels self.chunk at a time"""
+
+        return [slice(start, min(start + self.chunk, len(self)))
+                for start in range(0, len(self), self.chunk)]
+
+    def used(self):
+        """Indices of the pixels left by the mask"""
+
+        return np.flatnonzero(self.mask)
+
+    def clear_mask(self):
+        self.mask = np.ones(len(self), dtype=bool)
+
+    def mask_q_range(self, qmin=None, qmax=None):
+        """Exclude the pixels with |q| below qmin or above qmax"""
+
+        for block in self.blocks():
+            q = np.hypot(self.qx[block], self.qy[block])
+            if qmin is not None:
+                self.mask[block] &= q >= qmin
+            if qmax is not None:
+                self.mask[block] &= q <= qmax
+
+    def mask_circle(self, qx, qy, radius):
+        """Exclude the pixels within radius of (qx, qy), e.g. a beamstop"""
+
+        for block in self.blocks():
+            self.mask[block] &= np.hypot(self.qx[block] - qx,
+                                         self.qy[block] - qy) > radius
+
+    def mask_rectangle(self, qx_range, qy_range):
+        """Exclude the pixels inside a rectangle given as two (low, high) pairs"""
+
+        for block in self.blocks():
+            qx = self.qx[block]
+            qy = self.qy[block]
+            self.mask[block] &= ~((qx >= qx_range[0]) & (qx <= qx_range[1]) &
+                                  (qy >= qy_range[0]) & (qy <= qy_range[1]))
+
+    def mask_pixels(self, mask):
+        """Exclude the pixels where a boolean image or array is False"""
+
+        self.mask &= np.asarray(mask, dtype=bool).reshape(-1)
+
+    def sigma(self, weighting='auto', index=slice(None)):
+        """Standard deviations for the pixels in index, as ExpSasData.sigma
+
+        Invalid values are replaced by the smallest valid value over all
+        of the pixels, which is found once per weighting and kept.
+        """
+
+        if weighting == 'auto':
+            weighting = self.auto_weighting()
+        if weighting == 'none':
+            return np.ones(self.i[index].shape)
+
+        sigma = self._raw_sigma(weighting, index)
+        valid = np.isfinite(sigma) & (sigma > 0)
+        if not np.all(valid):
+            sigma[~valid] = self.sigma_floor(weighting)
+        return sigma
+
+    def auto_weighting(self):
+        """'errors' if any pixel has an error, otherwise 'none'"""
+
+        if 'auto' not in self._floor:
+            self._floor['auto'] = 'none'
+            for block in self.blocks():
+                if np.any(self.err[block] > 0):
+                    self._floor['auto'] = 'errors'
+                    break
+        return self._floor['auto']
+
+    def sigma_floor(self, weighting):
+        """The smallest valid standard deviation over all the pixels"""
+
+        if weighting not in self._floor:
+            floor = np.inf
+            for block in self.blocks():
+                sigma = self._raw_sigma(weighting, block)
+                valid = sigma[np.isfinite(sigma) & (sigma > 0)]
+                if len(valid):
+                    floor = min(floor, valid.min())
+            if not np.isfinite(floor):
+                floor = 1.0
+            self._floor[weighting] = floor
+        return self._floor[weighting]
+
+    def _raw_sigma(self, weighting, index):
+        if weighting == 'errors':
+            return np.array(self.err[index], dtype=float)
+        elif weighting == 'poisson':
+            return np.sqrt(np.abs(self.i[index]))
+        elif weighting == 'relative':
+            return np.abs(self.i[index])
+        raise ValueError, "Unknown weighting: " + str(weighting)
+
+
 def load_file():
     """A generic loader that will call specific loaders.
 
@@ -182,7 +487,7 @@ def load_file():
 
     for j in range(0,5):
         if DLS_I22_recogniser in file[j]:
-            sas_data_object = load_two_column_data(path, 3)
+            sas_data_object = load_column_data(path)
             break
         elif sasxml_recogniser in file[j]:
             sas_data_object = loadsasxml(path)
@@ -191,7 +496,7 @@ def load_file():
         else:
             pass
 
-    sas_data_object = load_two_column_data(path,0)
+    sas_data_object = load_column_data(path)
 
     return sas_data_object
     
@@ -202,14 +507,255 @@ def load_two_column_data(file, rows_to_skip=0):
     i22 files currently have two columns with three lines of text
     at the top. This just does a quick and dirty load of a the file
     into a SasData object. Currently setup to be called in the form
-    data = load_two_column_data('file')
+    data = load_two_column_data('file'). If the file has a third
+    column it is taken to be the uncertainty on I.
     """
 
-    data = np.loadtxt(file, skiprows = rows_to_skip)
+    data = np.loadtxt(file, skiprows = rows_to_skip, ndmin = 2)
 
     data_q = data[:,0]
     data_i = data[:,1]
-    return ExpSasData(list(data_q), list(data_i))
+    data_err = None
+    if data.shape[1] > 2:
+        data_err = data[:,2]
+    return ExpSasData(data_q, data_i, data_err)
+
+
+def write_column_data(data, file, header='q\ti\terr'):
+    """Write a SasData object as tab separated columns of q, i and err
+
+    A single header line is written so the file can be read back with
+    load_two_column_data(file, rows_to_skip=1). The err column is left
+    out if the data has no errors.
+    """
+
+    columns = [data.q, data.i]
+    if data.err is not None:
+        columns.append(data.err)
+    else:
+        header = '\t'.join(header.split('\t')[:2])
+    np.savetxt(file, np.column_stack(columns), delimiter='\t',
+               header=header, comments='')
+
+
+# Delimiters tried when sniffing a column file, None being any whitespace
+delimiters = [',', ';', '\t', None]
+
+
+def _numbers(line, delimiter):
+    """The fields of a line as floats, or None if any is not a number"""
+
+    fields = [field for field in line.strip().split(delimiter) if field.strip()]
+    try:
+        return [float(field) for field in fields]
+    except ValueError:
+        return None
+
+
+def sniff_columns(file, nlines=50):
+    """Guess the header length, delimiter and column count of a column file
+
+    Header lines are all the lines before the first one that holds only
+    numbers. The delimiter is the first of sas_utils.delimiters that
+    splits the first data lines into the same number (at least two) of
+    numeric fields. Returns (rows_to_skip, delimiter, ncolumns). Files
+    are read with universal newlines, so that the CR only line endings
+    of old Mac files such as data/micelles/pei_ctab.dat split into lines.
+    """
+
+    f = open(file, 'rU')
+    head = list(itertools.islice(f, nlines))
+    f.close()
+
+    for rows_to_skip, line in enumerate(head):
+        if not line.strip():
+            continue
+        for delimiter in delimiters:
+            fields = _numbers(line, delimiter)
+            if fields is None or len(fields) < 2:
+                continue
+            sample = [l for l in head[rows_to_skip:] if l.strip()][:10]
+            counts = set([len(_numbers(l, delimiter) or []) for l in sample])
+            if counts == set([len(fields)]):
+                return rows_to_skip, delimiter, len(fields)
+    raise ValueError, "No columns of numbers found in " + str(file)
+
+
+def read_columns(file, rows_to_skip=None, delimiter=None, chunk=100000):
+    """Read a text file of numeric columns into a (ncolumns, nrows) array
+
+    The header and delimiter are found with sniff_columns unless
+    rows_to_skip is given. The text is parsed chunk lines at a time
+    straight into float64 with np.fromstring, which is much faster than
+    np.loadtxt on large files. Blank lines are ignored.
+    """
+
+    if rows_to_skip is None:
+        rows_to_skip, delimiter, ncolumns = sniff_columns(file)
+    else:
+        ncolumns = None
+
+    blocks = []
+    f = open(file, 'rU')
+    for j in range(rows_to_skip):
+        f.readline()
+    while True:
+        lines = list(itertools.islice(f, chunk))
+        if not lines:
+            break
+        text = ''.join(lines)
+        if delimiter is not None:
+            text = text.replace(delimiter, ' ')
+        block = np.fromstring(text, dtype=float, sep=' ')
+        if not len(block):
+            continue
+        if ncolumns is None:
+            first = [line for line in lines if line.strip()][0]
+            ncolumns = len(_numbers(first, delimiter) or [])
+        if not ncolumns or len(block) % ncolumns:
+            f.close()
+            raise ValueError, "Rows of unequal length in " + str(file)
+        blocks.append(block.reshape(-1, ncolumns))
+    f.close()
+    if not blocks:
+        return np.empty((ncolumns or 2, 0))
+    return np.concatenate(blocks).T.copy()
+
+
+def column_cache(file):
+    """The path of the binary sidecar holding the parsed columns of file"""
+
+    return file + '.npy'
+
+
+def is_column_cache(path):
+    """True if path is the cache sidecar of a column file beside it"""
+
+    root, ext = os.path.splitext(path)
+    return ext == '.npy' and os.path.isfile(root)
+
+
+def load_column_data(file, rows_to_skip=None, delimiter=None, chunk=100000,
+                     cache=True):
+    """Load columns of q, I and optionally dI and dq as an ExpSasData
+
+    Header lines and the delimiter are sniffed (see sniff_columns)
+    unless rows_to_skip is given, and the text is parsed in chunks with
+    read_columns. With cache set the parsed columns are saved to a
+    sidecar .npy file (see column_cache) which later loads memory map in
+    place of the text, for as long as it is newer than the text. The
+    sidecar is skipped if it cannot be written.
+    """
+
+    if os.path.splitext(file)[1] == '.npy':
+        columns = np.load(file, mmap_mode='r')
+    elif (cache and os.path.exists(column_cache(file)) and
+            os.path.getmtime(column_cache(file)) >= os.path.getmtime(file)):
+        columns = np.load(column_cache(file), mmap_mode='r')
+    else:
+        columns = read_columns(file, rows_to_skip, delimiter, chunk)
+        if cache:
+            try:
+                np.save(column_cache(file), columns)
+            except (IOError, OSError):
+                pass
+
+    err = None
+    if len(columns) > 2:
+        err = columns[2]
+    data = ExpSasData(columns[0], columns[1], err)
+    if len(columns) > 3:
+        data.dq = columns[3]
+    return data
+
+
+def _load_column_file(path):
+    """Pool worker for load_files, leaving the parsed columns in the cache"""
+
+    data = load_column_data(path)
+    if os.path.exists(column_cache(path)):
+        return None
+    return data
+
+
+def load_files(paths, processes=None):
+    """Load many column files concurrently with load_column_data
+
+    The files are parsed across processes worker processes, which write
+    the cache sidecars; the returned ExpSasData objects then memory map
+    them. Files whose cache could not be written are sent back whole.
+    """
+
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    processes = max(min(processes, len(paths)), 1)
+    if processes == 1:
+        return [load_column_data(path) for path in paths]
+    pool = multiprocessing.Pool(processes)
+    try:
+        loaded = pool.map(_load_column_file, paths, 1)
+    finally:
+        pool.close()
+        pool.join()
+    return [data if data is not None else load_column_data(path)
+            for path, data in zip(paths, loaded)]
+
+
+def load_2d_data(file, shape=None, rows_to_skip=None, chunk=100000):
+    """Load 2-D data as a SasData2D backed by a memory mapped array
+
+    A .npy file holding the (4, npixels) array is opened directly.
+    Anything else is read as text with columns qx, qy, I and optionally
+    the error on I, skipping rows_to_skip header lines (by default all
+    the lines before the first one that starts with a number). The text
+    is read chunk lines at a time into a sidecar file.npy, which is used
+    in place of the text next time as long as it is newer.
+    """
+
+    if os.path.splitext(file)[1] == '.npy':
+        return SasData2D(np.load(file, mmap_mode='r'), shape, file)
+
+    cache = file + '.npy'
+    if (os.path.exists(cache) and
+            os.path.getmtime(cache) >= os.path.getmtime(file)):
+        return SasData2D(np.load(cache, mmap_mode='r'), shape, cache)
+
+    f = open(file, 'r')
+    if rows_to_skip is None:
+        rows_to_skip = 0
+        for line in f:
+            fields = line.split()
+            try:
+                float(fields[0])
+                break
+            except (ValueError, IndexError):
+                rows_to_skip += 1
+        f.seek(0)
+    npixels = -rows_to_skip
+    for line in f:
+        if line.strip():
+            npixels += 1
+    f.seek(0)
+
+    data = np.lib.format.open_memmap(cache, mode='w+', dtype=float,
+                                     shape=(4, npixels))
+    for j in range(rows_to_skip):
+        f.readline()
+    start = 0
+    while start < npixels:
+        lines = list(itertools.islice(f, chunk))
+        block = np.loadtxt(lines, ndmin=2)
+        if not len(block):
+            break
+        stop = start + len(block)
+        data[:block.shape[1], start:stop] = block[:, :4].T
+        if block.shape[1] < 4:
+            data[3, start:stop] = 0.0
+        start = stop
+    f.close()
+    data.flush()
+    del data
+    return SasData2D(np.load(cache, mmap_mode='r'), shape, cache)
 
 import xml.etree.ElementTree as ET
 
@@ -220,8 +766,9 @@ def loadsasxml(file):
     then searches through the file to find the {cansas1d/1.0}Q and
     {cansas1d/1,0}I tags and then extract the text attribute from each 
     of these. The list is then converted from text to floats and the Q
-    and I lists passed to a new SasData object. Currently nothing else
-    from the sas xml folder is loaded.
+    and I lists passed to a new SasData object. The {cansas1d/1.0}Idev
+    values are loaded as the uncertainties if there is one for every
+    point. Currently nothing else from the sas xml folder is loaded.
     """
 
     # Check that file is a sasxml file
@@ -246,6 +793,15 @@ def loadsasxml(file):
     for elements in i_tags:
         i_list.append(float(elements.text))
 
+    # and the <Idev> tags if they are present for every point
+    idev_tags = elem.getiterator("{cansas1d/1.0}Idev")
+    idev_list = []
+
+    for elements in idev_tags:
+        idev_list.append(float(elements.text))
+    if len(idev_list) != len(i_list):
+        idev_list = None
+
     # check everything is ok with q_list and i_list
     assert len(q_list) == len(i_list), 'different number of q and i values?'
     assert len(q_list) != 0, 'appear to be no q values'
@@ -253,7 +809,7 @@ def loadsasxml(file):
     assert q_list[0] < q_list[-1], 'q values not in order?'
 
     # generate and return a SasData object
-    return ExpSasData(q_list, i_list)
+    return ExpSasData(q_list, i_list, idev_list)
 
 
     
@@ -0,0 +1,329 @@
+# PyBioSas.service: A local HTTP/JSON service for model calculations
+# and fits
+#
+# Public Domain Waiver:
+# To the extent possible under law, Cameron Neylon has waived all
+# copyright and related or neighboring rights to service.py
+# This work is published from United Kingdom.
+#
+# See http://creativecommons.org/publicdomain/zero/1.0/
+#
+# Running modelling.py for every calculation pays the cost of starting
+# Python and importing the models each time. This service is started
+# once and answers requests over HTTP on localhost. Requests are handled
+# on threads, which only parse the request and wait; the calculations
+# and fits run in a pool of worker processes that keep every model they
+# have loaded. At most max_concurrent requests are given to the pool at
+# once and at most max_queue more wait for a turn; beyond that requests
+# are refused with 503 so a client can back off. A request that runs
+# for longer than the timeout is answered with 504, but the worker runs
+# on to the end of the job and its slot is only freed then.
+#
+# Endpoints, all taking and returning json:
+#
+#   POST /calculate  {"model", "parameters", "q"} -> {"q", "i"}
+#   POST /fit        {"model", "parameters", "q", "i", "err" (optional),
+#                     "weighting", "optimizer"} or a "dataset" path in
+#                     place of q, i and err -> {"parameters", "chi2",
+#                     "reduced_chi2", "success", "nfev"}
+#   GET  /models     the registered models and their parameters
+#   GET  /metrics    request counts and latencies for each endpoint
+#
+# Usage from the command line:
+#
+#     python service.py --port 8450 -j 4
+
+import optparse
+import BaseHTTPServer
+import SocketServer
+import multiprocessing
+import threading
+import collections
+import copy
+import json
+import time
+import numpy as np
+try:
+    import pybiosas.modelling as modelling
+    import pybiosas.models as models
+    import pybiosas.sas_utils as sas_utils
+except ImportError:
+    import modelling
+    import models
+    import sas_utils
+
+# Models loaded in this worker process, by registered name, with the
+# default values of their parameters as loaded
+_models = {}
+_defaults = {}
+
+
+def _model(name):
+    """The worker's instance of a model, reset to its default values
+
+    Requests only set the parameters they name, so every other
+    parameter is put back to its default rather than keeping the value
+    left by an earlier request.
+    """
+
+    if name not in _models:
+        _models[name] = modelling.load_model(name)
+        _defaults[name] = [(paramname, _models[name].getParam(paramname))
+                           for paramname in _models[name].details.keys()]
+    for paramname, value in _defaults[name]:
+        _models[name].setParam(paramname, value)
+    return _models[name]
+
+
+def _calculate(request):
+    model_func = _model(request['model'])
+    modelling.complete_parameters(model_func,
+                                  copy.deepcopy(request.get('parameters', [])))
+    q = np.asarray(request['q'], dtype=float)
+    return {'q' : q.tolist(),
+            'i' : np.asarray(modelling.evaluate_model(model_func, q)).tolist()}
+
+
+def _fit(request):
+    model_func = _model(request['model'])
+    parameters = modelling.complete_parameters(model_func,
+                                               copy.deepcopy(request['parameters']))
+    if 'dataset' in request:
+        data = modelling.load_dataset(request['dataset'])
+    else:
+        data = sas_utils.ExpSasData(request['q'], request['i'],
+                                    request.get('err'))
+    result = modelling.fit_parameters(model_func, request['model'],
+                                      parameters, data.q, data.i,
+                                      data.sigma(request.get('weighting',
+                                                             'auto')),
+                                      request.get('optimizer', 'leastsq'))
+    free = [par for par in parameters if not par.get('fixed', False)]
+    return {'parameters'   : parameters,
+            'chi2'         : result[5],
+            'reduced_chi2' : result[5] / max(len(data) - len(free), 1),
+            'success'      : bool(result[4]),
+            'nfev'         : result[2]['nfev']}
+
+
+operations = {'calculate' : _calculate,
+              'fit'       : _fit}
+
+
+class ServiceBusy(Exception):
+    pass
+
+
+class ServiceTimeout(Exception):
+    pass
+
+
+class Metrics:
+    """Request counts and latencies kept for each endpoint
+
+    Only the latest window latencies are kept for the percentiles.
+    """
+
+    def __init__(self, window=1000):
+        self.lock = threading.Lock()
+        self.window = window
+        self.counts = collections.defaultdict(lambda: {'ok' : 0, 'error' : 0,
+                                                       'busy' : 0,
+                                                       'timeout' : 0})
+        self.latencies = collections.defaultdict(
+                             lambda: collections.deque(maxlen=self.window))
+
+    def record(self, endpoint, outcome, seconds=None):
+        self.lock.acquire()
+        try:
+            self.counts[endpoint][outcome] += 1
+            if seconds is not None:
+                self.latencies[endpoint].append(seconds)
+        finally:
+            self.lock.release()
+
+    def summary(self):
+        self.lock.acquire()
+        try:
+            out = {}
+            for endpoint, counts in self.counts.items():
+                out[endpoint] = dict(counts)
+                latencies = list(self.latencies[endpoint])
+                if latencies:
+                    p50, p95 = np.percentile(latencies, [50, 95])
+                    out[endpoint]['latency'] = {'mean' : float(np.mean(latencies)),
+                                                'p50'  : float(p50),
+                                                'p95'  : float(p95),
+                                                'max'  : float(max(latencies))}
+            return out
+        finally:
+            self.lock.release()
+
+
+class FitService:
+    """Runs calculate and fit requests on a pool of worker processes
+
+    The pool is started when the service is created, which should be
+    before any threads are started.
+    """
+
+    def __init__(self, processes=None, max_concurrent=None, max_queue=32,
+                 timeout=600):
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        if max_concurrent is None:
+            max_concurrent = processes
+        self.pool = multiprocessing.Pool(processes)
+        self.slots = threading.BoundedSemaphore(max_concurrent)
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.waiting = 0
+        self.lock = threading.Lock()
+        self.metrics = Metrics()
+
+    def submit(self, operation, request):
+        """Run an operation in the pool and return its result
+
+        Raises ServiceBusy if max_queue requests are already waiting and
+        ServiceTimeout if the operation runs for longer than timeout
+        seconds, in which case its slot is held until the worker has
+        finished with it. Exceptions raised by the operation are raised
+        again here.
+        """
+
+        self.lock.acquire()
+        try:
+            if self.waiting >= self.max_queue:
+                raise ServiceBusy, "Too many requests waiting"
+            self.waiting += 1
+        finally:
+            self.lock.release()
+
+        self.slots.acquire()
+        self.lock.acquire()
+        self.waiting -= 1
+        self.lock.release()
+        result = self.pool.apply_async(operations[operation], (request,))
+        running = False
+        try:
+            return result.get(self.timeout)
+        except multiprocessing.TimeoutError:
+            running = True
+            thread = threading.Thread(target=self._release_when_done,
+                                      args=(result,))
+            thread.daemon = True
+            thread.start()
+            raise ServiceTimeout, ("No result after %g seconds" %
+                                   self.timeout)
+        finally:
+            if not running:
+                self.slots.release()
+
+    def _release_when_done(self, result):
+        result.wait()
+        self.slots.release()
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
+
+
+class ServiceHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def send_json(self, code, body):
+        text = json.dumps(body)
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(text)))
+        self.end_headers()
+        self.wfile.write(text)
+
+    def do_GET(self):
+        service = self.server.service
+        if self.path == '/metrics':
+            self.send_json(200, service.metrics.summary())
+        elif self.path == '/models':
+            self.send_json(200, dict([(name, [par['paramname'] for par in
+                                              entry['exp_vals']])
+                                      for name, entry in
+                                      models.models.items()]))
+        else:
+            self.send_json(404, {'error' : 'Unknown path ' + self.path})
+
+    def do_POST(self):
+        service = self.server.service
+        endpoint = self.path.strip('/')
+        if endpoint not in operations:
+            self.send_json(404, {'error' : 'Unknown path ' + self.path})
+            return
+
+        start_time = time.time()
+        try:
+            length = int(self.headers.getheader('Content-Length', 0))
+            request = json.loads(self.rfile.read(length))
+            result = service.submit(endpoint, request)
+        except ServiceBusy, error:
+            service.metrics.record(endpoint, 'busy')
+            self.send_json(503, {'error' : str(error)})
+        except ServiceTimeout, error:
+            service.metrics.record(endpoint, 'timeout')
+            self.send_json(504, {'error' : str(error)})
+        except (ValueError, KeyError, TypeError), error:
+            service.metrics.record(endpoint, 'error')
+            self.send_json(400, {'error' : repr(error)})
+        except Exception, error:
+            service.metrics.record(endpoint, 'error')
+            self.send_json(500, {'error' : repr(error)})
+        else:
+            service.metrics.record(endpoint, 'ok', time.time() - start_time)
+            self.send_json(200, result)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, format,
+                                                              *args)
+
+
+class ServiceServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """Threaded HTTP server holding a FitService"""
+
+    daemon_threads = True
+
+    def __init__(self, address, service, verbose=False):
+        BaseHTTPServer.HTTPServer.__init__(self, address, ServiceHandler)
+        self.service = service
+        self.verbose = verbose
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser()
+    parser.add_option('--host', type = str, dest = 'host',
+                      default = '127.0.0.1', help = "Address to listen on")
+    parser.add_option('--port', type = int, dest = 'port', default = 8450,
+                      help = "Port to listen on")
+    parser.add_option('-j', '--processes', type = int, dest = 'processes',
+                      default = None, help = "Number of worker processes")
+    parser.add_option('--max-concurrent', type = int, dest = 'max_concurrent',
+                      default = None,
+                      help = """Requests run at once, defaults to the number
+                      of worker processes""")
+    parser.add_option('--max-queue', type = int, dest = 'max_queue',
+                      default = 32,
+                      help = "Requests allowed to wait before refusing more")
+    parser.add_option('-v', '--verbose', action = 'store_true',
+                      dest = 'verbose', default = False,
+                      help = "Log every request")
+
+    (options, args) = parser.parse_args()
+    service = FitService(options.processes, options.max_concurrent,
+                         options.max_queue)
+    server = ServiceServer((options.host, options.port), service,
+                           options.verbose)
+    print "Serving on", options.host, "port", server.server_address[1]
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
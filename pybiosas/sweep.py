@@ -0,0 +1,377 @@
+# PyBioSas.sweep: Run the tasks of a task table across worker processes,
+# longest first
+#
+# Public Domain Waiver:
+# To the extent possible under law, Cameron Neylon has waived all
+# copyright and related or neighboring rights to sweep.py
+# This work is published from United Kingdom.
+#
+# See http://creativecommons.org/publicdomain/zero/1.0/
+#
+# Fits from some starting points take much longer than others (for
+# ellipticalCylinder those with a long length in particular). Run in
+# grid order the slow tasks are as likely to come last as first, and the
+# sweep then waits on a few stragglers after the other workers have run
+# out of work. Here the wall time and number of function evaluations of
+# every task are recorded in a costs file (one json line per task) and a
+# CostModel built from them predicts the cost of each task from
+#
+#     (model, dataset size, start region)
+#
+# where the start region is the decade of each free starting value.
+# Unseen regions fall back to the mean time per data point for the
+# model. Tasks are then handed out most expensive first, the longest
+# processing time rule, so the cheap tasks fill in the gaps at the end.
+# Runs of cheap tasks are sent to the workers in chunks of at least
+# min_seconds of predicted work to save on the dispatch.
+#
+# Usage from the command line (run from the data directory as the
+# tables hold relative paths):
+#
+#     python ../../pybiosas/sweep.py run --table bagout_q48_table.tasks -j 8
+#     python ../../pybiosas/sweep.py report --costs bagout_q48_table.tasks.costs -j 8
+#
+# The report compares the makespan of the recorded tasks run in grid
+# order with that in the order the cost model gives, for j workers.
+#
+# While a sweep runs its progress, throughput and ETA are printed every
+# --interval seconds and, with --metrics, written to a Prometheus text
+# file (see pybiosas.telemetry).
+
+import optparse
+import multiprocessing
+import heapq
+import json
+import math
+import time
+import os
+import os.path
+try:
+    import pybiosas.modelling as modelling
+    import pybiosas.tasktable as tasktable
+    import pybiosas.parallel as parallel
+    import pybiosas.telemetry as telemetry
+except ImportError:
+    import modelling
+    import tasktable
+    import parallel
+    import telemetry
+
+
+def start_region(start, resolution=1.0):
+    """The region key of a dictionary of free starting values
+
+    Each value is binned by resolution decades of its magnitude, with
+    zero in a bin of its own.
+    """
+
+    region = []
+    for name in sorted(start.keys()):
+        value = abs(start[name])
+        if value == 0:
+            region.append((name, None))
+        else:
+            region.append((name, int(math.floor(math.log10(value) /
+                                                 resolution))))
+    return tuple(region)
+
+
+class CostModel:
+    """Predicts the wall time of a fit from the costs of earlier fits
+
+    Records are dictionaries with 'model', 'npoints', 'start' (the free
+    starting values by name) and 'seconds', as written by run_sweep.
+    """
+
+    def __init__(self, records=[], resolution=1.0):
+        self.resolution = resolution
+        self.regions = {}
+        self.models = {}
+        self.total = [0.0, 0]
+        for record in records:
+            self.add(record)
+
+    def key(self, model, npoints, start):
+        return (model, npoints, start_region(start, self.resolution))
+
+    def add(self, record):
+        """Add the cost of a task, unless it failed with an error"""
+
+        if 'seconds' not in record or 'error' in record:
+            return
+        key = self.key(record['model'], record['npoints'], record['start'])
+        for table, index, value in [
+                (self.regions, key, record['seconds']),
+                (self.models, record['model'],
+                 record['seconds'] / max(record['npoints'], 1))]:
+            entry = table.setdefault(index, [0.0, 0])
+            entry[0] += value
+            entry[1] += 1
+        self.total[0] += record['seconds']
+        self.total[1] += 1
+
+    def predict(self, model, npoints, start):
+        """Mean seconds of the region, else the model's mean time per point"""
+
+        entry = self.regions.get(self.key(model, npoints, start))
+        if entry:
+            return entry[0] / entry[1]
+        entry = self.models.get(model)
+        if entry:
+            return entry[0] / entry[1] * npoints
+        if self.total[1]:
+            return self.total[0] / self.total[1]
+        return 1.0
+
+
+def load_costs(path):
+    """The records in a costs file, or none if it does not exist yet"""
+
+    if not os.path.exists(path):
+        return []
+    f = open(path, 'r')
+    records = [json.loads(line) for line in f if line.strip()]
+    f.close()
+    return records
+
+
+def free_start(header, values, index):
+    """The free starting values of task index by parameter name"""
+
+    return dict([(name, float(value)) for name, fixed, value in
+                 zip(header['names'], header['fixed'], values[index])
+                 if not fixed])
+
+
+def plan_chunks(costs, min_seconds=0.0):
+    """Group task indices into chunks, most expensive first
+
+    costs is a dictionary of task index to predicted seconds. Tasks are
+    ordered by decreasing cost, and consecutive tasks are put together
+    until each chunk has at least min_seconds of work, so expensive
+    tasks go out on their own and cheap ones in batches.
+    """
+
+    order = sorted(costs.keys(), key=lambda index: (-costs[index], index))
+    chunks = []
+    chunk = []
+    total = 0.0
+    for index in order:
+        chunk.append(index)
+        total += costs[index]
+        if total >= min_seconds:
+            chunks.append(chunk)
+            chunk = []
+            total = 0.0
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+def simulate_makespan(seconds, workers):
+    """Makespan of tasks taking seconds, handed in order to free workers"""
+
+    finish = [0.0] * max(workers, 1)
+    for cost in seconds:
+        heapq.heapreplace(finish, finish[0] + cost)
+    return max(finish)
+
+
+def _run_chunk(state, chunk):
+    """Fit and write each task of a chunk, returning their cost records"""
+
+    if 'table_values' not in state:
+        state['header'], state['table_values'] = \
+            tasktable.read_table(state['table'])
+    header = state['header']
+    records = []
+    for index in chunk:
+        args = dict(state['options'])
+        args.update(tasktable.task_args(header, state['table_values'], index))
+        record = {'task'    : index,
+                  'model'   : header['model'],
+                  'npoints' : state['npoints'],
+                  'start'   : free_start(header, state['table_values'], index)}
+        start_time = time.time()
+        start_cpu = os.times()
+        try:
+            wrapper = modelling.ModelWrapper(args)
+            wrapper.execute()
+            wrapper.write()
+            record.update({'nfev'    : wrapper.nfev,
+                           'success' : bool(wrapper.fitsuccess),
+                           'aborted' : wrapper.aborted})
+        except Exception, error:
+            record['error'] = repr(error)
+        record['seconds'] = time.time() - start_time
+        end_cpu = os.times()
+        record['cpu'] = ((end_cpu[0] - start_cpu[0]) +
+                         (end_cpu[1] - start_cpu[1]))
+        record['pid'] = os.getpid()
+        records.append(record)
+    return records
+
+
+def run_sweep(table, processes=None, order='cost', costs_path=None,
+              min_seconds=0.0, options=None, tasks=None, metrics_path=None,
+              interval=10.0, quiet=False):
+    """Run the tasks of a task table across a pool of workers
+
+    order is 'cost' to hand the tasks out most expensive first as
+    predicted from the costs file (by default table.costs), or 'grid'
+    for table order. The cost of every task run is appended to the costs
+    file as it finishes. options are further ModelWrapper arguments
+    applied to every task, e.g. {'optimizer' : 'trf'}. tasks selects a
+    subset as for modelling.py task ('N' or 'N:M').
+
+    Progress is reported every interval seconds, and written to
+    metrics_path in the Prometheus text format if it is given, by a
+    telemetry.SweepTelemetry.
+
+    Returns (records, wall seconds).
+    """
+
+    header, values = tasktable.read_table(table)
+    if costs_path is None:
+        costs_path = table + '.costs'
+    indices = tasktable.parse_range(tasks or ':', header['ntasks'])
+    npoints = len(modelling.load_dataset(header['dataset']))
+
+    if order == 'cost':
+        model = CostModel(load_costs(costs_path))
+        predicted = dict([(index,
+                           model.predict(header['model'], npoints,
+                                         free_start(header, values, index)))
+                          for index in indices])
+        chunks = plan_chunks(predicted, min_seconds)
+    elif order == 'grid':
+        chunks = [[index] for index in indices]
+    else:
+        raise ValueError, "Unknown order: " + str(order)
+
+    pool = parallel.ModelPool(None, [], shared = {'table'   : table,
+                                                  'npoints' : npoints,
+                                                  'options' : options or {}},
+                              processes = processes)
+    progress = telemetry.SweepTelemetry(len(indices), pool.processes,
+                                        metrics_path, interval,
+                                        quiet = quiet)
+    start_time = time.time()
+    records = []
+    f = open(costs_path, 'a')
+    try:
+        results = pool.imap_unordered(_run_chunk, chunks)
+        while True:
+            try:
+                if pool.pool is None:
+                    chunk_records = results.next()
+                else:
+                    chunk_records = results.next(interval)
+            except StopIteration:
+                break
+            except multiprocessing.TimeoutError:
+                progress.write()
+                continue
+            for record in chunk_records:
+                f.write(json.dumps(record) + '\n')
+                progress.record(record)
+            f.flush()
+            records += chunk_records
+            progress.update()
+    finally:
+        f.close()
+        pool.close()
+    progress.write()
+    return records, time.time() - start_time
+
+
+def makespan_report(records, workers, resolution=1.0):
+    """Compare the makespan of the recorded tasks in grid and cost order
+
+    The tasks are timed with their recorded seconds in both cases; the
+    cost order is that predicted by a CostModel of the same records.
+    Returns (grid makespan, cost ordered makespan, lower bound), the
+    bound being the larger of the mean load per worker and the longest
+    task.
+    """
+
+    latest = {}
+    for record in records:
+        if 'seconds' in record:
+            latest[record['task']] = record
+    records = [latest[index] for index in sorted(latest.keys())]
+    model = CostModel(records, resolution)
+    seconds = [record['seconds'] for record in records]
+    grid = simulate_makespan(seconds, workers)
+    ordered = sorted(records, key=lambda record:
+                     -model.predict(record['model'], record['npoints'],
+                                    record['start']))
+    cost = simulate_makespan([record['seconds'] for record in ordered],
+                             workers)
+    bound = max(sum(seconds) / workers, max(seconds))
+    return grid, cost, bound
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser(usage = "%prog run|report [options]")
+    parser.add_option('--table', type = str, dest = 'table',
+                      help = "Task table written by cli.py --table")
+    parser.add_option('--tasks', type = str, dest = 'tasks', default = None,
+                      help = "Only run task N or tasks N:M of the table")
+    parser.add_option('--costs', type = str, dest = 'costs', default = None,
+                      help = """File of the recorded task costs, by default
+                      the table path with .costs appended""")
+    parser.add_option('--order', type = str, dest = 'order', default = 'cost',
+                      help = "Hand out tasks by predicted 'cost' or in 'grid' order")
+    parser.add_option('--min-seconds', type = float, dest = 'min_seconds',
+                      default = 0.0,
+                      help = """Batch cheap tasks into chunks of at least this
+                      many predicted seconds""")
+    parser.add_option('-j', '--processes', type = int, dest = 'processes',
+                      default = None, help = "Number of worker processes")
+    parser.add_option('-f', '--optimizer', type = str, dest = 'optimizer',
+                      default = None, help = "Optimizer backend for every fit")
+    parser.add_option('-w', '--weighting', type = str, dest = 'weighting',
+                      default = None, help = "Weighting for every fit")
+    parser.add_option('--metrics', type = str, dest = 'metrics',
+                      default = None,
+                      help = """Path of a Prometheus text file to keep updated
+                      with the progress of the sweep""")
+    parser.add_option('--interval', type = float, dest = 'interval',
+                      default = 10.0,
+                      help = "Seconds between progress reports")
+    parser.add_option('--lean', action = 'store_true', dest = 'lean',
+                      default = None,
+                      help = "Write lean output for every fit (see modelling.py)")
+
+    (options, args) = parser.parse_args()
+    if not args:
+        parser.error("A command, run or report, is required")
+    costs_path = options.costs
+    if costs_path is None and options.table:
+        costs_path = options.table + '.costs'
+
+    if args[0] == 'run':
+        fit_options = {}
+        for key in ['optimizer', 'weighting', 'lean']:
+            if getattr(options, key) is not None:
+                fit_options[key] = getattr(options, key)
+        records, seconds = run_sweep(options.table, options.processes,
+                                     options.order, costs_path,
+                                     options.min_seconds, fit_options,
+                                     options.tasks, options.metrics,
+                                     options.interval)
+        failed = len([record for record in records if 'error' in record])
+        print "Ran", len(records), "tasks,", failed, "failed, in %.1f s" % seconds
+    elif args[0] == 'report':
+        if options.processes is None:
+            parser.error("The number of workers (-j) is required")
+        grid, cost, bound = makespan_report(load_costs(costs_path),
+                                            options.processes)
+        print "%-12s %12s" % ('order', 'makespan')
+        print "%-12s %12.1f" % ('grid', grid)
+        print "%-12s %12.1f" % ('cost', cost)
+        print "%-12s %12.1f" % ('lower bound', bound)
+        print "Improvement over grid order: %.1f%%" % (100 * (1 - cost / grid))
+    else:
+        parser.error("Unknown command: " + args[0])
@@ -0,0 +1,132 @@
+# PyBioSas.tasktable: A compact binary table of fit tasks
+#
+# Public Domain Waiver:
+# To the extent possible under law, Cameron Neylon has waived all
+# copyright and related or neighboring rights to tasktable.py
+# This work is published from United Kingdom.
+#
+# See http://creativecommons.org/publicdomain/zero/1.0/
+#
+# A bag of tasks written by cli.py repeats the model, dataset, script
+# path and the full json parameter list on every line, so a sweep of
+# 10^5 starting points gives a bag of tens of megabytes and every task
+# parses its own json. A task table holds everything that is common to
+# the tasks once, followed by the matrix of starting values:
+#
+#   line 1     json header: model, dataset, outpath, progpath, the
+#              parameter names and fixed flags, the mask options and the
+#              number of tasks, padded with spaces to a multiple of 8
+#              bytes
+#   the rest   float64 starting values, one row of len(names) per task
+#
+# The matrix is memory mapped, so running task N only reads the header
+# and row N. Tables are written by SingleModelFitSet.write_task_table in
+# cli.py and run with
+#
+#     python modelling.py task --table bagout.tasks --tasks 0:100
+
+import json
+import os
+import os.path
+import numpy as np
+
+FORMAT = 'pybiosas-tasks'
+VERSION = 1
+
+
+def write_table(path, header, rows, ntasks, chunk=10000):
+    """Write a task table of ntasks rows to path
+
+    header is a dictionary that must include 'names', the parameter
+    names in the order of the values in each row. rows is an iterable
+    of ntasks sequences of values, which is written chunk rows at a time
+    so the whole matrix is never held in memory.
+    """
+
+    header = dict(header)
+    header.update({'format' : FORMAT, 'version' : VERSION,
+                   'ntasks' : ntasks})
+    line = json.dumps(header)
+    line += ' ' * (-(len(line) + 1) % 8) + '\n'
+
+    nparams = len(header['names'])
+    written = 0
+    f = open(path, 'wb')
+    f.write(line)
+    block = []
+    for row in rows:
+        block.append(row)
+        if len(block) == chunk:
+            f.write(np.array(block, dtype='<f8').reshape(-1, nparams).tostring())
+            written += len(block)
+            block = []
+    if block:
+        f.write(np.array(block, dtype='<f8').reshape(-1, nparams).tostring())
+        written += len(block)
+    f.close()
+    if written != ntasks:
+        os.remove(path)
+        raise ValueError, "Expected %d tasks but was given %d" % (ntasks,
+                                                                   written)
+    return path
+
+
+def read_table(path):
+    """Return the header and memory mapped (ntasks, nparams) values of a table"""
+
+    f = open(path, 'rb')
+    line = f.readline()
+    f.close()
+    try:
+        header = json.loads(line)
+    except ValueError:
+        header = {}
+    if header.get('format') != FORMAT:
+        raise ValueError, path + " is not a task table"
+    if header['version'] > VERSION:
+        raise ValueError, "Task table version %d is not supported" % \
+                          header['version']
+    shape = (header['ntasks'], len(header['names']))
+    if not header['ntasks']:
+        return header, np.empty(shape)
+    values = np.memmap(path, dtype='<f8', mode='r', offset=len(line),
+                       shape=shape)
+    return header, values
+
+
+def parse_range(tasks, ntasks):
+    """The task indices selected by 'N', 'N:M' (M excluded) or 'N:'"""
+
+    if ':' not in tasks:
+        start = int(tasks)
+        if not 0 <= start < ntasks:
+            raise IndexError, "Task %d is not in the table" % start
+        return [start]
+    start, stop = tasks.split(':')
+    start = int(start) if start else 0
+    stop = min(int(stop), ntasks) if stop else ntasks
+    return range(start, stop)
+
+
+def task_args(header, values, index):
+    """ModelWrapper arguments for task index of a table
+
+    The parameter list is built from the header names and fixed flags
+    with the values of the task's row. The output is written to
+    outpath/NNNNNN.json as for the tasks of a bag.
+    """
+
+    parameters = []
+    for name, fixed, value in zip(header['names'], header['fixed'],
+                                  values[index]):
+        parameters.append({'paramname' : name,
+                           'value'     : float(value),
+                           'fixed'     : bool(fixed)})
+    args = {'command'    : 'fit',
+            'model'      : header['model'],
+            'dataset'    : header['dataset'],
+            'parameters' : parameters,
+            'outpath'    : os.path.join(header['outpath'] or '',
+                                        '%06d.json' % index)}
+    args.update(header.get('options', {}))
+    return args
@@ -0,0 +1,168 @@
+# PyBioSas.telemetry: Progress and throughput of a running sweep
+#
+# Public Domain Waiver:
+# To the extent possible under law, Cameron Neylon has waived all
+# copyright and related or neighboring rights to telemetry.py
+# This work is published from United Kingdom.
+#
+# See http://creativecommons.org/publicdomain/zero/1.0/
+#
+# SweepTelemetry is given the cost record of every task as it finishes
+# (see sweep.run_sweep) and keeps
+#
+#   counts        completed, failed (raised an error), aborted (stopped by
+#                 the fit monitor), running and queued tasks
+#   throughput    fits per second over the whole sweep and over the last
+#                 window completions, the latter giving the ETA
+#   workers       the cpu seconds used by each worker process over the
+#                 wall time of the sweep, which should be near one for a
+#                 busy worker
+#   stalls        seconds since the last task completed
+#
+# Every interval seconds a one line summary is printed and, if a path is
+# given, the metrics are written in the Prometheus text exposition
+# format. The file is written to a temporary name and renamed so that a
+# node_exporter textfile collector (or anything else polling it) never
+# reads it half written.
+
+import collections
+import time
+import os
+
+
+class SweepTelemetry:
+    """Counts, rates and an ETA for a sweep of total tasks on workers"""
+
+    def __init__(self, total, workers, path=None, interval=10.0, window=50,
+                 quiet=False):
+        self.total = total
+        self.workers = workers
+        self.path = path
+        self.interval = interval
+        self.quiet = quiet
+        self.start_time = time.time()
+        self.last_write = self.start_time
+        self.last_completion = self.start_time
+        self.completions = collections.deque(maxlen=window)
+        self.counts = {'completed' : 0, 'failed' : 0, 'aborted' : 0}
+        self.cpu = {}
+
+    def record(self, record):
+        """Add the cost record of a finished task"""
+
+        now = time.time()
+        self.last_completion = now
+        self.completions.append(now)
+        self.counts['completed'] += 1
+        if 'error' in record:
+            self.counts['failed'] += 1
+        if record.get('aborted'):
+            self.counts['aborted'] += 1
+        if 'pid' in record:
+            self.cpu[record['pid']] = (self.cpu.get(record['pid'], 0.0) +
+                                       record.get('cpu', 0.0))
+
+    def metrics(self):
+        """The current metrics as a dictionary"""
+
+        now = time.time()
+        elapsed = max(now - self.start_time, 1e-9)
+        remaining = self.total - self.counts['completed']
+        running = min(self.workers, remaining)
+
+        rate = self.counts['completed'] / elapsed
+        recent = rate
+        if len(self.completions) > 1:
+            span = now - self.completions[0]
+            if span > 0:
+                recent = (len(self.completions) - 1) / span
+        if remaining == 0:
+            eta = 0.0
+        elif recent > 0:
+            eta = remaining / recent
+        else:
+            eta = None
+
+        metrics = dict(self.counts)
+        metrics.update({'total'                  : self.total,
+                        'running'                : running,
+                        'queued'                 : remaining - running,
+                        'elapsed_seconds'        : elapsed,
+                        'fits_per_second'        : rate,
+                        'recent_fits_per_second' : recent,
+                        'eta_seconds'            : eta,
+                        'seconds_since_completion' : now - self.last_completion,
+                        'worker_cpu_utilisation' :
+                            dict([(pid, cpu / elapsed)
+                                  for pid, cpu in self.cpu.items()])})
+        return metrics
+
+    def prometheus(self, metrics=None):
+        """The metrics in the Prometheus text exposition format"""
+
+        if metrics is None:
+            metrics = self.metrics()
+        lines = []
+
+        def add(name, kind, description, samples):
+            lines.append('# HELP pybiosas_sweep_%s %s' % (name, description))
+            lines.append('# TYPE pybiosas_sweep_%s %s' % (name, kind))
+            for labels, value in samples:
+                lines.append('pybiosas_sweep_%s%s %r' % (name, labels,
+                                                         float(value)))
+
+        add('tasks_total', 'gauge', 'Tasks in the sweep',
+            [('', metrics['total'])])
+        add('tasks', 'gauge', 'Tasks by state',
+            [('{state="%s"}' % state, metrics[state]) for state in
+             ['completed', 'failed', 'aborted', 'running', 'queued']])
+        add('elapsed_seconds', 'gauge', 'Wall time since the sweep started',
+            [('', metrics['elapsed_seconds'])])
+        add('fits_per_second', 'gauge', 'Mean fits completed per second',
+            [('', metrics['fits_per_second'])])
+        add('recent_fits_per_second', 'gauge',
+            'Fits per second over the latest completions',
+            [('', metrics['recent_fits_per_second'])])
+        if metrics['eta_seconds'] is not None:
+            add('eta_seconds', 'gauge', 'Estimated seconds to completion',
+                [('', metrics['eta_seconds'])])
+        add('seconds_since_completion', 'gauge',
+            'Seconds since a task last completed',
+            [('', metrics['seconds_since_completion'])])
+        add('worker_cpu_utilisation', 'gauge',
+            'Cpu seconds per wall second of each worker process',
+            [('{pid="%s"}' % pid, value) for pid, value in
+             sorted(metrics['worker_cpu_utilisation'].items())])
+        return '\n'.join(lines) + '\n'
+
+    def summary(self, metrics=None):
+        """A one line progress summary"""
+
+        if metrics is None:
+            metrics = self.metrics()
+        if metrics['eta_seconds'] is None:
+            eta = 'unknown'
+        else:
+            eta = '%.0f s' % metrics['eta_seconds']
+        return ('%d/%d done, %d failed, %d aborted, %.2f fits/s, ETA %s' %
+                (metrics['completed'], metrics['total'], metrics['failed'],
+                 metrics['aborted'], metrics['recent_fits_per_second'], eta))
+
+    def write(self):
+        """Print the summary and write the metrics file"""
+
+        metrics = self.metrics()
+        self.last_write = time.time()
+        if not self.quiet:
+            print self.summary(metrics)
+        if self.path:
+            f = open(self.path + '.tmp', 'w')
+            f.write(self.prometheus(metrics))
+            f.close()
+            os.rename(self.path + '.tmp', self.path)
+
+    def update(self):
+        """Write out if interval seconds have passed since the last write"""
+
+        if time.time() - self.last_write >= self.interval:
+            self.write()
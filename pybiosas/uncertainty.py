@@ -0,0 +1,214 @@
+# PyBioSas.uncertainty: Bootstrap and profile likelihood estimates of
+# the uncertainty on fitted parameters
+#
+# Public Domain Waiver:
+# To the extent possible under law, Cameron Neylon has waived all
+# copyright and related or neighboring rights to uncertainty.py
+# This work is published from United Kingdom.
+#
+# See http://creativecommons.org/publicdomain/zero/1.0/
+#
+# Both methods need many independent refits so they are run across a
+# pybiosas.parallel.ModelPool. Every refit is warm-started from the best
+# fit so that it only has to move as far as the perturbation requires.
+
+import copy
+import numpy as np
+import scipy.stats
+try:
+    import pybiosas.modelling as modelling
+    import pybiosas.parallel as parallel
+except ImportError:
+    import modelling
+    import parallel
+
+
+def _current_chi2(state):
+    """chi2 of the worker's model as currently set against the data"""
+
+    model_i = modelling.evaluate_model(state['model_func'], state['q'])
+    res = (state['i'] - model_i) / state['sigma']
+    return float(np.dot(res, res))
+
+
+def _start_chi2(state, item):
+    """chi2 at the parameters the pool was created with"""
+
+    parallel.reset_parameters(state)
+    return _current_chi2(state)
+
+
+def _bootstrap_replicate(state, seed):
+    """Refit a synthetic dataset built by resampling the weighted residuals"""
+
+    parameters = parallel.reset_parameters(state)
+    model_func = state['model_func']
+    if 'best_i' not in state:
+        state['best_i'] = modelling.evaluate_model(model_func, state['q'])
+        state['best_res'] = (state['i'] - state['best_i']) / state['sigma']
+
+    random = np.random.RandomState(seed)
+    picks = random.randint(0, len(state['q']), len(state['q']))
+    i_star = state['best_i'] + state['sigma'] * state['best_res'][picks]
+
+    result = modelling.fit_parameters(model_func, state['model'], parameters,
+                                      state['q'], i_star, state['sigma'],
+                                      state['optimizer'])
+    values = [par['value'] for par in parameters if not par.get('fixed', False)]
+    return values, result[4]
+
+
+def _profile_point(state, item):
+    """Refit with one parameter held at a given value and return chi2"""
+
+    name, value = item
+    parameters = parallel.reset_parameters(state)
+    for par in parameters:
+        if par['paramname'] == name:
+            par['value'] = value
+            par['fixed'] = True
+            state['model_func'].setParam(name, value)
+
+    if not [par for par in parameters if not par.get('fixed', False)]:
+        return name, value, _current_chi2(state)
+
+    result = modelling.fit_parameters(state['model_func'], state['model'],
+                                      parameters, state['q'], state['i'],
+                                      state['sigma'], state['optimizer'])
+    return name, value, result[5]
+
+
+def profile_interval(values, chi2, best_value, threshold):
+    """Find where a chi2 profile crosses threshold either side of the best value
+
+    The crossing is found by linear interpolation between scan points.
+    Returns [lower, upper], with None for a side where the profile does
+    not reach the threshold within the scan.
+    """
+
+    values = np.asarray(values, dtype=float)
+    chi2 = np.asarray(chi2, dtype=float)
+    order = np.argsort(values)
+    values = values[order]
+    chi2 = chi2[order]
+
+    interval = [None, None]
+    below = values <= best_value
+    above = values >= best_value
+    for side, selection, step in [(0, below, -1), (1, above, 1)]:
+        v = values[selection][::step]
+        c = chi2[selection][::step]
+        for j in range(1, len(v)):
+            if c[j] >= threshold and c[j - 1] < threshold:
+                frac = (threshold - c[j - 1]) / (c[j] - c[j - 1])
+                interval[side] = float(v[j - 1] + frac * (v[j] - v[j - 1]))
+                break
+
+    return interval
+
+
+class UncertaintyAnalysis:
+    """Uncertainty estimates for the free parameters of a converged fit
+
+    parameters is the fitted parameter list (as left in
+    ModelWrapper.parameters after a fit) and data the ExpSasData that
+    was fitted. The covariance and the profile likelihood thresholds are
+    scaled by the residual variance chi2 / (N - p).
+    """
+
+    def __init__(self, model, parameters, data, weighting='auto',
+                 optimizer='leastsq', processes=None, level=0.95):
+        self.model = model
+        self.parameters = copy.deepcopy(parameters)
+        self.free = [par for par in self.parameters
+                     if not par.get('fixed', False)]
+        self.level = level
+        self.optimizer = optimizer
+        sigma = data.sigma(weighting)
+
+        self.pool = parallel.ModelPool(model, self.parameters,
+                                       shared = {'q'         : data.q,
+                                                 'i'         : data.i,
+                                                 'sigma'     : sigma,
+                                                 'optimizer' : optimizer},
+                                       processes = processes)
+
+        # chi2 at the best fit, evaluated in a worker which holds the model
+        self.chisqr = self.pool.map(_start_chi2, [None])[0]
+        self.dof = max(len(data) - len(self.free), 1)
+        self.residual_variance = self.chisqr / self.dof
+
+    def bootstrap(self, nsamples, seed=0):
+        """Residual bootstrap refits of the free parameters
+
+        Returns a dictionary with the number of converged samples, the
+        percentile confidence interval and the sample covariance.
+        """
+
+        results = self.pool.map(_bootstrap_replicate,
+                                range(seed, seed + nsamples))
+        samples = np.array([values for values, success in results if success])
+        names = [par['paramname'] for par in self.free]
+
+        out = {'nsamples'  : len(samples),
+               'params'    : names,
+               'intervals' : {}}
+        if len(samples) < 2:
+            return out
+
+        tail = 100.0 * (1.0 - self.level) / 2.0
+        for j, name in enumerate(names):
+            lower, upper = np.percentile(samples[:, j], [tail, 100.0 - tail])
+            out['intervals'][name] = [float(lower), float(upper)]
+        out['cov'] = np.atleast_2d(np.cov(samples.T)).tolist()
+
+        return out
+
+    def profile(self, npoints, cov=None, width=4.0):
+        """Profile likelihood scans of each free parameter
+
+        Each parameter is scanned over npoints values spanning width
+        standard errors (from cov if given, otherwise 10% of the value)
+        either side of the best fit, clipped to its bounds, refitting all
+        of the other free parameters at each point. The confidence
+        interval is where chi2 rises by the chi squared quantile for one
+        degree of freedom, scaled by the residual variance.
+        """
+
+        items = []
+        for j, par in enumerate(self.free):
+            best = par['value']
+            if cov is not None and cov[j][j] > 0:
+                step = width * np.sqrt(cov[j][j])
+            else:
+                step = width * 0.1 * max(abs(best), 1e-12)
+            lower, upper = modelling.param_info(self.model, par)[0]
+            low = best - step
+            high = best + step
+            if lower is not None:
+                low = max(low, lower)
+            if upper is not None:
+                high = min(high, upper)
+            for value in np.linspace(low, high, npoints):
+                items.append((par['paramname'], float(value)))
+
+        results = self.pool.map(_profile_point, items)
+
+        delta = scipy.stats.chi2.ppf(self.level, 1) * self.residual_variance
+        out = {}
+        for par in self.free:
+            name = par['paramname']
+            points = [(value, chi2) for n, value, chi2 in results if n == name]
+            values = [point[0] for point in points]
+            chi2 = [point[1] for point in points]
+            minimum = min(min(chi2), self.chisqr)
+            out[name] = {'values'   : values,
+                         'chi2'     : chi2,
+                         'interval' : profile_interval(values, chi2,
+                                                       par['value'],
+                                                       minimum + delta)}
+
+        return out
+
+    def close(self):
+        self.pool.close()
@@ -0,0 +1,228 @@
+# PyBioSas.watch: Fit data files as they appear in a directory
+#
+# Public Domain Waiver:
+# To the extent possible under law, Cameron Neylon has waived all
+# copyright and related or neighboring rights to watch.py
+# This work is published from United Kingdom.
+#
+# See http://creativecommons.org/publicdomain/zero/1.0/
+#
+# A long running process for fitting frames as they are written at the
+# beamline. The model is imported and instantiated once when the process
+# starts and kept, so the time to fit a frame is only the fit itself.
+# The directory is polled for new files; a file is only picked up once
+# its size and modification time have stopped changing, so partly
+# written frames are not read.
+#
+# Each frame is fitted starting from the fitted values of the last frame
+# that converged (a warm start), as consecutive frames are usually
+# similar. If that fit fails the frame is refitted from the starting
+# parameters given. The result for each frame is written to its own
+# json file in the output directory and appended as a line of json to
+# results.jsonl there as soon as it is done.
+#
+# Usage from the command line:
+#
+#     python watch.py -m ellipticalCylinder -p start.json -i /data/run42 \
+#            -o /data/run42/fits --pattern '*.txt'
+
+import optparse
+import fnmatch
+import copy
+import json
+import time
+import os
+import os.path
+try:
+    import pybiosas.modelling as modelling
+    import pybiosas.sas_utils as sas_utils
+except ImportError:
+    import modelling
+    import sas_utils
+
+
+class FolderWatcher:
+    """Polls a directory for new files matching a pattern
+
+    A file is reported once, the first time it is polled after its size
+    and modification time have been unchanged for at least settle
+    seconds. The .npy sidecars the loader caches parsed text files in
+    (see sas_utils.column_cache) are never reported.
+    """
+
+    def __init__(self, directory, pattern='*', settle=1.0, existing=True):
+        self.directory = directory
+        self.pattern = pattern
+        self.settle = settle
+        self.seen = set()
+        self.pending = {}
+        if not existing:
+            self.seen.update(self._listing().keys())
+
+    def _listing(self):
+        listing = {}
+        for name in os.listdir(self.directory):
+            if fnmatch.fnmatch(name, self.pattern):
+                path = os.path.join(self.directory, name)
+                if os.path.isfile(path) and not sas_utils.is_column_cache(path):
+                    stat = os.stat(path)
+                    listing[path] = (stat.st_size, stat.st_mtime)
+        return listing
+
+    def poll(self):
+        """Return the new files that are ready, oldest first"""
+
+        now = time.time()
+        ready = []
+        for path, signature in self._listing().items():
+            if path in self.seen:
+                continue
+            previous = self.pending.get(path)
+            if previous is None or previous[0] != signature:
+                self.pending[path] = (signature, now)
+            elif now - previous[1] >= self.settle:
+                ready.append((signature[1], path))
+        ready.sort()
+        for mtime, path in ready:
+            self.seen.add(path)
+            del self.pending[path]
+        return [path for mtime, path in ready]
+
+
+class LiveFitter:
+    """Fits frames one after another with a resident model
+
+    parameters is the starting parameter list for the first frame and
+    for any frame where the warm start fails. qmin and qmax restrict the
+    q range fitted, as for modelling.py.
+    """
+
+    def __init__(self, model, parameters, outdir, weighting='auto',
+                 optimizer='leastsq', warm=True, qmin=None, qmax=None):
+        self.model = model
+        self.model_func = modelling.load_model(model)
+        self.parameters = modelling.complete_parameters(self.model_func,
+                                                        copy.deepcopy(parameters))
+        self.outdir = outdir
+        self.weighting = weighting
+        self.optimizer = optimizer
+        self.warm = warm
+        self.qmin = qmin
+        self.qmax = qmax
+        self.previous = None
+        if not os.path.exists(outdir):
+            os.makedirs(outdir)
+        self.log = open(os.path.join(outdir, 'results.jsonl'), 'a')
+
+    def _fit(self, start, data):
+        parameters = modelling.complete_parameters(self.model_func,
+                                                   copy.deepcopy(start))
+        result = modelling.fit_parameters(self.model_func, self.model,
+                                          parameters, data.q, data.i,
+                                          data.sigma(self.weighting),
+                                          self.optimizer)
+        return parameters, result
+
+    def fit_file(self, path):
+        """Fit one frame and write out the result, which is also returned"""
+
+        start_time = time.time()
+        data = modelling.load_dataset(path)
+        if self.qmin is not None or self.qmax is not None:
+            data.mask_q_range(self.qmin, self.qmax)
+        data = data.masked
+
+        warm = self.warm and self.previous is not None
+        if warm:
+            parameters, result = self._fit(self.previous, data)
+        if not warm or not result[4]:
+            warm = False
+            parameters, result = self._fit(self.parameters, data)
+        if result[4]:
+            self.previous = parameters
+
+        out = {'dataset'    : path,
+               'model'      : self.model,
+               'parameters' : parameters,
+               'chi2'       : result[5],
+               'success'    : bool(result[4]),
+               'nfev'       : result[2]['nfev'],
+               'warm_start' : warm,
+               'seconds'    : time.time() - start_time}
+        name = os.path.splitext(os.path.basename(path))[0]
+        f = open(os.path.join(self.outdir, name + '.json'), 'w')
+        json.dump(out, f)
+        f.close()
+        self.log.write(json.dumps(out) + '\n')
+        self.log.flush()
+        return out
+
+    def close(self):
+        self.log.close()
+
+
+def run(watcher, fitter, interval=1.0):
+    """Fit new files from watcher with fitter until interrupted"""
+
+    try:
+        while True:
+            for path in watcher.poll():
+                try:
+                    out = fitter.fit_file(path)
+                    print os.path.basename(path), "chi2:", out['chi2'], \
+                          "%.2f s" % out['seconds']
+                except Exception, error:
+                    print "Failed to fit", path, ":", error
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        fitter.close()
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser()
+    parser.add_option('-m', '--model', type = str, dest = 'model',
+                      help = "The model to fit to every frame")
+    parser.add_option('-p', '--parameters', type = str, dest = 'parameters',
+                      help = "Starting parameters as a json file or string")
+    parser.add_option('-i', '--indir', type = str, dest = 'indir',
+                      help = "Directory to watch for new frames")
+    parser.add_option('-o', '--outdir', type = str, dest = 'outdir',
+                      help = "Directory for the fit results")
+    parser.add_option('--pattern', type = str, dest = 'pattern', default = '*',
+                      help = "Only fit files matching this pattern")
+    parser.add_option('--interval', type = float, dest = 'interval',
+                      default = 1.0, help = "Seconds between polls")
+    parser.add_option('--settle', type = float, dest = 'settle', default = 1.0,
+                      help = """Seconds a file must be unchanged before it is
+                      read""")
+    parser.add_option('--skip-existing', action = 'store_true',
+                      dest = 'skip_existing', default = False,
+                      help = "Ignore the files already in the directory")
+    parser.add_option('--cold', action = 'store_false', dest = 'warm',
+                      default = True,
+                      help = """Start every fit from the given parameters
+                      rather than the last fit""")
+    parser.add_option('-w', '--weighting', type = str, dest = 'weighting',
+                      default = 'auto', help = "Weighting as for modelling.py")
+    parser.add_option('-f', '--optimizer', type = str, dest = 'optimizer',
+                      default = 'leastsq', help = "Optimizer backend")
+    parser.add_option('--qmin', type = float, dest = 'qmin', default = None)
+    parser.add_option('--qmax', type = float, dest = 'qmax', default = None)
+
+    (options, args) = parser.parse_args()
+    if os.path.isfile(options.parameters):
+        f = open(options.parameters, 'r')
+        parameters = json.load(f)
+        f.close()
+    else:
+        parameters = json.loads(options.parameters)
+
+    watcher = FolderWatcher(options.indir, options.pattern, options.settle,
+                            existing = not options.skip_existing)
+    fitter = LiveFitter(options.model, parameters, options.outdir,
+                        options.weighting, options.optimizer, options.warm,
+                        options.qmin, options.qmax)
+    print "Watching", options.indir
+    run(watcher, fitter, options.interval)
@@ -0,0 +1,72 @@
+"""Stand in for the SansView models in tests that cannot import sans.models
+
+StandInModel has the parts of the SansView model interface the package
+uses: params, details, orientation_params, setParam, getParam and
+evalDistribution. The curve is given as a function of the parameter
+dictionary and q. A [qx, qy] pair is evaluated at the radial q. Every
+call is counted in calls and the length of its q array kept in lengths.
+"""
+
+import numpy as np
+
+
+class StandInModel:
+
+    def __init__(self, curve, **params):
+        self.curve = curve
+        self.params = params
+        self.details = dict([(name, ['', None, None]) for name in params])
+        self.orientation_params = []
+        self.calls = 0
+        self.lengths = []
+
+    def setParam(self, name, value):
+        self.params[name] = value
+
+    def getParam(self, name):
+        return self.params[name]
+
+    def evalDistribution(self, q):
+        if isinstance(q, list):
+            q = np.sqrt(np.asarray(q[0]) ** 2 + np.asarray(q[1]) ** 2)
+        self.calls += 1
+        self.lengths.append(len(q))
+        return self.curve(self.params, q)
+
+
+def _guinier(p, q):
+    return p['scale'] * np.exp(-(q * p['rg']) ** 2 / 3.0) + p['background']
+
+def _power_law(p, q):
+    return p['scale'] * q ** -p['exponent'] + p['background']
+
+def _exponential(p, q):
+    return p['scale'] * np.exp(-p['rate'] * q)
+
+def _line(p, q):
+    return p['slope'] * q + p['background']
+
+def _gaussian(p, q):
+    return np.exp(-q * q / p['width'] ** 2)
+
+
+def guinier(scale=2.0, rg=30.0, background=0.0):
+    """scale * exp(-(q rg)**2 / 3) + background"""
+    return StandInModel(_guinier, scale=scale, rg=rg, background=background)
+
+def power_law(scale=1.0, exponent=2.0, background=0.5):
+    """scale * q**-exponent + background"""
+    return StandInModel(_power_law, scale=scale, exponent=exponent,
+                        background=background)
+
+def exponential(scale=1.0, rate=1.0):
+    """scale * exp(-rate * q)"""
+    return StandInModel(_exponential, scale=scale, rate=rate)
+
+def line(slope=1.0, background=0.0):
+    """slope * q + background"""
+    return StandInModel(_line, slope=slope, background=background)
+
+def gaussian(width=0.05):
+    """exp(-q**2 / width**2)"""
+    return StandInModel(_gaussian, width=width)
@@ -0,0 +1,49 @@
+import unittest
+import shutil
+import tempfile
+import json
+import os.path
+import numpy as np
+from pybiosas import chi2map, modelling, sas_utils
+import standin
+
+class TestChi2Map(unittest.TestCase):
+
+    def setUp(self):
+        self.load_model = modelling.load_model
+        modelling.load_model = lambda model: standin.guinier()
+        self.tempdir = tempfile.mkdtemp()
+        self.q = np.linspace(0.005, 0.1, 60)
+        i = standin.guinier(scale = 2.0, rg = 30.0).evalDistribution(self.q)
+        self.data = sas_utils.ExpSasData(self.q, i, 0.05 * i)
+
+    def tearDown(self):
+        modelling.load_model = self.load_model
+        shutil.rmtree(self.tempdir)
+
+    def testSurface(self):
+        path = os.path.join(self.tempdir, 'map')
+        surface = chi2map.chi2_map('guinier', self.data,
+                                   [{'paramname' : 'background', 'value' : 0.0}],
+                                   {'rg' : [20.0, 40.0, 21],
+                                    'scale' : [1.0, 3.0, 11]},
+                                   path, processes = 1, chunk = 50)
+        self.assertEqual(surface.shape, (21, 11))
+
+        # Against chi2 computed directly at one grid point
+        model = standin.guinier(scale = 1.4, rg = 25.0)
+        res = (self.data.i - model.evalDistribution(self.q)) / self.data.err
+        self.assertAlmostEqual(surface[5, 2], np.dot(res, res))
+        self.assertEqual(np.load(path + '.npy')[5, 2], surface[5, 2])
+
+        f = open(path + '.json')
+        info = json.load(f)
+        f.close()
+        self.assertEqual(info['names'], ['rg', 'scale'])
+        self.assertEqual(info['minimum']['index'], [10, 5])
+        self.assertAlmostEqual(info['minimum']['chi2'], 0.0)
+        self.assertAlmostEqual(info['minimum']['values']['rg'], 30.0)
+        self.assertAlmostEqual(info['minimum']['values']['scale'], 2.0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import unittest
+import numpy as np
+from pybiosas import composite, models, modelling
+import standin
+
+class TestCompositeModel(unittest.TestCase):
+
+    def setUp(self):
+        self.q = np.linspace(0.01, 0.5, 20)
+        self.a = standin.power_law()
+        self.b = standin.power_law()
+
+    def testSum(self):
+        model = composite.CompositeModel([('a', self.a), ('b', self.b)])
+        self.assertTrue('a.exponent' in model.details)
+        self.assertFalse('a.background' in model.details)
+        self.assertFalse('scale' in model.details)
+        model.setParam('b.exponent', 1.0)
+        model.setParam('background', 0.1)
+        expected = self.q ** -2.0 + self.q ** -1.0 + 0.1
+        self.assertTrue(np.allclose(model.evalDistribution(self.q), expected))
+        self.assertRaises(ValueError, model.setParam, 'c.exponent', 1.0)
+
+    def testProduct(self):
+        model = composite.CompositeModel([('a', self.a), ('b', self.b)],
+                                         'product')
+        model.setParam('scale', 3.0)
+        model.setParam('a.exponent', 1.0)
+        self.assertEqual(model.getParam('a.exponent'), 1.0)
+        expected = 3.0 * self.q ** -3.0
+        self.assertTrue(np.allclose(model.evalDistribution(self.q), expected))
+
+    def testCache(self):
+        model = composite.CompositeModel([('a', self.a), ('b', self.b)])
+        model.evalDistribution(self.q)
+        model.setParam('a.exponent', 1.5)
+        model.setParam('b.exponent', 2.0)
+        model.evalDistribution(self.q)
+        self.assertEqual((self.a.calls, self.b.calls), (2, 1))
+        model.evalDistribution(self.q[:10])
+        self.assertEqual((self.a.calls, self.b.calls), (3, 2))
+
+    def testRegistryEntry(self):
+        entry = models.models['sphere+cylinder']
+        names = [par['paramname'] for par in entry['exp_vals']]
+        self.assertTrue('sphere.radius' in names)
+        self.assertTrue('cylinder.length' in names)
+        self.assertFalse('sphere.background' in names)
+        self.assertEqual(entry['param_info']['cylinder.radius']['bounds'],
+                         [0, None])
+
+    def testFixedStructureFactor(self):
+        model = composite.CompositeModel([('form', self.a),
+                                          ('structure', self.b)], 'product',
+                                         ['structure.exponent'])
+        parameters = modelling.complete_parameters(model,
+                                                   [{'paramname' : 'scale',
+                                                     'value'     : 2.0}])
+        fixed = [par['paramname'] for par in parameters if par.get('fixed')]
+        self.assertEqual(fixed, ['structure.exponent'])
+
+        # Fitting the form factor alone only evaluates S(q) once
+        data = model.evalDistribution(self.q)
+        model.setParam('form.exponent', 1.0)
+        result = modelling.fit_parameters(model, 'test', parameters,
+                                          self.q, data,
+                                          registered_models = {'test' : {}})
+        self.assertAlmostEqual(model.getParam('form.exponent'), 2.0, places=4)
+        self.assertEqual(model.evaluations['structure'], 1)
+        self.assertTrue(model.evaluations['form'] > 2)
+
+        entry = models.models['ellipticalCylinder*hardsphere']
+        self.assertEqual(sorted(entry['fixed_params']),
+                         ['hardsphere.effect_radius', 'hardsphere.volfraction'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import unittest
+import numpy as np
+from pybiosas import curvecache, modelling
+import standin
+
+class TestCurveCache(unittest.TestCase):
+
+    def setUp(self):
+        self.q = np.linspace(0.001, 0.2, 100)
+        self.model = standin.guinier()
+        self.cache = modelling.set_curve_cache(2)
+
+    def tearDown(self):
+        modelling.set_curve_cache(0)
+
+    def testRepeats(self):
+        first = modelling.evaluate_model(self.model, self.q)
+        again = modelling.evaluate_model(self.model, self.q)
+        self.assertTrue(again is first)
+        self.assertFalse(again.flags.writeable)
+        self.assertEqual(len(self.model.lengths), 1)
+
+        # A change below the quantization is the same curve
+        self.model.setParam('rg', 30.0 * (1 + 1e-14))
+        modelling.evaluate_model(self.model, self.q)
+        self.assertEqual(len(self.model.lengths), 1)
+
+        # A finite difference step is not
+        self.model.setParam('rg', 30.0 * (1 + 1.5e-8))
+        stepped = modelling.evaluate_model(self.model, self.q)
+        self.assertEqual(len(self.model.lengths), 2)
+        self.assertFalse(np.array_equal(stepped, first))
+
+        modelling.evaluate_model(self.model, self.q[:50])
+        self.assertEqual(len(self.model.lengths), 3)
+        self.assertEqual(self.cache.stats(),
+                         {'maxsize' : 2, 'size' : 2, 'hits' : 2,
+                          'misses' : 3, 'evictions' : 1, 'hit_rate' : 0.4})
+
+    def testLeastRecentlyUsed(self):
+        for rg in [10.0, 20.0, 10.0, 30.0, 10.0]:
+            self.model.setParam('rg', rg)
+            modelling.evaluate_model(self.model, self.q)
+        self.assertEqual(len(self.model.lengths), 3)
+        self.model.setParam('rg', 20.0)
+        modelling.evaluate_model(self.model, self.q)
+        self.assertEqual(len(self.model.lengths), 4)
+
+    def testKeys(self):
+        self.assertEqual(curvecache.quantize(1.0 / 3, 3), 0.333)
+        self.assertEqual(curvecache.q_digest(self.q),
+                         curvecache.q_digest(self.q.tolist()))
+        self.assertNotEqual(curvecache.q_digest(self.q),
+                            curvecache.q_digest(self.q[::-1]))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import unittest
+import multiprocessing
+import numpy as np
+from pybiosas import composite, modelling
+import standin
+
+def _forked_evaluation(npoints):
+    q = np.linspace(0.001, 0.2, npoints)
+    return len(modelling.evaluate_model(standin.guinier(), q))
+
+class TestThreadedEvaluation(unittest.TestCase):
+
+    def setUp(self):
+        self.q = np.linspace(0.001, 0.2, 10001)
+        modelling.set_evaluation_threads(4, 1000)
+
+    def tearDown(self):
+        modelling.set_evaluation_threads(1, 2048)
+
+    def testChunkBounds(self):
+        self.assertEqual(modelling.chunk_bounds(500), [(0, 500)])
+        bounds = modelling.chunk_bounds(10001)
+        self.assertEqual(len(bounds), 4)
+        self.assertEqual(bounds[0][0], 0)
+        self.assertEqual(bounds[-1][1], 10001)
+        self.assertEqual(len(modelling.chunk_bounds(2500)), 2)
+
+    def testChunkedMatches(self):
+        model = standin.guinier()
+        threaded = modelling.evaluate_model(model, self.q)
+        self.assertEqual(len(model.lengths), 4)
+        modelling.set_evaluation_threads(1)
+        single = modelling.evaluate_model(model, self.q)
+        self.assertEqual(model.lengths[-1], len(self.q))
+        self.assertTrue(np.array_equal(threaded, single))
+
+        qx = np.linspace(-0.1, 0.1, 5000)
+        qy = np.linspace(0.1, -0.1, 5000)
+        modelling.set_evaluation_threads(4)
+        threaded = modelling.evaluate_model_2d(model, qx, qy)
+        self.assertTrue(np.allclose(threaded,
+                                    model.evalDistribution([qx, qy])))
+
+    def testForkedWorker(self):
+        # The parent's thread pool exists before the worker is forked
+        modelling.evaluate_model(standin.guinier(), self.q)
+        pool = multiprocessing.Pool(1)
+        try:
+            result = pool.apply_async(_forked_evaluation, (20000,))
+            self.assertEqual(result.get(30), 20000)
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def testCompositeCache(self):
+        a = standin.guinier()
+        b = standin.guinier()
+        model = composite.CompositeModel([('a', a), ('b', b)])
+        first = modelling.evaluate_model(model, self.q)
+        self.assertEqual((len(a.lengths), len(b.lengths)), (4, 4))
+        model.setParam('a.rg', 20.0)
+        second = modelling.evaluate_model(model, self.q)
+        self.assertEqual((len(a.lengths), len(b.lengths)), (8, 4))
+        self.assertEqual(model.evaluations, {'a' : 2, 'b' : 1})
+        self.assertTrue(np.allclose(second, model.evalDistribution(self.q)))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+import unittest
+import shutil
+import tempfile
+import os.path
+import numpy as np
+from pybiosas import fit2d, sas_utils
+import standin
+
+class TestImageResiduals(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        qx, qy = np.meshgrid(np.linspace(-0.1, 0.1, 30),
+                             np.linspace(-0.1, 0.1, 30))
+        model = standin.gaussian()
+        i = model.evalDistribution([qx.ravel(), qy.ravel()])
+        self.path = os.path.join(self.tempdir, 'image.npy')
+        np.save(self.path, np.array([qx.ravel(), qy.ravel(), i,
+                                     np.zeros(900)]))
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def testChunks(self):
+        data = sas_utils.load_2d_data(self.path)
+        data.mask_circle(0.0, 0.0, 0.03)
+        used = data.used()
+        state = {'path' : self.path, 'used' : used, 'names' : ['width'],
+                 'weighting' : 'none', 'model_func' : standin.gaussian()}
+        res = np.concatenate([fit2d._image_residuals(state, (start, start + 100,
+                                                             [0.05]))
+                              for start in range(0, len(used), 100)])
+        self.assertEqual(len(res), len(used))
+        self.assertTrue(np.allclose(res, 0.0))
+
+        start, block = fit2d._image_block(state, (0, 900, [0.06]))
+        self.assertEqual(len(block), 900)
+        self.assertTrue(np.all(block >= data.i))
+
+if __name__ == '__main__':
+    unittest.main()
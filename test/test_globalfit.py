@@ -0,0 +1,65 @@
+import unittest
+import numpy as np
+from pybiosas import globalfit, models, sas_utils
+import standin
+
+class TestSparsity(unittest.TestCase):
+
+    def testBlockStructure(self):
+        # two shared columns (0, 1) and one local column per dataset
+        sparsity = globalfit.block_sparsity([3, 2, 4], [[0, 1, 2], [0, 1, 3],
+                                                        [0, 1, 4]], 5)
+        dense = sparsity.toarray()
+        self.assertEqual(dense.shape, (9, 5))
+        self.assertEqual(dense[:, :2].sum(), 18)
+        self.assertEqual(dense[:3, 2].tolist(), [1, 1, 1])
+        self.assertEqual(dense[3:, 2].sum(), 0)
+        self.assertEqual(dense[3:5, 3].tolist(), [1, 1])
+        self.assertEqual(dense[:, 3].sum(), 2)
+        self.assertEqual(dense[5:, 4].sum(), 4)
+
+class TestGlobalFit(unittest.TestCase):
+
+    def setUp(self):
+        models.models['guinier'] = {}
+        self.q = np.linspace(0.005, 0.08, 50)
+
+    def tearDown(self):
+        del models.models['guinier']
+
+    def testSharedAndLocal(self):
+        # One radius of gyration across three datasets of different scale
+        fit = globalfit.GlobalFit(shared = ['rg'])
+        scales = [1.0, 2.0, 4.0]
+        for k, scale in enumerate(scales):
+            i = standin.guinier(scale, 30.0).evalDistribution(self.q[k:])
+            data = sas_utils.ExpSasData(self.q[k:], i, 0.01 * i)
+            fit.add_dataset(data, 'guinier',
+                            [{'paramname' : 'rg', 'value' : 20.0 + 5 * k},
+                             {'paramname' : 'scale', 'value' : 1.5},
+                             {'paramname' : 'background', 'value' : 0.0,
+                              'fixed' : True}],
+                            model_func = standin.guinier())
+        self.assertTrue(fit.fit())
+
+        self.assertEqual([column['label'] for column in fit.columns],
+                         ['rg', 'scale[0]', 'scale[1]', 'scale[2]'])
+        self.assertEqual(fit.cov_x.shape, (4, 4))
+        self.assertTrue(fit.chisqr < 1e-8)
+        for ds, scale in zip(fit.datasets, scales):
+            values = dict([(par['paramname'], par['value'])
+                           for par in ds['parameters']])
+            self.assertAlmostEqual(values['rg'], 30.0, places = 5)
+            self.assertAlmostEqual(values['scale'], scale, places = 5)
+            self.assertEqual(values['background'], 0.0)
+            self.assertAlmostEqual(ds['model_func'].getParam('rg'), 30.0,
+                                   places = 5)
+
+        # The stacked residuals follow the datasets in order
+        res = fit.residuals(fit.x + np.array([0.0, 0.1, 0.0, 0.0]))
+        self.assertEqual(len(res), 50 + 49 + 48)
+        self.assertTrue(np.all(res[:50] < 0))
+        self.assertTrue(np.allclose(res[50:], 0.0, atol = 1e-4))
+
+if __name__ == '__main__':
+    unittest.main()
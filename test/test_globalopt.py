@@ -0,0 +1,50 @@
+import unittest
+import numpy as np
+import scipy.optimize
+from pybiosas import globalopt
+
+def rastrigin(x):
+    x = np.atleast_2d(x)
+    return 10 * x.shape[1] + np.sum(x * x - 10 * np.cos(2 * np.pi * x), axis=1)
+
+class FakePool:
+    processes = 4
+
+class Rastrigin:
+    """Objective with local fits, standing in for PopulationObjective"""
+
+    pool = FakePool()
+    npoints = 10
+
+    def __call__(self, population):
+        return rastrigin(population)
+
+    def local_fits(self, starts):
+        results = []
+        for start in starts:
+            fit = scipy.optimize.minimize(lambda x: rastrigin(x)[0], start)
+            results.append((list(fit.x), float(fit.fun), fit.nfev))
+        return results
+
+class TestGlobalSearch(unittest.TestCase):
+
+    def setUp(self):
+        self.lower = -5.12 * np.ones(2)
+        self.upper = 5.12 * np.ones(2)
+
+    def testDifferentialEvolution(self):
+        best, value, generations = globalopt.differential_evolution(
+                                       rastrigin, self.lower, self.upper,
+                                       popsize=20, tol=1e-6, seed=1)
+        self.assertTrue(np.allclose(best, 0.0, atol=1e-2))
+        self.assertTrue(value < 1e-2)
+
+    def testBasinHopping(self):
+        best, value, nfev = globalopt.basin_hopping(Rastrigin(),
+                                                    np.array([3.1, -2.9]),
+                                                    self.lower, self.upper,
+                                                    niter=30, seed=1)
+        self.assertTrue(value < 1e-6)
+
+if __name__ == '__main__':
+    unittest.main()
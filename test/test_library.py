@@ -0,0 +1,82 @@
+import unittest
+import shutil
+import tempfile
+import json
+import os.path
+import numpy as np
+from pybiosas import library, sas_utils
+
+class TestCurveLibrary(unittest.TestCase):
+
+    def setUp(self):
+        # A hand built library of Guinier curves over a grid of radii
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, 'guinier')
+        self.q = np.logspace(-3, 0, 100)
+        self.radii = library.grid_values([5.0, 200.0, 40, 'log'])
+        curves = np.exp(-np.outer(self.radii ** 2, self.q ** 2) / 5.0)
+        norms = curves.max(axis=1)
+        np.save(self.path + '.npy', curves / norms[:, np.newaxis])
+        np.save(self.path + '_params.npy', np.column_stack([self.radii, norms]))
+        f = open(self.path + '.json', 'w')
+        json.dump({'model' : 'guinier', 'names' : ['radius'],
+                   'q' : self.q.tolist(),
+                   'fixed' : [{'paramname' : 'sldSph', 'value' : 2e-6},
+                              {'paramname' : 'sldSolv', 'value' : 1e-6}]}, f)
+        f.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def testGridValues(self):
+        self.assertEqual(library.grid_values([1, 3, 3, 'lin']).tolist(),
+                         [1.0, 2.0, 3.0])
+        self.assertAlmostEqual(library.grid_values([1, 100, 3, 'log'])[1], 10.0)
+
+    def testNearest(self):
+        radius = self.radii[17]
+        q = np.linspace(0.002, 0.2, 300)
+        data = sas_utils.ExpSasData(q, 3.5 * np.exp(-(radius * q) ** 2 / 5.0)
+                                       + 0.01)
+        lib = library.CurveLibrary(self.path)
+        self.assertEqual(len(lib), 40)
+        residual, values = lib.nearest(data, k = 3)[0]
+        self.assertAlmostEqual(values['radius'], radius)
+        self.assertAlmostEqual(values['scale'], 3.5, places = 3)
+        self.assertAlmostEqual(values['background'], 0.01, places = 3)
+
+    def testSeedParameters(self):
+        radius = self.radii[5]
+        data = sas_utils.ExpSasData(self.q, 2.0 * np.exp(-(radius * self.q) ** 2 / 5.0))
+        lib = library.CurveLibrary(self.path)
+        start = [{'paramname' : 'radius', 'value' : 1.0},
+                 {'paramname' : 'scale', 'value' : 1.0, 'fixed' : True}]
+        seeds = library.seed_parameters(lib, data, start, k = 2)
+        self.assertEqual(len(seeds), 2)
+        self.assertAlmostEqual(seeds[0][0]['value'], radius)
+        self.assertEqual(seeds[0][1]['value'], 1.0)
+        self.assertEqual(seeds[0][2]['paramname'], 'background')
+
+    def testContrast(self):
+        radius = self.radii[5]
+        data = sas_utils.ExpSasData(self.q, 2.0 * np.exp(-(radius * self.q) ** 2 / 5.0))
+        lib = library.CurveLibrary(self.path)
+        start = [{'paramname' : 'sldSph', 'value' : 4e-6, 'fixed' : True},
+                 {'paramname' : 'sldSolv', 'value' : 1e-6, 'fixed' : True}]
+        seeds = library.seed_parameters(lib, data, start, k = 1)
+        values = dict([(par['paramname'], par['value']) for par in seeds[0]])
+        # Three times the contrast needs a ninth of the scale
+        self.assertAlmostEqual(values['scale'], 2.0 / 9, places = 4)
+        self.assertEqual(values['sldSph'], 4e-6)
+
+        self.assertEqual(lib.contrast_factor([]), 1.0)
+        self.assertRaises(ValueError, lib.contrast_factor,
+                          [{'paramname' : 'sldSph', 'value' : 1e-6}])
+        # The fit then runs from the given parameters alone
+        self.assertEqual(library.seed_parameters(lib, data,
+                             [{'paramname' : 'sldSph', 'value' : 1e-6}]), [])
+        self.assertRaises(ValueError, library.seed_parameters, lib, data,
+                          [], model = 'sphere')
+
+if __name__ == '__main__':
+    unittest.main()
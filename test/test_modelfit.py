@@ -30,6 +30,9 @@ class TestSimpleFits(unittest.TestCase):
 
     def testRegisteredModels(self):
         for model in iter(models.models):
+            if not models.models[model].get('test_data'):
+                print "\nSkipping", model + ": no test data"
+                continue
             self.setUp()
             self.args = self.default_args
             self.args['model'] = model
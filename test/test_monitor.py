@@ -0,0 +1,66 @@
+import unittest
+import time
+import numpy as np
+from pybiosas import modelling, monitor
+import standin
+
+class TestFitMonitor(unittest.TestCase):
+
+    def setUp(self):
+        self.model = standin.exponential()
+        self.q = np.linspace(0.0, 5.0, 50)
+        self.i = 3.0 * np.exp(-2.0 * self.q)
+        self.registered = {'test' : {}}
+
+    def fit(self, fit_monitor, scale=1.0, bounds=None):
+        parameters = [{'paramname' : 'scale', 'value' : scale,
+                       'bounds' : bounds or [None, None]},
+                      {'paramname' : 'rate', 'value' : 1.0}]
+        modelling.complete_parameters(self.model, parameters)
+        return parameters, modelling.fit_parameters(self.model, 'test',
+                                                    parameters, self.q, self.i,
+                                                    registered_models = self.registered,
+                                                    monitor = fit_monitor)
+
+    def testUnhindered(self):
+        fit_monitor = monitor.FitMonitor(timeout = 60, patience = 100,
+                                         check_bounds = True)
+        parameters, result = self.fit(fit_monitor, bounds = [0, None])
+        self.assertTrue(result[4])
+        self.assertFalse('aborted' in result[2])
+        self.assertAlmostEqual(parameters[0]['value'], 3.0, places=5)
+
+    def testStagnated(self):
+        parameters, result = self.fit(monitor.FitMonitor(patience = 2))
+        self.assertEqual(result[2]['aborted'], 'stagnated')
+        self.assertFalse(result[4])
+        self.assertEqual(result[1], None)
+        # The best values seen are kept
+        self.assertTrue(result[5] < np.sum((self.i - 1.0 *
+                                            np.exp(-self.q)) ** 2))
+
+    def testOutOfBounds(self):
+        fit_monitor = monitor.FitMonitor(check_bounds = True)
+        parameters, result = self.fit(fit_monitor, bounds = [0, 1.5])
+        self.assertEqual(result[2]['aborted'], 'out of bounds')
+        self.assertTrue(parameters[0]['value'] <= 1.5)
+
+    def testChecks(self):
+        fit_monitor = monitor.FitMonitor(check_bounds = True, collapse = 0.1)
+        fit_monitor.start([1.0], [[0, None]])
+        fit_monitor.check([0.5], np.ones(3))
+        self.assertRaises(monitor.FitAborted, fit_monitor.check, [0.05],
+                          np.ones(3))
+        self.assertRaises(monitor.FitAborted, fit_monitor.check, [0.5],
+                          np.array([np.nan]))
+
+        fit_monitor = monitor.FitMonitor(timeout = 0.01)
+        time.sleep(0.02)
+        try:
+            fit_monitor.check([1.0], np.ones(3))
+            self.fail("Fit not timed out")
+        except monitor.FitAborted, error:
+            self.assertEqual(error.reason, 'timeout')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import unittest
+import numpy as np
+from pybiosas import optimizers, modelling
+
+class TestOptimizers(unittest.TestCase):
+
+    def setUp(self):
+        # A Guinier curve with parameters of very different magnitude
+        self.q = np.linspace(0.005, 0.1, 200)
+        self.true = [2e-3, 40.0, 0.05]
+        self.i = self.guinier(self.true)
+
+    def guinier(self, p):
+        return p[0] * np.exp(-(self.q * p[1]) ** 2 / 3.0) + p[2]
+
+    def residuals(self, p):
+        return self.i - self.guinier(p)
+
+    def testBackendsConverge(self):
+        p0 = [1e-3, 30.0, 0.0]
+        bounds = [[0, None], [0, None], [None, None]]
+        x_scale = [1e-3, 10.0, 0.1]
+        for name in optimizers.optimizers:
+            out, cov_x, info, mesg, success = optimizers.minimise(name,
+                                                 self.residuals, p0,
+                                                 bounds = bounds,
+                                                 x_scale = x_scale)
+            self.assertTrue(success, name + ': ' + str(mesg))
+            self.assertTrue(info['nfev'] > 0)
+            self.assertEqual(cov_x.shape, (3, 3))
+            for fitted, expected in zip(out, self.true):
+                self.assertAlmostEqual(fitted, expected, places = 4)
+
+    def testBoundsRespected(self):
+        seen = []
+        def f(p):
+            seen.append(p[1])
+            return self.residuals(p)
+
+        optimizers.minimise('trf', f, [1e-3, 1.0, 0.0],
+                            bounds = [[0, None], [0, None], [None, None]])
+        optimizers.minimise('lmbounded', f, [1e-3, 1.0, 0.0],
+                            bounds = [[0, None], [0, None], [None, None]])
+        self.assertTrue(min(seen) >= 0)
+
+    def testBoundsTransformRoundTrip(self):
+        lower = np.array([0.0, -np.inf, 1.0, -np.inf])
+        upper = np.array([10.0, 5.0, np.inf, np.inf])
+        transform = optimizers.BoundsTransform(lower, upper)
+        p = np.array([3.0, -2.0, 7.0, 1e-6])
+        u = transform.to_internal(p)
+        for a, b in zip(transform.to_external(u), p):
+            self.assertAlmostEqual(a, b)
+
+    def testUnknownOptimizer(self):
+        self.assertRaises(ValueError, optimizers.minimise, 'simplex',
+                          self.residuals, [1.0, 1.0, 1.0])
+
+    def testDefaultScales(self):
+        registered = {'test' : {'param_info' : {'radius' : {'x_scale' : 10.0}}}}
+        for par, x_scale in [({'paramname' : 'radius', 'value' : 60.0}, 10.0),
+                             ({'paramname' : 'sldSolv', 'value' : -2e-6}, 2e-6),
+                             ({'paramname' : 'background', 'value' : 0.0}, 1.0),
+                             ({'paramname' : 'scale', 'value' : 0.01,
+                               'x_scale' : 0.1}, 0.1)]:
+            self.assertEqual(modelling.param_info('test', par, registered)[1],
+                             x_scale)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+import unittest
+import os
+import json
+import tempfile
+import numpy as np
+from pybiosas import modelling, process
+import standin
+
+class TestLeanOutput(unittest.TestCase):
+
+    def setUp(self):
+        self.load_model = modelling.load_model
+        modelling.load_model = lambda model: standin.line()
+        handle, self.path = tempfile.mkstemp(suffix='.json')
+        os.close(handle)
+        self.output = {'model' : 'line',
+                       'run'   : {'lean' : True},
+                       'fit'   : {'chi2'  : {'value' : 1.5},
+                                  'slope' : {'paramname' : 'slope',
+                                             'value'     : 2.0,
+                                             'stderr'    : 0.1}}}
+        f = open(self.path, 'w')
+        json.dump(self.output, f)
+        f.close()
+
+    def tearDown(self):
+        modelling.load_model = self.load_model
+        os.remove(self.path)
+
+    def testFittedParameters(self):
+        parameters = process.fitted_parameters(self.output)
+        self.assertEqual([par['paramname'] for par in parameters], ['slope'])
+
+    def testAddCurve(self):
+        process.add_curve(self.path, [0.1, 0.2])
+        output = json.load(open(self.path))
+        self.assertEqual(json.loads(output['data_out']['i']), [0.2, 0.4])
+        self.assertEqual(output['fit'], self.output['fit'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import unittest
+import numpy as np
+from pybiosas import ranking, modelling, models, sas_utils
+import standin
+
+class TestRanking(unittest.TestCase):
+
+    def testDefaults(self):
+        names = ranking.default_models()
+        self.assertTrue('sphere' in names)
+        self.assertFalse('hardsphere' in names)
+        self.assertFalse('sphere+cylinder' in names)
+        fixed = [par['paramname'] for par in ranking.default_parameters('sphere')
+                 if par.get('fixed')]
+        self.assertEqual(sorted(fixed), ['sldSolv', 'sldSph'])
+
+    def testRandomStarts(self):
+        start = ranking.default_parameters('ellipticalCylinder')
+        starts = ranking.random_starts('ellipticalCylinder', start, 4)
+        self.assertEqual(len(starts), 4)
+        self.assertEqual(starts[0], start)
+        for other in starts[1:]:
+            values = dict([(par['paramname'], par['value']) for par in other])
+            self.assertTrue(values['r_ratio'] >= 1)
+            self.assertEqual(values['sldCyl'], 4e-6)
+
+    def testInformationCriteria(self):
+        results = [{'model' : 'simple', 'chi2' : 110.0, 'k' : 2,
+                    'seconds' : 1.0, 'nfev' : 20},
+                   {'model' : 'complex', 'chi2' : 100.0, 'k' : 8,
+                    'seconds' : 3.0, 'nfev' : 80},
+                   {'model' : 'broken', 'seconds' : 0.0, 'nfev' : 0}]
+        ranking.information_criteria(results, 100, True)
+        self.assertEqual(results[0]['aic'], 114.0)
+        self.assertEqual(results[1]['aic'], 116.0)
+        self.assertAlmostEqual(results[0]['akaike_weight'] +
+                               results[1]['akaike_weight'], 1.0)
+        self.assertTrue(results[0]['akaike_weight'] > 0.5)
+        table = ranking.format_table(results)
+        self.assertTrue('broken' in table.splitlines()[-1])
+
+class TestRankModels(unittest.TestCase):
+
+    def setUp(self):
+        self.load_model = modelling.load_model
+        modelling.load_model = lambda model: getattr(standin, model)()
+        models.models['line'] = {}
+        models.models['exponential'] = {}
+        q = np.linspace(0.0, 2.0, 40)
+        i = 3.0 * np.exp(-2.0 * q)
+        self.data = sas_utils.ExpSasData(q, i, 0.01 * np.ones(40))
+        self.parameters = {'line'        : [{'paramname' : 'slope',
+                                             'value'     : -1.0},
+                                            {'paramname' : 'background',
+                                             'value'     : 1.0}],
+                           'exponential' : [{'paramname' : 'scale',
+                                             'value'     : 1.0},
+                                            {'paramname' : 'rate',
+                                             'value'     : 1.0}]}
+
+    def tearDown(self):
+        modelling.load_model = self.load_model
+        del models.models['line']
+        del models.models['exponential']
+
+    def testRankModels(self):
+        results = ranking.rank_models(self.data, ['line', 'exponential'],
+                                      self.parameters, nstarts = 2,
+                                      processes = 1)
+        self.assertEqual([result['model'] for result in results],
+                         ['exponential', 'line'])
+        best = dict([(par['paramname'], par['value'])
+                     for par in results[0]['parameters']])
+        self.assertAlmostEqual(best['scale'], 3.0, places = 5)
+        self.assertAlmostEqual(best['rate'], 2.0, places = 5)
+        self.assertEqual((results[0]['k'], results[0]['starts']), (2, 2))
+        self.assertTrue(results[0]['akaike_weight'] > 0.99)
+        self.assertTrue(results[1]['chi2'] > 1000)
+
+if __name__ == '__main__':
+    unittest.main()
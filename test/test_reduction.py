@@ -0,0 +1,93 @@
+import unittest
+import shutil
+import tempfile
+import os.path
+import numpy as np
+from pybiosas import reduction, sas_utils
+
+class TestReduction(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.q = np.linspace(0.01, 0.5, 50)
+        self.empty = sas_utils.ExpSasData(self.q, np.ones(50), 0.1 * np.ones(50))
+        self.background = sas_utils.ExpSasData(self.q, 3.0 * np.ones(50),
+                                               0.1 * np.ones(50))
+        self.sample = sas_utils.ExpSasData(self.q, 3.0 + 1.0 / self.q,
+                                           0.1 * np.ones(50))
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def testArithmetic(self):
+        diff = self.sample - self.background
+        self.assertTrue(np.allclose(diff.i, 1.0 / self.q))
+        self.assertTrue(np.allclose(diff.err, 0.1 * np.sqrt(2)))
+        self.assertTrue(isinstance(diff, sas_utils.ExpSasData))
+        scaled = 2 * self.sample
+        self.assertTrue(np.allclose(scaled.err, 0.2))
+
+    def testInterpolate(self):
+        q = (self.q[1:] + self.q[:-1]) / 2.0
+        half = self.background.interpolate(q)
+        self.assertTrue(np.allclose(half.i, 3.0))
+        self.assertTrue(np.allclose(half.err, 0.1 / np.sqrt(2)))
+        self.assertRaises(ValueError, self.background.interpolate, [1.0])
+
+    def testReduceFrame(self):
+        reduced = reduction.reduce_frame(self.sample, self.background,
+                                         self.empty, scale=2.0)
+        self.assertTrue(np.allclose(reduced.i, 2.0 / self.q))
+
+        # The empty cell is in both terms and its error cancels
+        exact = sas_utils.ExpSasData(self.q, 5.0 * np.ones(50),
+                                     np.zeros(50))
+        reduced = reduction.reduce_frame(exact, exact * 0.6, self.empty)
+        self.assertTrue(np.allclose(reduced.i, 2.0))
+        self.assertTrue(np.allclose(reduced.err, 0.0))
+        reduced = reduction.reduce_frame(exact, exact * 0.6, self.empty,
+                                         sample_norm=2.0)
+        self.assertTrue(np.allclose(reduced.i, 6.0))
+        self.assertTrue(np.allclose(reduced.err, 0.1))
+        reduced = reduction.reduce_frame(exact, empty=self.empty)
+        self.assertTrue(np.allclose(reduced.err, 0.1))
+
+        # Only the overlapping q range is kept
+        short = sas_utils.ExpSasData(self.q[10:], 3.0 * np.ones(40))
+        reduced = reduction.reduce_frame(self.sample, short)
+        self.assertEqual(len(reduced), 40)
+
+    def testReduceFiles(self):
+        paths = []
+        for name, data in [('bkg', self.background), ('a', self.sample),
+                           ('b', self.sample * 2)]:
+            paths.append(os.path.join(self.tempdir, name + '.dat'))
+            sas_utils.write_column_data(data, paths[-1])
+        outdir = os.path.join(self.tempdir, 'reduced')
+        done = reduction.reduce_files(paths[1:], outdir, background=paths[0],
+                                      norms={paths[2] : 0.5}, processes=1)
+        self.assertEqual([pair[0] for pair in done], paths[1:])
+        for path, out in done:
+            data = sas_utils.load_two_column_data(out, rows_to_skip=1)
+            self.assertTrue(np.allclose(data.i, 1.0 / self.q))
+
+    def testOutputCollisions(self):
+        for name in ['a/frame.dat', 'b/frame.dat', 'c/other.txt']:
+            path = os.path.join(self.tempdir, name)
+            os.makedirs(os.path.dirname(path))
+            sas_utils.write_column_data(self.sample, path)
+        a, b, c = [os.path.join(self.tempdir, name)
+                   for name in ['a/frame.dat', 'b/frame.dat', 'c/other.txt']]
+        outdir = os.path.join(self.tempdir, 'reduced')
+        self.assertRaises(ValueError, reduction.reduce_files, [a, b], outdir,
+                          processes = 1)
+        self.assertRaises(ValueError, reduction.reduce_files, [c],
+                          os.path.dirname(c), processes = 1)
+        self.assertRaises(ValueError, reduction.check_outputs, [a], outdir,
+                          [os.path.join(outdir, 'frame.txt')])
+        self.assertFalse(os.path.exists(outdir))
+        self.assertEqual(len(reduction.reduce_files([a, c], outdir,
+                                                    processes = 1)), 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import unittest
+import shutil
+import tempfile
+import os.path
+import numpy as np
+from pybiosas import sampler
+
+class TestEnsembleSampler(unittest.TestCase):
+
+    def setUp(self):
+        self.mean = np.array([1.0, -2.0])
+        self.std = np.array([0.5, 2.0])
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def log_prob(self, positions):
+        return -0.5 * np.sum(((positions - self.mean) / self.std) ** 2, axis=1)
+
+    def testGaussian(self):
+        ensemble = sampler.EnsembleSampler(self.log_prob, 2, 16,
+                                           chain_path = self.tempdir,
+                                           chunk = 64, seed = 1)
+        p0 = self.mean + 0.01 * np.random.RandomState(2).randn(16, 2)
+        ensemble.run(p0, 1500)
+        summary = ensemble.diagnostics(['a', 'b'], burn = 300)
+
+        self.assertTrue(0.2 < summary['acceptance_fraction'] < 0.9)
+        self.assertAlmostEqual(summary['params']['a']['median'], 1.0, places = 0)
+        self.assertAlmostEqual(summary['params']['b']['median'], -2.0, places = 0)
+        self.assertTrue(summary['params']['a']['rhat'] < 1.2)
+
+        chain = np.load(os.path.join(self.tempdir, 'chain.npy'))
+        self.assertEqual(chain.shape, (1500, 16, 2))
+        self.assertAlmostEqual(chain[300:, :, 1].std(), 2.0, places = 0)
+
+    def testRunAgain(self):
+        ensemble = sampler.EnsembleSampler(self.log_prob, 2, 16, seed = 1)
+        p0 = self.mean + 0.01 * np.random.RandomState(2).randn(16, 2)
+        position, lnprob = ensemble.run(p0, 200)
+        ensemble.run(position, 100)
+        self.assertEqual(ensemble.chain.shape, (100, 16, 2))
+        fraction = ensemble.acceptance_fraction()
+        self.assertTrue(np.all(fraction <= 1.0))
+        self.assertTrue(0.2 < np.mean(fraction) < 0.9)
+
+    def testWalkerCount(self):
+        self.assertRaises(ValueError, sampler.EnsembleSampler, self.log_prob, 2, 3)
+
+    def testIntegratedTimeIndependent(self):
+        x = np.random.RandomState(0).randn(4000, 4)
+        self.assertTrue(sampler.integrated_time(x) < 2.0)
+        self.assertAlmostEqual(sampler.gelman_rubin(x), 1.0, places = 1)
+
+if __name__ == '__main__':
+    unittest.main()
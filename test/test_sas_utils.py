@@ -0,0 +1,213 @@
+import unittest
+import os
+import os.path
+import tempfile
+import shutil
+import numpy as np
+from pybiosas import sas_utils
+
+class TestLoaders(unittest.TestCase):
+
+    def setUp(self):
+        if os.path.isfile('testdata.xml'):
+            self.test_data_dir = ''
+        elif os.path.isfile('test/testdata.xml'):
+            self.test_data_dir = 'test'
+        else:
+            print "Can't find data for test, run tests from root of package or test/"
+            raise IOError
+        self.tempfiles = []
+
+    def tearDown(self):
+        for path in self.tempfiles:
+            os.remove(path)
+            if os.path.exists(sas_utils.column_cache(path)):
+                os.remove(sas_utils.column_cache(path))
+
+    def write_temp(self, text):
+        handle, path = tempfile.mkstemp(suffix='.txt')
+        os.write(handle, text)
+        os.close(handle)
+        self.tempfiles.append(path)
+        return path
+
+    def testSasXMLUncertainties(self):
+        data = sas_utils.loadsasxml(os.path.join(self.test_data_dir,
+                                                 'testdata.xml'))
+        self.assertEqual(len(data.err), len(data))
+        self.assertAlmostEqual(data.q[0], 0.009)
+        self.assertAlmostEqual(data.err[0], 0.14)
+
+    def testThreeColumnData(self):
+        path = self.write_temp("q\ti\terr\n0.01\t10.0\t1.0\n0.02\t5.0\t0.5\n")
+        data = sas_utils.load_two_column_data(path, rows_to_skip=1)
+        self.assertEqual(len(data), 2)
+        self.assertEqual(data.err.tolist(), [1.0, 0.5])
+
+    def testTwoColumnData(self):
+        path = self.write_temp("q\ti\n0.01\t10.0\n0.02\t5.0\n")
+        data = sas_utils.load_two_column_data(path, rows_to_skip=1)
+        self.assertEqual(data.err, None)
+        self.assertEqual(data.i.tolist(), [10.0, 5.0])
+
+    def testSniffColumns(self):
+        path = self.write_temp("Created at DLS-I22\nrun 42\nq, i, err, dq\n"
+                               "0.01, 10.0, 1.0, 0.001\n0.02, 5.0, 0.5, 0.001\n")
+        self.assertEqual(sas_utils.sniff_columns(path), (3, ',', 4))
+        path = self.write_temp("# q i\n0.01 10.0\n\n0.02   5.0\n")
+        self.assertEqual(sas_utils.sniff_columns(path), (1, None, 2))
+
+    def testChunkedColumns(self):
+        rows = np.column_stack([np.linspace(0.01, 0.3, 1001),
+                                np.linspace(100.0, 1.0, 1001),
+                                np.linspace(1.0, 0.1, 1001)])
+        text = "q\ti\terr\n" + "".join(["%r\t%r\t%r\n" % tuple(row)
+                                         for row in rows])
+        path = self.write_temp(text)
+        columns = sas_utils.read_columns(path, chunk=100)
+        self.assertEqual(columns.shape, (3, 1001))
+        self.assertTrue(np.array_equal(columns.T, rows))
+
+        data = sas_utils.load_column_data(path)
+        self.assertTrue(os.path.exists(sas_utils.column_cache(path)))
+        cached = sas_utils.load_column_data(path)
+        self.assertTrue(np.array_equal(cached.err, data.err))
+        self.assertEqual(cached.dq, None)
+
+        loaded = sas_utils.load_files([path, self.write_temp(text)], 2)
+        self.assertTrue(np.array_equal(loaded[1].i, data.i))
+
+    def testCarriageReturns(self):
+        path = os.path.join(os.path.dirname(__file__), '..', 'data',
+                            'micelles', 'pei_ctab.dat')
+        data = sas_utils.load_column_data(path, cache=False)
+        self.assertEqual(len(data), 753)
+        self.assertAlmostEqual(data.q[0], 0.091302)
+        self.assertEqual(sas_utils.sniff_columns(path), (1, '\t', 3))
+
+
+class TestWeighting(unittest.TestCase):
+
+    def setUp(self):
+        self.data = sas_utils.ExpSasData([0.01, 0.02, 0.03],
+                                         [100.0, 4.0, 0.0],
+                                         [2.0, 0.0, 1.0])
+
+    def testErrors(self):
+        # zero uncertainty is replaced by the smallest valid value
+        self.assertEqual(self.data.sigma('errors').tolist(), [2.0, 1.0, 1.0])
+        self.assertEqual(self.data.sigma().tolist(), [2.0, 1.0, 1.0])
+
+    def testFallbacks(self):
+        self.assertEqual(self.data.sigma('poisson').tolist(), [10.0, 2.0, 2.0])
+        self.assertEqual(self.data.sigma('relative').tolist(), [100.0, 4.0, 4.0])
+        self.assertEqual(self.data.sigma('none').tolist(), [1.0, 1.0, 1.0])
+
+    def testAutoWithoutErrors(self):
+        data = sas_utils.ExpSasData([0.01, 0.02], [1.0, 2.0])
+        self.assertEqual(data.sigma().tolist(), [1.0, 1.0])
+        self.assertRaises(ValueError, data.sigma, 'errors')
+
+
+class TestRebin(unittest.TestCase):
+
+    def setUp(self):
+        self.q = np.logspace(-3, 0, 1000)
+        self.data = sas_utils.ExpSasData(self.q, 1.0 / self.q,
+                                         np.ones(1000))
+
+    def testLogRebin(self):
+        rebinned = self.data.log_rebin(50)
+        self.assertTrue(len(rebinned) <= 50)
+        self.assertTrue(len(rebinned) > 40)
+        self.assertTrue(np.all(np.diff(rebinned.q) > 0))
+        # twenty points per bin, so the error of the mean is 1/sqrt(20)
+        self.assertAlmostEqual(np.median(rebinned.err), 1.0 / np.sqrt(20),
+                               places = 2)
+        self.assertAlmostEqual(rebinned.q.min(), self.q[:10].mean(), places = 4)
+
+    def testNoRebinNeeded(self):
+        self.assertTrue(self.data.log_rebin(2000) is self.data)
+
+
+class TestMask(unittest.TestCase):
+
+    def setUp(self):
+        self.q = np.linspace(0.01, 0.5, 50)
+        self.data = sas_utils.ExpSasData(self.q, 1.0 / self.q, np.ones(50))
+
+    def testNoMask(self):
+        self.assertTrue(self.data.masked is self.data)
+
+    def testQRange(self):
+        self.data.mask_q_range(0.1, 0.3)
+        masked = self.data.masked
+        self.assertTrue(masked.q.min() >= 0.1)
+        self.assertTrue(masked.q.max() <= 0.3)
+        self.assertEqual(len(masked), self.data.mask.sum())
+        # a contiguous range is a view on the original arrays
+        self.assertTrue(np.may_share_memory(masked.i, self.data.i))
+        self.data.clear_mask()
+        self.assertTrue(self.data.masked is self.data)
+
+    def testRanges(self):
+        self.data.mask_ranges([[0.1, 0.2], [0.4, 0.45]])
+        q = self.data.masked.q
+        self.assertFalse(np.any((q >= 0.1) & (q <= 0.2)))
+        self.assertFalse(np.any((q >= 0.4) & (q <= 0.45)))
+        self.assertEqual(len(self.data.masked.err), len(q))
+
+    def testOutliers(self):
+        self.data.i[20] *= 50
+        self.data.mask_outliers(5.0)
+        self.assertFalse(self.data.mask[20])
+        self.assertEqual(len(self.data.masked), 49)
+
+    def testOutliersWithoutErrors(self):
+        random = np.random.RandomState(0)
+        data = sas_utils.ExpSasData(self.q, 1.0 + 0.01 * random.randn(50))
+        data.i[30] = 2.0
+        data.mask_outliers(5.0)
+        self.assertEqual(np.flatnonzero(~data.mask).tolist(), [30])
+
+class TestData2D(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, 'image.txt')
+        qx, qy = np.meshgrid(np.linspace(-0.1, 0.1, 21),
+                             np.linspace(-0.1, 0.1, 11))
+        self.qx = qx.ravel()
+        self.qy = qy.ravel()
+        i = 1.0 / (np.hypot(self.qx, self.qy) + 0.01)
+        np.savetxt(self.path, np.column_stack([self.qx, self.qy, i]),
+                   header='qx qy I')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def testLoad(self):
+        data = sas_utils.load_2d_data(self.path, shape=(11, 21), chunk=50)
+        self.assertEqual(len(data), 231)
+        self.assertTrue(np.allclose(data.qy, self.qy))
+        self.assertTrue(np.all(data.err == 0))
+        self.assertEqual(data.auto_weighting(), 'none')
+        self.assertEqual(data.path, self.path + '.npy')
+        # The sidecar is used the second time
+        self.assertTrue(isinstance(sas_utils.load_2d_data(self.path).data,
+                                   np.memmap))
+
+    def testMasks(self):
+        data = sas_utils.load_2d_data(self.path)
+        data.chunk = 40
+        data.mask_circle(0.0, 0.0, 0.02)
+        data.mask_q_range(qmax=0.1)
+        used = data.used()
+        q = np.hypot(self.qx[used], self.qy[used])
+        self.assertTrue(np.all(q > 0.02) and np.all(q <= 0.1))
+        data.mask_rectangle([-0.1, 0.1], [0.09, 0.1])
+        self.assertFalse(np.any(self.qy[data.used()] >= 0.09))
+        self.assertTrue(np.all(data.sigma('relative', used) > 0))
+
+if __name__ == '__main__':
+    unittest.main()
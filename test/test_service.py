@@ -0,0 +1,118 @@
+import unittest
+import threading
+import urllib2
+import json
+import time
+import numpy as np
+from pybiosas import service, modelling, models
+import standin
+
+def _slow(p, q):
+    time.sleep(p['seconds'])
+    return np.zeros(len(q))
+
+def _load_model(name):
+    if name == 'slow':
+        return standin.StandInModel(_slow, seconds=0.5)
+    if name == 'guinier':
+        return standin.guinier()
+    raise KeyError, name
+
+class TestService(unittest.TestCase):
+
+    def setUp(self):
+        # The workers are forked with the stand-in models in place
+        self.load_model = modelling.load_model
+        modelling.load_model = _load_model
+        models.models['guinier'] = {'exp_vals' : [{'paramname' : 'rg',
+                                                   'value'     : 30.0}]}
+        self.service = service.FitService(processes=1, max_queue=2)
+        self.server = service.ServiceServer(('127.0.0.1', 0), self.service)
+        self.url = 'http://127.0.0.1:%d' % self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.q = np.linspace(0.005, 0.1, 40)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.service.close()
+        modelling.load_model = self.load_model
+        del models.models['guinier']
+
+    def request(self, path, body=None):
+        if body is not None:
+            body = json.dumps(body)
+        try:
+            response = urllib2.urlopen(self.url + path, body)
+            return response.getcode(), json.load(response)
+        except urllib2.HTTPError, error:
+            return error.code, json.load(error)
+
+    def testModels(self):
+        code, body = self.request('/models')
+        self.assertEqual(code, 200)
+        self.assertTrue('radius' in body['sphere'])
+
+    def testCalculate(self):
+        code, body = self.request('/calculate',
+                                  {'model' : 'guinier', 'q' : self.q.tolist(),
+                                   'parameters' : [{'paramname' : 'rg',
+                                                    'value'     : 20.0}]})
+        self.assertEqual(code, 200)
+        expected = standin.guinier(rg = 20.0).evalDistribution(self.q)
+        self.assertTrue(np.allclose(body['i'], expected))
+
+    def testDefaultsRestored(self):
+        default = {'model' : 'guinier', 'q' : self.q.tolist()}
+        first = self.request('/calculate', default)[1]
+        code, body = self.request('/calculate',
+                                  {'model' : 'guinier', 'q' : self.q.tolist(),
+                                   'parameters' : [{'paramname' : 'rg',
+                                                    'value'     : 80.0}]})
+        self.assertEqual(code, 200)
+        self.assertFalse(np.allclose(body['i'], first['i']))
+        second = self.request('/calculate', default)[1]
+        self.assertEqual(second['i'], first['i'])
+
+    def testFit(self):
+        i = standin.guinier(scale = 3.0, rg = 25.0).evalDistribution(self.q)
+        code, body = self.request('/fit',
+                                  {'model' : 'guinier', 'q' : self.q.tolist(),
+                                   'i' : i.tolist(), 'err' : (0.01 * i).tolist(),
+                                   'parameters' : [{'paramname' : 'rg',
+                                                    'value'     : 20.0},
+                                                   {'paramname' : 'background',
+                                                    'value'     : 0.0,
+                                                    'fixed'     : True}]})
+        self.assertEqual(code, 200)
+        self.assertTrue(body['success'])
+        values = dict([(par['paramname'], par['value'])
+                       for par in body['parameters']])
+        self.assertAlmostEqual(values['rg'], 25.0, places = 4)
+        self.assertAlmostEqual(values['scale'], 3.0, places = 4)
+        self.assertTrue(body['chi2'] < 1e-6)
+
+    def testTimeout(self):
+        self.service.timeout = 0.1
+        code, body = self.request('/calculate', {'model' : 'slow',
+                                                 'q' : [0.1]})
+        self.assertEqual(code, 504)
+        # The worker is still busy with the job so its slot is held
+        self.assertFalse(self.service.slots.acquire(False))
+        time.sleep(1.0)
+        self.assertTrue(self.service.slots.acquire(False))
+        self.service.slots.release()
+        self.assertEqual(self.request('/metrics')[1]['calculate']['timeout'], 1)
+
+    def testErrors(self):
+        code, body = self.request('/calculate', {'model' : 'no-such-model',
+                                                 'q' : [0.1]})
+        self.assertEqual(code, 400)
+        self.assertEqual(self.request('/nowhere', {})[0], 404)
+        code, body = self.request('/metrics')
+        self.assertEqual(body['calculate']['error'], 1)
+
+if __name__ == '__main__':
+    unittest.main()
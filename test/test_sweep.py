@@ -0,0 +1,44 @@
+import unittest
+from pybiosas import sweep
+
+class TestCostModel(unittest.TestCase):
+
+    def setUp(self):
+        self.records = [{'task' : 0, 'model' : 'cyl', 'npoints' : 100,
+                         'start' : {'length' : 100.0}, 'seconds' : 1.0},
+                        {'task' : 1, 'model' : 'cyl', 'npoints' : 100,
+                         'start' : {'length' : 150.0}, 'seconds' : 3.0},
+                        {'task' : 2, 'model' : 'cyl', 'npoints' : 100,
+                         'start' : {'length' : 2000.0}, 'seconds' : 20.0},
+                        {'task' : 3, 'model' : 'cyl', 'npoints' : 100,
+                         'start' : {'length' : 5000.0}, 'seconds' : 30.0}]
+
+    def testRegions(self):
+        self.assertEqual(sweep.start_region({'b' : 0.0, 'a' : 150.0}),
+                         (('a', 2), ('b', None)))
+        self.assertEqual(sweep.start_region({'a' : 0.05}), (('a', -2),))
+
+    def testPredict(self):
+        model = sweep.CostModel(self.records)
+        self.assertEqual(model.predict('cyl', 100, {'length' : 120.0}), 2.0)
+        self.assertEqual(model.predict('cyl', 100, {'length' : 3000.0}), 25.0)
+        # Unseen region and size: the model's mean time per point
+        self.assertAlmostEqual(model.predict('cyl', 200, {'length' : 1.0}),
+                               27.0)
+        self.assertEqual(model.predict('sphere', 100, {'radius' : 1.0}),
+                         13.5)
+        self.assertEqual(sweep.CostModel().predict('cyl', 100, {}), 1.0)
+
+    def testChunks(self):
+        chunks = sweep.plan_chunks({0 : 1.0, 1 : 10.0, 2 : 0.5, 3 : 0.5}, 2.0)
+        self.assertEqual(chunks, [[1], [0, 2, 3]])
+        self.assertEqual(sweep.plan_chunks({0 : 1.0, 1 : 2.0}), [[1], [0]])
+
+    def testMakespan(self):
+        self.assertEqual(sweep.simulate_makespan([1, 1, 10], 2), 11)
+        self.assertEqual(sweep.simulate_makespan([10, 1, 1], 2), 10)
+        grid, cost, bound = sweep.makespan_report(self.records, 2)
+        self.assertEqual((grid, cost, bound), (33.0, 30.0, 30.0))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import unittest
+import os
+import os.path
+import tempfile
+import shutil
+import numpy as np
+from pybiosas import cli, tasktable, benchmark
+
+class TestTaskTable(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.bagpath = os.path.join(self.tempdir, 'bagout.sh')
+        self.fitset = cli.SingleModelFitSet()
+        self.fitset.params = [{'paramname' : 'radius',
+                               'value'     : [10.0, 20.0, 30.0]},
+                              {'paramname' : 'length',
+                               'value'     : [100.0, 200.0]},
+                              {'paramname' : 'sldSolv',
+                               'value'     : [1.0],
+                               'fixed'     : True}]
+        for arg, value in [('model', 'cylinder'), ('dataset', 'q32.txt'),
+                           ('outpath', 'output/'), ('bagpath', self.bagpath),
+                           ('progpath', 'modelling.py'), ('qmin', '0.01'),
+                           ('exclude', '[[0.1, 0.12]]')]:
+            self.fitset.set_arg(arg, value)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def testRoundTrip(self):
+        path = self.fitset.write_task_table(per_line = 4)
+        self.assertEqual(path, os.path.join(self.tempdir, 'bagout.tasks'))
+        header, values = tasktable.read_table(path)
+        self.assertEqual(header['ntasks'], 6)
+        self.assertEqual(values.shape, (6, 3))
+        self.assertEqual(values[3].tolist(), [20.0, 200.0, 1.0])
+
+        args = tasktable.task_args(header, values, 3)
+        self.assertEqual(args['outpath'], 'output/000003.json')
+        self.assertEqual(args['qmin'], 0.01)
+        self.assertEqual(args['exclude'], '[[0.1, 0.12]]')
+        self.assertEqual(args['parameters'][2], {'paramname' : 'sldSolv',
+                                                 'value'     : 1.0,
+                                                 'fixed'     : True})
+
+        lines = open(self.bagpath).readlines()
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[1].strip().endswith('--tasks 4:6'))
+
+        tasks = benchmark.read_bag(self.bagpath)
+        self.assertEqual(len(tasks), 6)
+        self.assertEqual(tasks[5]['parameters'][1]['value'], 200.0)
+        self.assertEqual(len(benchmark.read_bag(self.bagpath, 5)), 5)
+
+    def testRanges(self):
+        self.assertEqual(tasktable.parse_range('3', 10), [3])
+        self.assertEqual(tasktable.parse_range('8:', 10), [8, 9])
+        self.assertEqual(tasktable.parse_range(':2', 10), [0, 1])
+        self.assertRaises(IndexError, tasktable.parse_range, '10', 10)
+
+    def testNotATable(self):
+        path = os.path.join(self.tempdir, 'bag.tasks')
+        f = open(path, 'w')
+        f.write("python modelling.py fit -m sphere\n")
+        f.close()
+        self.assertRaises(ValueError, tasktable.read_table, path)
+
+    def testMaskedBagLine(self):
+        self.fitset.set_arg('model', 'cylinder*hardsphere')
+        self.fitset.write_bag()
+        line = open(self.bagpath).readline()
+        self.assertTrue(" -m 'cylinder*hardsphere' " in line)
+        tasks = benchmark.read_bag(self.bagpath, 1)
+        self.assertEqual(tasks[0]['model'], 'cylinder*hardsphere')
+        self.assertTrue(tasks[0]['parameters'].startswith('[{'))
+        self.assertTrue(tasks[0]['parameters'].endswith('}]'))
+
+if __name__ == '__main__':
+    unittest.main()
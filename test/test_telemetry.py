@@ -0,0 +1,58 @@
+import unittest
+import os
+import os.path
+import tempfile
+import shutil
+from pybiosas import telemetry
+
+class TestSweepTelemetry(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, 'sweep.prom')
+        self.progress = telemetry.SweepTelemetry(10, 4, self.path,
+                                                 quiet = True)
+        for record in [{'task' : 0, 'pid' : 11, 'cpu' : 0.5},
+                       {'task' : 1, 'pid' : 12, 'cpu' : 0.25,
+                        'error' : 'ImportError()'},
+                       {'task' : 2, 'pid' : 11, 'cpu' : 0.5,
+                        'aborted' : ['stagnated']}]:
+            self.progress.record(record)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def testCounts(self):
+        metrics = self.progress.metrics()
+        self.assertEqual([metrics[key] for key in ['completed', 'failed',
+                                                   'aborted', 'running',
+                                                   'queued']],
+                         [3, 1, 1, 4, 3])
+        self.assertTrue(metrics['fits_per_second'] > 0)
+        self.assertTrue(metrics['eta_seconds'] > 0)
+        self.assertEqual(sorted(metrics['worker_cpu_utilisation'].keys()),
+                         [11, 12])
+
+    def testPrometheus(self):
+        self.progress.write()
+        self.assertFalse(os.path.exists(self.path + '.tmp'))
+        lines = open(self.path).read().splitlines()
+        self.assertTrue('# TYPE pybiosas_sweep_tasks gauge' in lines)
+        self.assertTrue('pybiosas_sweep_tasks{state="failed"} 1.0' in lines)
+        self.assertTrue('pybiosas_sweep_tasks_total 10.0' in lines)
+        samples = [line for line in lines if not line.startswith('#')]
+        for line in samples:
+            name, value = line.rsplit(' ', 1)
+            float(value)
+        self.assertEqual(len([line for line in samples if 'pid=' in line]), 2)
+
+    def testFinished(self):
+        for task in range(3, 10):
+            self.progress.record({'task' : task})
+        metrics = self.progress.metrics()
+        self.assertEqual((metrics['running'], metrics['eta_seconds']),
+                         (0, 0.0))
+        self.assertTrue(self.progress.summary().startswith('10/10 done'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import unittest
+import numpy as np
+import scipy.stats
+from pybiosas import uncertainty, parallel, modelling, models, sas_utils
+import standin
+
+class TestProfileInterval(unittest.TestCase):
+
+    def testParabola(self):
+        values = np.linspace(-4, 4, 41)
+        chi2 = 10.0 + values ** 2
+        lower, upper = uncertainty.profile_interval(values, chi2, 0.0, 11.0)
+        self.assertAlmostEqual(lower, -1.0, places = 1)
+        self.assertAlmostEqual(upper, 1.0, places = 1)
+
+    def testOpenSide(self):
+        values = np.linspace(0, 4, 21)
+        chi2 = 10.0 + values ** 2
+        interval = uncertainty.profile_interval(values, chi2, 0.0, 11.0)
+        self.assertEqual(interval[0], None)
+        self.assertAlmostEqual(interval[1], 1.0, places = 1)
+
+class TestUncertaintyAnalysis(unittest.TestCase):
+
+    def setUp(self):
+        self.load_model = modelling.load_model
+        modelling.load_model = lambda model: standin.line()
+        models.models['line'] = {}
+        random = np.random.RandomState(1)
+        q = np.linspace(0.0, 1.0, 40)
+        i = 2.0 * q + 1.0 + random.normal(0.0, 0.1, 40)
+        self.data = sas_utils.ExpSasData(q, i, 0.1 * np.ones(40))
+        self.parameters = modelling.complete_parameters(standin.line(),
+                              [{'paramname' : 'slope', 'value' : 1.0},
+                               {'paramname' : 'background', 'value' : 0.0}])
+        result = modelling.fit_parameters(standin.line(), 'line',
+                                          self.parameters, q, i,
+                                          self.data.sigma('errors'))
+        self.cov_x = result[1]
+
+    def tearDown(self):
+        modelling.load_model = self.load_model
+        del models.models['line']
+
+    def testInProcessPool(self):
+        pool = parallel.ModelPool('line', self.parameters,
+                                  shared = {'extra' : 1}, processes = 1)
+        self.assertTrue(pool.pool is None)
+        self.assertEqual(parallel._state['extra'], 1)
+        parallel.ModelPool('line', self.parameters, processes = 1)
+        self.assertFalse('extra' in parallel._state)
+        self.assertEqual(parallel._state['model_func'].getParam('slope'),
+                         self.parameters[0]['value'])
+
+    def testBootstrapAndProfile(self):
+        analysis = uncertainty.UncertaintyAnalysis('line', self.parameters,
+                                                   self.data, 'errors',
+                                                   processes = 1)
+        best = dict([(par['paramname'], par['value'])
+                     for par in self.parameters])
+        cov = self.cov_x * analysis.residual_variance
+
+        boot = analysis.bootstrap(200)
+        self.assertEqual(boot['nsamples'], 200)
+        self.assertEqual(boot['params'], ['slope', 'background'])
+        for j, name in enumerate(boot['params']):
+            lower, upper = boot['intervals'][name]
+            self.assertTrue(lower < best[name] < upper)
+            # The spread of the refits matches the fit covariance
+            ratio = boot['cov'][j][j] / cov[j][j]
+            self.assertTrue(0.6 < ratio < 1.5, ratio)
+
+        # The profile of a linear model is a parabola, giving the
+        # covariance interval
+        profile = analysis.profile(41, cov)
+        half = np.sqrt(scipy.stats.chi2.ppf(0.95, 1) * np.diag(cov))
+        for j, name in enumerate(boot['params']):
+            self.assertEqual(len(profile[name]['values']), 41)
+            lower, upper = profile[name]['interval']
+            self.assertAlmostEqual(lower, best[name] - half[j],
+                                   delta = 0.01 * half[j])
+            self.assertAlmostEqual(upper, best[name] + half[j],
+                                   delta = 0.01 * half[j])
+        # The refits leave the pool's parameters untouched
+        self.assertEqual(analysis.pool.map(uncertainty._start_chi2, [None])[0],
+                         analysis.chisqr)
+        analysis.close()
+
+if __name__ == '__main__':
+    unittest.main()
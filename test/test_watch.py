@@ -0,0 +1,52 @@
+import unittest
+import shutil
+import tempfile
+import os.path
+from pybiosas import watch
+
+class TestFolderWatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def write(self, name, text='q\ti\n0.01\t1.0\n'):
+        f = open(os.path.join(self.tempdir, name), 'w')
+        f.write(text)
+        f.close()
+        return os.path.join(self.tempdir, name)
+
+    def testNewFiles(self):
+        old = self.write('old.txt')
+        watcher = watch.FolderWatcher(self.tempdir, '*.txt', settle=0.0,
+                                      existing=False)
+        new = self.write('frame001.txt')
+        self.write('notes.log')
+        # A file is only reported once it has been seen unchanged
+        self.assertEqual(watcher.poll(), [])
+        self.assertEqual(watcher.poll(), [new])
+        self.assertEqual(watcher.poll(), [])
+
+    def testChangingFile(self):
+        watcher = watch.FolderWatcher(self.tempdir, settle=0.0)
+        path = self.write('frame.txt')
+        watcher.poll()
+        self.write('frame.txt', 'q\ti\n0.01\t1.0\n0.02\t0.5\n')
+        self.assertEqual(watcher.poll(), [])
+        self.assertEqual(watcher.poll(), [path])
+
+    def testSkipsColumnCache(self):
+        watcher = watch.FolderWatcher(self.tempdir, settle=0.0)
+        path = self.write('frame001.txt')
+        watch.sas_utils.load_column_data(path)
+        self.assertTrue(os.path.exists(path + '.npy'))
+        self.write('frame002.npy')
+        watcher.poll()
+        self.assertEqual(sorted(watcher.poll()),
+                         [path, os.path.join(self.tempdir, 'frame002.npy')])
+        self.assertEqual(watcher.poll(), [])
+
+if __name__ == '__main__':
+    unittest.main()